@@ -0,0 +1,50 @@
+"""Benchmarks for the TensorFlow meta objects, unification and reification."""
+import tensorflow as tf
+
+from unification import var, unify, reify
+
+from etuples import etuple, etuplize
+
+from symbolic_pymc.meta import enable_lvar_defaults, metatize_cache_scope
+from symbolic_pymc.tensorflow.meta import mt, tf_metatize_cache
+
+from .graphs import tf_chain, tf_wide_sum
+
+
+class MetaSuite:
+    """Time the conversion of TensorFlow graphs to meta graphs and unification against them."""
+
+    # TensorFlow graphs are metatized recursively, so larger sizes can reach
+    # the recursion limit.
+    params = (["chain", "wide"], [5, 15, 30])
+    param_names = ["shape", "size"]
+
+    def setup(self, shape, size):
+        self.graph = tf.Graph()
+
+        with self.graph.as_default():
+            if shape == "chain":
+                self.y_tf = tf_chain(size)[1]
+            else:
+                self.y_tf = tf_wide_sum(size)[1]
+
+            self.y_mt = mt(self.y_tf)
+
+            with enable_lvar_defaults("names", "node_attrs"):
+                self.a_lv, self.b_lv = var(), var()
+                self.pattern_et = etuple(mt.add, self.a_lv, self.b_lv)
+
+        self.s = {self.a_lv: self.y_mt, self.b_lv: self.y_mt}
+
+    def time_metatize(self, shape, size):
+        tf_metatize_cache.clear()
+        with self.graph.as_default(), metatize_cache_scope():
+            mt(self.y_tf)
+
+    def time_unify_pattern(self, shape, size):
+        with self.graph.as_default():
+            unify(self.pattern_et, etuplize(self.y_mt), {})
+
+    def time_reify_pattern(self, shape, size):
+        with self.graph.as_default():
+            reify(self.pattern_et, self.s)
@@ -0,0 +1,169 @@
+"""Benchmarks for the Theano meta objects, unification, reification and rewrites."""
+import theano
+import theano.tensor as tt
+
+from unification import var, unify, reify
+
+from kanren import eq
+from kanren.core import lall
+
+from etuples import etuple, etuplize
+
+from theano.gof.opt import EquilibriumOptimizer
+from theano.gof.graph import inputs as tt_inputs
+
+from symbolic_pymc.meta import meta_reify_graph, metatize_cache_scope
+from symbolic_pymc.theano.meta import mt, TheanoMetaApply, TheanoMetaTensorVariable
+from symbolic_pymc.theano.opt import KanrenRelationSub, FunctionGraph
+from symbolic_pymc.theano.utils import optimize_graph
+from symbolic_pymc.theano.pymc3 import model_graph, logp
+
+from .graphs import (
+    theano_chain,
+    theano_wide_sum,
+    theano_distributive_graph,
+    theano_hmm,
+    pymc3_hierarchical_model,
+)
+
+
+def _theano_graph(shape, size):
+    if shape == "chain":
+        return theano_chain(size)[1]
+    else:
+        return theano_wide_sum(size)[1]
+
+
+class TheanoSuite:
+    """A base class for benchmarks that construct Theano graphs.
+
+    PyMC3 changes the global test value setting, so it's reset before every
+    benchmark.
+    """
+
+    def setup(self, *params):
+        theano.config.compute_test_value = "ignore"
+        self.setup_graphs(*params)
+
+
+class MetaSuite(TheanoSuite):
+    """Time the conversion of base graphs to meta graphs and back."""
+
+    params = (["chain", "wide"], [10, 100, 500])
+    param_names = ["shape", "size"]
+    number = 1
+    repeat = 10
+
+    def setup_graphs(self, shape, size):
+        self.y_tt = _theano_graph(shape, size)
+
+        # A meta graph without base objects, so that it needs to be reified
+        x_mt = mt(tt.vector("x"))
+        y_mt = x_mt
+        for i in range(size):
+            y_mt = TheanoMetaTensorVariable(
+                x_mt.type, TheanoMetaApply(mt.add, [y_mt, x_mt]), 0, None
+            )
+        self.y_mt = y_mt
+
+    def time_metatize(self, shape, size):
+        with metatize_cache_scope():
+            mt(self.y_tt)
+
+    def time_reify(self, shape, size):
+        meta_reify_graph(self.y_mt)
+
+
+class UnifySuite(TheanoSuite):
+    """Time unification and reification of meta graphs and `mt.*` patterns."""
+
+    params = (["chain", "wide"], [10, 100, 500])
+    param_names = ["shape", "size"]
+
+    def setup_graphs(self, shape, size):
+        y_tt = _theano_graph(shape, size)
+        self.y_mt = mt(y_tt)
+        self.y_clone_mt = mt(y_tt.owner.clone().default_output())
+
+        self.a_lv, self.b_lv = var(), var()
+        self.pattern_et = etuple(mt.add, self.a_lv, etuple(mt.exp, self.b_lv))
+        self.s = {self.a_lv: self.y_mt, self.b_lv: self.y_mt}
+
+    def time_unify_ground(self, shape, size):
+        unify(self.y_mt, self.y_clone_mt, {})
+
+    def time_unify_pattern(self, shape, size):
+        unify(self.pattern_et, etuplize(self.y_mt), {})
+
+    def time_reify_pattern(self, shape, size):
+        reify(self.pattern_et, self.s)
+
+    def time_reify_ground(self, shape, size):
+        reify(self.y_mt, self.s)
+
+
+def distributes(in_lv, out_lv):
+    A_lv, x_lv, b_lv = var(), var(), var()
+    return lall(
+        eq(etuple(mt.dot, A_lv, etuple(mt.add, x_lv, b_lv)), etuplize(in_lv)),
+        eq(etuple(mt.add, etuple(mt.dot, A_lv, x_lv), etuple(mt.dot, A_lv, b_lv)), out_lv),
+    )
+
+
+class KanrenRelationSubSuite(TheanoSuite):
+    """Time `KanrenRelationSub` rewrites under an `EquilibriumOptimizer`."""
+
+    params = [1, 5, 10]
+    param_names = ["depth"]
+    number = 1
+    repeat = 5
+    timeout = 300
+
+    def setup_graphs(self, depth):
+        y_tt = theano_distributive_graph(depth)
+        self.fgraph = FunctionGraph(tt_inputs([y_tt]), [y_tt], clone=True)
+        self.opt = EquilibriumOptimizer([KanrenRelationSub(distributes)], max_use_ratio=10)
+
+    def time_optimize(self, depth):
+        optimize_graph(self.fgraph, self.opt, in_place=True)
+
+
+class PyMC3Suite(TheanoSuite):
+    """Time the conversion of PyMC3 models into graphs and their log-likelihoods."""
+
+    params = [1, 10, 50]
+    param_names = ["n_groups"]
+    number = 1
+    repeat = 5
+    timeout = 300
+
+    def setup_graphs(self, n_groups):
+        self.model = pymc3_hierarchical_model(n_groups)
+        self.fgraph = model_graph(self.model)
+        self.rvs = [o.owner.inputs[1] for o in self.fgraph.outputs]
+
+    def time_model_graph(self, n_groups):
+        model_graph(self.model)
+
+    def time_logp(self, n_groups):
+        logp(*self.rvs)
+
+
+class ScanSuite(TheanoSuite):
+    """Time the metatization and log-likelihoods of `Scan` time series models."""
+
+    params = [10, 100]
+    param_names = ["n_steps"]
+    number = 1
+    repeat = 5
+    timeout = 300
+
+    def setup_graphs(self, n_steps):
+        self.Y_rv = theano_hmm(n_steps)
+
+    def time_metatize(self, n_steps):
+        with metatize_cache_scope():
+            mt(self.Y_rv)
+
+    def time_logp(self, n_steps):
+        logp(self.Y_rv)
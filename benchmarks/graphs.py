@@ -0,0 +1,120 @@
+"""Synthetic graphs of controllable size for the benchmarks."""
+import numpy as np
+
+
+def theano_chain(depth):
+    """Create a Theano graph consisting of a chain of `depth` alternating `Elemwise`s."""
+    import theano.tensor as tt
+
+    x_tt = tt.vector("x")
+    y_tt = x_tt
+    for i in range(depth):
+        y_tt = tt.exp(y_tt) if i % 2 else y_tt + 1.0
+
+    return x_tt, y_tt
+
+
+def theano_wide_sum(width):
+    """Create a Theano graph that sums `width` distinct input terms."""
+    import theano.tensor as tt
+
+    xs_tt = [tt.vector(f"x_{i}") for i in range(width)]
+    y_tt = xs_tt[0]
+    for x_tt in xs_tt[1:]:
+        y_tt = y_tt + tt.dot(x_tt, x_tt)
+
+    return xs_tt, y_tt
+
+
+def theano_distributive_graph(depth):
+    """Create a Theano graph of nested `A.dot(x + B.dot(...))` terms that can be distributed."""
+    import theano.tensor as tt
+
+    x_tt = tt.vector("x")
+    y_tt = x_tt
+    for i in range(depth):
+        A_tt = tt.matrix(f"A_{i}")
+        c_tt = tt.vector(f"c_{i}")
+        y_tt = A_tt.dot(c_tt + y_tt)
+
+    return y_tt
+
+
+def pymc3_hierarchical_model(n_groups):
+    """Create a PyMC3 hierarchical normal model with `n_groups` group-level random variables."""
+    import pymc3 as pm
+
+    rng = np.random.RandomState(23924)
+    y_obs = rng.normal(size=(n_groups, 10))
+
+    with pm.Model() as model:
+        mu = pm.Normal("mu", 0.0, 10.0)
+        tau = pm.HalfCauchy("tau", 5.0)
+        for i in range(n_groups):
+            theta_i = pm.Normal(f"theta_{i}", mu, tau)
+            pm.Normal(f"y_{i}", theta_i, 1.0, shape=10, observed=y_obs[i])
+
+    return model
+
+
+def theano_hmm(n_steps):
+    """Create a Theano `Scan` time series graph of a Gaussian hidden Markov model with `n_steps` steps."""
+    import theano
+    import theano.tensor as tt
+
+    from symbolic_pymc.theano.random_variables import CategoricalRV, DirichletRV, NormalRV
+
+    rng_tt = theano.shared(np.random.RandomState(1234), name="rng", borrow=True)
+    rng_tt.tag.is_rng = True
+    rng_tt.default_update = rng_tt
+
+    M = 2
+    mus_tt = tt.as_tensor_variable(
+        np.stack([np.arange(0.0, n_steps), np.arange(0.0, -n_steps, -1)], axis=-1)
+    )
+    sigmas_tt = tt.ones((n_steps,))
+
+    pi_0_rv = DirichletRV(tt.ones((M,)), rng=rng_tt, name="pi_0")
+    Gamma_rv = DirichletRV(tt.ones((M, M)), rng=rng_tt, name="Gamma")
+    S_0_rv = CategoricalRV(pi_0_rv, rng=rng_tt, name="S_0")
+
+    def scan_fn(mus_t, sigma_t, S_tm1, Gamma_t, rng):
+        S_t = CategoricalRV(Gamma_t[S_tm1], rng=rng, name="S_t")
+        Y_t = NormalRV(mus_t[S_t], sigma_t, rng=rng, name="Y_t")
+        return S_t, Y_t
+
+    (S_rv, Y_rv), _ = theano.scan(
+        fn=scan_fn,
+        sequences=[mus_tt, sigmas_tt],
+        non_sequences=[Gamma_rv, rng_tt],
+        outputs_info=[{"initial": S_0_rv, "taps": [-1]}, {}],
+        strict=True,
+        name="scan_rv",
+    )
+    Y_rv.name = "Y_rv"
+
+    return Y_rv
+
+
+def tf_chain(depth):
+    """Create a TensorFlow graph consisting of a chain of `depth` alternating operations."""
+    import tensorflow as tf
+
+    x_tf = tf.compat.v1.placeholder(tf.float64, name="x")
+    y_tf = x_tf
+    for i in range(depth):
+        y_tf = tf.exp(y_tf) if i % 2 else y_tf + tf.constant(1.0, dtype=tf.float64)
+
+    return x_tf, y_tf
+
+
+def tf_wide_sum(width):
+    """Create a TensorFlow graph that sums `width` distinct input terms."""
+    import tensorflow as tf
+
+    xs_tf = [tf.compat.v1.placeholder(tf.float64, name=f"x_{i}") for i in range(width)]
+    y_tf = xs_tf[0]
+    for x_tf in xs_tf[1:]:
+        y_tf = y_tf + x_tf * x_tf
+
+    return xs_tf, y_tf
@@ -1,18 +1,48 @@
+import threading
+
+from numbers import Number
+from contextlib import contextmanager
 from collections.abc import Mapping
 
 from cons.core import _car, _cdr, ConsError
 
 from kanren.term import arguments, operator
 
-from unification.variable import Var
-from unification.core import _reify, _unify, reify, unify
+from unification.variable import Var, var, isvar
+from unification.core import _reify, _unify, assoc, reify, unify, walk
 
 from etuples import etuple
+from etuples.core import ExpressionTuple
+
+from .meta import MetaSymbol, MetaVariable, metatize, meta_free_vars
+from .utils import PersistentMap
+
+
+_meta_reify_counts = threading.local()
 
-from .meta import MetaSymbol, MetaVariable
+
+@contextmanager
+def count_meta_reify_calls():
+    """Count the meta objects reified by `unification.reify` within this context.
+
+    Only reifications in the current thread are counted.  The yielded list's
+    only element is the running count; nested contexts add their counts to
+    the enclosing ones.
+    """
+    counts = [0]
+    _current_counts = getattr(_meta_reify_counts, "counts", None)
+    _meta_reify_counts.counts = counts
+    try:
+        yield counts
+    finally:
+        _meta_reify_counts.counts = _current_counts
+        if _current_counts is not None:
+            _current_counts[0] += counts[0]
 
 
 def unify_MetaSymbol(u, v, s):
+    if u is v:
+        return s
     if type(u) != type(v):
         return False
     if getattr(u, "__all_props__", False):
@@ -23,23 +53,256 @@ def unify_MetaSymbol(u, v, s):
         )
     elif u != v:
         return False
-    if s:
+    if s is not False:
         # If these two meta objects unified, and one has a logic
         # variable as its base object, consider the unknown base
         # object unified by the other's base object (if any).
         # This way, the original base objects can be recovered during
         # reification (preserving base object equality and such).
+        # `s` could be the caller's state, so it's extended with `assoc`
+        # instead of being changed in-place.
         if isinstance(u.obj, Var) and v.obj:
-            s[u.obj] = v.obj
+            s = assoc(s, u.obj, v.obj)
         elif isinstance(v.obj, Var) and u.obj:
-            s[v.obj] = u.obj
+            s = assoc(s, v.obj, u.obj)
     return s
 
 
 _unify.add((MetaSymbol, MetaSymbol, Mapping), unify_MetaSymbol)
 
+assoc.add((PersistentMap, object, object), lambda s, u, v: s.assoc(u, v))
+
+
+class MetaPattern(object):
+    """A meta object or etuple pattern compiled into a specialized unification function.
+
+    Generic `unify` dispatches on the types of every pair of sub-terms.  A
+    `MetaPattern` walks its pattern once, at construction, and produces a
+    function that checks a term's types, arities and ground sub-terms
+    directly and binds the pattern's logic variables in a single pass.
+    Sub-terms that the compiled function doesn't specialize on (e.g. a term of
+    a different type than its pattern) fall back to `unify`.
+
+    A `MetaPattern` can be used in place of its pattern in `eq` goals.
+
+    Since compiling a pattern is more expensive than unifying it once, the same
+    `MetaPattern` should be reused.  `MetaPattern.fresh` provides copies with
+    new logic variables, so that the compiled function can be shared by
+    relations that need distinct logic variables each time they're called.
+
+    """
+
+    __slots__ = ("_template", "_program", "_template_vars", "_renaming", "_pattern", "lvars")
+
+    def __init__(self, pattern):
+        self._template = pattern
+        self._pattern = pattern
+        self._renaming = None
+        slots = {}
+        self._program = _compile_pattern(pattern, slots, {})
+        self._template_vars = tuple(slots)
+        self.lvars = self._template_vars
+
+    def fresh(self):
+        """Return a copy of this pattern, and its compiled function, with new logic variables."""
+        res = object.__new__(type(self))
+        res._template = self._template
+        res._program = self._program
+        res._template_vars = self._template_vars
+        res.lvars = tuple(var() for _ in self._template_vars)
+        res._renaming = dict(zip(self._template_vars, res.lvars))
+        res._pattern = None
+        return res
+
+    @property
+    def pattern(self):
+        """Return the pattern term (with this copy's logic variables)."""
+        if self._pattern is None:
+            self._pattern = self.subpattern(self._template)
+        return self._pattern
+
+    def subpattern(self, term):
+        """Replace the template logic variables in a sub-term of the pattern with this copy's."""
+        if self._renaming is None:
+            return term
+        return reify(term, self._renaming)
+
+    def __getitem__(self, lvar):
+        """Return this copy's logic variable for a logic variable in the original pattern."""
+        if self._renaming is None:
+            if lvar not in self._template_vars:
+                raise KeyError(lvar)
+            return lvar
+        return self._renaming[lvar]
+
+    def match(self, term, s):
+        """Unify the pattern with a term; this is equivalent to `unify(self.pattern, term, s)`."""
+        return self._program(term, s, self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.pattern!r})"
+
+
+def _unify_MetaPattern(u, v, s):
+    if isinstance(u, MetaPattern):
+        if isinstance(v, MetaPattern):
+            v = v.pattern
+        return u.match(v, s)
+    return v.match(u, s)
+
+
+_unify.add((MetaPattern, object, Mapping), _unify_MetaPattern)
+_unify.add((object, MetaPattern, Mapping), _unify_MetaPattern)
+_unify.add((MetaPattern, Var, Mapping), _unify_MetaPattern)
+_unify.add((Var, MetaPattern, Mapping), _unify_MetaPattern)
+_unify.add((MetaPattern, MetaPattern, Mapping), _unify_MetaPattern)
+_reify.add((MetaPattern, Mapping), lambda o, s: _reify(o.pattern, s))
+
+
+def _is_ground_pattern(p):
+    if isvar(p):
+        return False
+    elif isinstance(p, MetaSymbol):
+        return not meta_free_vars(p)
+    elif isinstance(p, (tuple, list, ExpressionTuple)):
+        return all(_is_ground_pattern(e) for e in p)
+    return isinstance(p, (str, bytes, Number, type(None)))
+
+
+def _compile_pattern(p, slots, memo):
+    """Compile a pattern into a function with the signature `(term, s, pattern) -> s or False`.
+
+    `slots` collects the pattern's logic variables in order, and `memo` holds
+    the functions for already compiled sub-patterns.
+    """
+    if id(p) in memo:
+        return memo[id(p)][1]
+
+    if isvar(p):
+        slot = slots.setdefault(p, len(slots))
+
+        def match_var(t, s, pat):
+            u = walk(pat.lvars[slot], s)
+            if isvar(u):
+                if isvar(t):
+                    t = walk(t, s)
+                    if t == u:
+                        return s
+                return assoc(s, u, t)
+            return unify(u, t, s)
+
+        program = match_var
+
+    elif _is_ground_pattern(p):
+
+        def match_ground(t, s, pat):
+            if t is p:
+                return s
+            if isvar(t):
+                t = walk(t, s)
+                if isvar(t):
+                    return assoc(s, t, p)
+            if isinstance(p, MetaSymbol) and type(t) is type(p) and t == p:
+                return s
+            return unify(p, t, s)
+
+        program = match_ground
+
+    elif isinstance(p, MetaSymbol) and getattr(p, "__all_props__", False):
+        p_type = type(p)
+        props = p_type.__all_props__
+        prop_programs = [_compile_pattern(getattr(p, prop), slots, memo) for prop in props]
+        p_obj = p.obj
+        obj_slot = slots.setdefault(p_obj, len(slots)) if isvar(p_obj) else None
+        p_base = p_type.base if isinstance(p_type.base, type) else ()
+
+        def match_meta(t, s, pat):
+            if isvar(t):
+                t = walk(t, s)
+                if isvar(t):
+                    return assoc(s, t, pat.subpattern(p))
+
+            if isinstance(t, p_base):
+                # Base objects are unified as meta objects (e.g. see
+                # `symbolic_pymc.theano.dispatch`), so they can be matched
+                # directly, too.
+                t = metatize(t)
+
+            if type(t) is not p_type:
+                return unify(pat.subpattern(p), t, s)
+
+            for prop, prop_program in zip(props, prop_programs):
+                s = prop_program(getattr(t, prop), s, pat)
+                if s is False:
+                    return False
+
+            # See `unify_MetaSymbol`
+            if obj_slot is not None:
+                if t.obj:
+                    s = assoc(s, pat.lvars[obj_slot], t.obj)
+            elif isinstance(t.obj, Var) and p_obj:
+                s = assoc(s, t.obj, p_obj)
+
+            return s
+
+        program = match_meta
+
+    elif type(p) in (tuple, list, ExpressionTuple):
+        p_type = type(p)
+        p_len = len(p)
+        seq_types = (tuple, ExpressionTuple) if p_type is not list else (list,)
+        elem_programs = [_compile_pattern(e, slots, memo) for e in p]
+
+        def match_seq(t, s, pat):
+            if isvar(t):
+                t = walk(t, s)
+                if isvar(t):
+                    return assoc(s, t, pat.subpattern(p))
+
+            if type(t) not in seq_types:
+                if isinstance(t, MetaSymbol):
+                    # Meta objects never unify with sequences.
+                    return False
+                return unify(pat.subpattern(p), t, s)
+
+            if len(t) != p_len:
+                return False
+
+            for elem_program, e in zip(elem_programs, getattr(t, "_tuple", t)):
+                s = elem_program(e, s, pat)
+                if s is False:
+                    return False
+
+            return s
+
+        program = match_seq
+
+    else:
+        # Collect the logic variables, so that they're renamed in fresh copies.
+        if isinstance(p, MetaSymbol):
+            for lvar in meta_free_vars(p):
+                slots.setdefault(lvar, len(slots))
+
+        def match_other(t, s, pat):
+            return unify(pat.subpattern(p), t, s)
+
+        program = match_other
+
+    # Keep a reference to `p`, so that its `id` isn't reused.
+    memo[id(p)] = (p, program)
+    return program
+
 
 def _reify_MetaSymbol(o, s):
+    counts = getattr(_meta_reify_counts, "counts", None)
+    if counts is not None:
+        counts[0] += 1
+
+    # Skip objects that don't contain any of the substituted logic variables
+    # (e.g. ground sub-graphs).
+    if not any(v in s for v in meta_free_vars(o)):
+        return o
+
     if isinstance(o.obj, Var):
         # We allow reification of the base object field for
         # a meta object.
@@ -1,37 +1,56 @@
 import abc
 import types
+import weakref
 import reprlib
+import threading
 
 import numpy as np
 
 from copy import deepcopy
 from itertools import chain
-from functools import partial
+from functools import partial, wraps
 from collections import OrderedDict
 from contextlib import contextmanager
-from collections.abc import Iterator, Mapping, Sequence
+from collections.abc import Iterator, Mapping, Sequence, Set
 
 from unification import isvar, Var
+from unification.variable import _glv
 
 from etuples.core import ExpressionTuple
 
-from .utils import HashableNDArray
-
-from multipledispatch import dispatch
-
-from cachetools import cached
+from .utils import HashableNDArray, InstrumentedLRUCache, TypeDispatcher, _WeakCacheKey
 
 meta_repr = reprlib.Repr()
 meta_repr.maxstring = 100
 meta_repr.maxother = 100
 meta_repr.print_obj = False
 
-metatize_cache = {}
+metatize_cache = InstrumentedLRUCache(2 ** 12, weak_keys=True)
+
+meta_intern_table = weakref.WeakValueDictionary()
+
+dynamic_meta_types = {}
 
 _auto_reification_disabled = False
 _lvar_defaults_enabled = set()
 
 
+class _MetaModes(threading.local):
+    """The meta object modes set by `enable_meta_interning`, `enable_frozen_meta`, etc.
+
+    The modes are thread-local, so that contexts entered in one thread don't
+    affect the meta objects created in others.
+    """
+
+    meta_interning_enabled = False
+    weak_base_refs_enabled = False
+    frozen_meta_enabled = False
+    meta_reify_memo = None
+
+
+_meta_modes = _MetaModes()
+
+
 @contextmanager
 def disable_auto_reification():
     """Stop meta objects from automatically reifying themselves in order to determine unspecified properties."""
@@ -69,6 +88,140 @@ def enable_lvar_defaults(*types):
         _lvar_defaults_enabled = _current_value
 
 
+@contextmanager
+def enable_meta_interning():
+    """Hash-cons ground meta objects created within this context.
+
+    Structurally equal meta objects that contain no logic variables--and
+    refer to equal base objects (or none at all)--are reduced to a single
+    Python object, so that equality checks between them reduce to identity
+    checks.  The objects are held in the weak-valued `meta_intern_table`, so
+    interning doesn't extend their lifetimes.
+
+    Interned objects are shared, so they should be treated as immutable;
+    setting one of their properties removes them from the table.
+
+    The context only applies to the thread it's entered in.
+    """
+    _current_value = _meta_modes.meta_interning_enabled
+    _meta_modes.meta_interning_enabled = True
+    try:
+        yield
+    finally:
+        _meta_modes.meta_interning_enabled = _current_value
+
+
+@contextmanager
+def metatize_cache_scope(cache=None):
+    """Use a separate `metatize` cache within this context.
+
+    The default is a new, empty cache with the same size limit as the current
+    one.  The previous cache is restored, unchanged, on exit.
+
+    Parameters
+    ----------
+      cache: MutableMapping (optional)
+        The cache to use.
+    """
+    global metatize_cache
+    _current_value = metatize_cache
+
+    if cache is None:
+        cache = InstrumentedLRUCache(
+            getattr(_current_value, "maxsize", 2 ** 12),
+            weak_keys=getattr(_current_value, "weak_keys", True),
+        )
+
+    metatize_cache = cache
+    try:
+        yield cache
+    finally:
+        metatize_cache = _current_value
+
+
+def _metatize_cached(func):
+    """Cache the results of a single-argument `metatize` implementation in `metatize_cache`.
+
+    Unlike `cachetools.cached`, the cache is looked up on each call, so that it
+    can be replaced (e.g. by `metatize_cache_scope`).
+    """
+
+    @wraps(func)
+    def _cached_func(obj):
+        cache = metatize_cache
+        try:
+            return cache[obj]
+        except KeyError:
+            pass
+        except TypeError:
+            # The object isn't hashable.
+            return func(obj)
+
+        res = func(obj)
+
+        try:
+            cache[obj] = res
+        except ValueError:  # pragma: no cover
+            # The value is too large.
+            pass
+
+        return res
+
+    return _cached_func
+
+
+@contextmanager
+def enable_weak_base_refs():
+    """Only weakly reference the base objects of meta objects created within this context.
+
+    Meta objects normally keep their base objects--and, through them, entire
+    base graphs--alive.  Under this context, a base object that supports weak
+    references is dropped once nothing else refers to it; afterward, the meta
+    object's `obj` is `None`, and `MetaSymbol.reify` will construct a new base
+    object from the meta object's properties.
+
+    Meta types without properties (e.g. most meta `Op`s) can't reconstruct
+    their base objects, so they always hold strong references.
+
+    The context only applies to the thread it's entered in.
+    """
+    _current_value = _meta_modes.weak_base_refs_enabled
+    _meta_modes.weak_base_refs_enabled = True
+    try:
+        yield
+    finally:
+        _meta_modes.weak_base_refs_enabled = _current_value
+
+
+@contextmanager
+def enable_frozen_meta():
+    """Freeze the meta objects created within this context.
+
+    The properties of frozen meta objects can't be changed in-place; instead,
+    `MetaSymbol.evolve` produces updated copies that share the unchanged
+    properties.  Cached values (e.g. hash values) can still be computed
+    lazily, and a frozen meta object without a base object can still be
+    assigned the result of its reification.
+
+    This makes it safe to share meta objects (e.g. in global caches or between
+    threads) without defensive copies.  Like the other meta object modes, the
+    context only applies to the thread it's entered in, so the meta objects
+    that other threads create while it's active aren't frozen.
+    """
+    _current_value = _meta_modes.frozen_meta_enabled
+    _meta_modes.frozen_meta_enabled = True
+    try:
+        yield
+    finally:
+        _meta_modes.frozen_meta_enabled = _current_value
+
+
+class _WeakBaseRef(weakref.ref):
+    """A weak reference to a meta object's base object."""
+
+    __slots__ = ()
+
+
 def metatize(obj):
     """Convert object to base type then meta object."""
     if isvar(obj):
@@ -76,13 +229,16 @@ def metatize(obj):
     return _metatize(obj)
 
 
-@dispatch((type(None), types.FunctionType, partial, str, Mapping))
-def _metatize(obj):
+_metatize = TypeDispatcher("_metatize")
+
+
+@_metatize.register((type(None), types.FunctionType, partial, str, Mapping))
+def _metatize_identity(obj):
     return obj
 
 
 @_metatize.register((frozenset, tuple, ExpressionTuple))
-@cached(metatize_cache)
+@_metatize_cached
 def _metatize_hashable_Sequence(obj):
     """Convert elements of an iterable to meta objects."""
     return type(obj)([metatize(o) for o in obj])
@@ -107,14 +263,29 @@ def _metatize_HashableNDArray(obj):
 
 
 @_metatize.register(Iterator)
-@cached(metatize_cache)
+@_metatize_cached
 def _metatize_Iterator(obj):
     """Convert elements of an iterator to meta objects."""
     return iter([metatize(o) for o in obj])
 
 
 def meta_reify_iter(rands):
-    """Recursively reify an iterable object and return a boolean indicating the presence of un-reifiable objects, if any."""
+    """Recursively reify an iterable object and return a boolean indicating the presence of un-reifiable objects, if any.
+
+    When it isn't called within `meta_reify_graph`, the meta objects in
+    `rands` are first reified by `meta_reify_graph`, so that the
+    reification of each distinct sub-graph is memoized and iterative.
+    """
+    memo = _meta_modes.meta_reify_memo
+
+    if memo is None:
+        children = tuple(_meta_children(rands))
+        memo = meta_reify_graph(*children)._results if children else {}
+
+    return _meta_reify_iter(rands, memo)
+
+
+def _meta_reify_iter(rands, memo):
     any_unreified = False
     reified_rands = []
 
@@ -124,7 +295,11 @@ def meta_reify_iter(rands):
 
     for s in _rands:
         if isinstance(s, MetaSymbol):
-            rrand = s.reify()
+            memo_res = memo.get(id(s))
+            if memo_res is not None and memo_res[0] is s:
+                rrand = memo_res[1]
+            else:
+                rrand = s.reify()
             reified_rands.append(rrand)
             any_unreified |= isinstance(rrand, MetaSymbol)
             any_unreified |= isvar(rrand)
@@ -132,7 +307,7 @@ def meta_reify_iter(rands):
             reified_rands.append(s)
             any_unreified |= True
         elif isinstance(s, (list, tuple)):
-            _reified_rands, _any_unreified = meta_reify_iter(s)
+            _reified_rands, _any_unreified = _meta_reify_iter(s, memo)
             reified_rands.append(type(s)(_reified_rands))
             any_unreified |= _any_unreified
         else:
@@ -141,18 +316,417 @@ def meta_reify_iter(rands):
     return type(rands)(reified_rands), any_unreified
 
 
+def _meta_children(rands):
+    """Return the meta objects contained in rands--including nested sequences and maps."""
+    stack = [rands]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, MetaSymbol):
+            yield o
+        elif isinstance(o, (list, tuple)):
+            stack.extend(reversed(o))
+        elif isinstance(o, (Set, ExpressionTuple)):
+            stack.extend(reversed(tuple(o)))
+        elif isinstance(o, Mapping):
+            stack.extend(reversed(tuple(o.values())))
+
+
+class MetaReificationResults(Mapping):
+    """A read-only map from meta objects--by identity--to their reified values."""
+
+    __slots__ = ("_results",)
+
+    def __init__(self, results):
+        self._results = results
+
+    def __getitem__(self, key):
+        return self._results[id(key)][1]
+
+    def __iter__(self):
+        return (k for k, v in self._results.values())
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, key):
+        return id(key) in self._results
+
+
+def meta_reify_graph(*outputs):
+    """Reify a graph of meta objects iteratively, reifying each distinct meta object once.
+
+    The meta objects are reified in topological order, starting from the
+    meta objects with base objects, so that the recursive calls in
+    `MetaSymbol.reify` (and its overrides) only ever need to reach the
+    immediate--and already reified--children of a meta object.  This avoids
+    recursion limits for deep graphs and repeated reification of the shared
+    sub-graphs.  `MetaSymbol.reify` reaches its children through
+    `meta_reify_iter`, which uses this function, so the same applies to it.
+
+    Parameters
+    ----------
+      outputs: MetaSymbol
+        The meta objects to reify.
+
+    Returns
+    -------
+      A `MetaReificationResults` map, in topological order, from each meta
+      object in the graph to its reified value (i.e. a base object, or a meta
+      object when reification wasn't possible).  Meta objects are
+      distinguished by identity, so this doesn't involve any (potentially
+      recursive) hashing or equality checks.
+    """
+    results = OrderedDict()
+    visited = set()
+    stack = [(o, False) for o in reversed(outputs) if isinstance(o, MetaSymbol)]
+
+    # `meta_reify_iter` reuses these results while the meta objects are
+    # reified.
+    _current_memo = _meta_modes.meta_reify_memo
+    _meta_modes.meta_reify_memo = results
+    try:
+        while stack:
+            node, expanded = stack.pop()
+
+            if expanded:
+                results[id(node)] = (node, node.reify())
+                continue
+
+            if id(node) in visited:
+                continue
+
+            visited.add(id(node))
+
+            obj = node.obj
+            if obj is not None and not isvar(obj):
+                results[id(node)] = (node, obj)
+                continue
+
+            stack.append((node, True))
+
+            try:
+                rands = node.rands
+            except NotImplementedError:
+                continue
+
+            stack.extend((c, False) for c in reversed(tuple(_meta_children(rands))))
+    finally:
+        _meta_modes.meta_reify_memo = _current_memo
+
+    return MetaReificationResults(results)
+
+
 class MetaReificationError(Exception):
     """An exception type for errors encountered during the creation of base objects from meta objects."""
 
     pass
 
 
+class MetaFrozenError(AttributeError):
+    """An exception type for attempts to change the properties of frozen meta objects."""
+
+    pass
+
+
+class _MetaInternKey(object):
+    """A key for `meta_intern_table` that keeps the hash computed at creation.
+
+    Mutating an interned object's children would otherwise change the key's
+    hash and keep us from removing the (stale) entry.
+    """
+
+    __slots__ = ("key", "_hash", "__weakref__")
+
+    def __init__(self, key):
+        self.key = key
+        self._hash = hash(key)
+
+    def __eq__(self, other):
+        return self is other or (type(other) == type(self) and self.key == other.key)
+
+    def __hash__(self):
+        return self._hash
+
+
+def _meta_is_ground(rands):
+    """Determine whether or not a collection of meta object rands contains logic variables."""
+    stack = [rands]
+    while stack:
+        o = stack.pop()
+        if isvar(o):
+            return False
+        elif isinstance(o, MetaSymbol):
+            if getattr(o, "_intern_key", None) is not None:
+                # Only ground objects are interned.
+                continue
+            if isvar(o.obj):
+                return False
+            try:
+                stack.append(o.rands)
+            except NotImplementedError:
+                pass
+        elif isinstance(o, (tuple, list)):
+            stack.extend(o)
+
+    return True
+
+
+def _uninterned(obj):
+    """Remove a meta object from `meta_intern_table`, if it's the canonical instance."""
+    intern_key = getattr(obj, "_intern_key", None)
+    if intern_key is not None:
+        if meta_intern_table.get(intern_key) is obj:
+            del meta_intern_table[intern_key]
+        object.__setattr__(obj, "_intern_key", None)
+
+
+def _base_intern_key(base_obj):
+    """Return the part of an intern key that represents a base object.
+
+    Base objects are compared using their own equality, so objects that are
+    equal by value (e.g. `Op`s and `Type`s with equal properties) are interned
+    together, while objects that are only equal to themselves (e.g. graph
+    variables) keep their meta objects distinct.  The base objects are weakly
+    referenced, when possible, so that the keys don't keep them alive.
+    """
+    if base_obj is None:
+        return None
+
+    try:
+        return _WeakCacheKey(base_obj)
+    except TypeError:
+        # The base object can't be weakly referenced.
+        hash(base_obj)
+        return base_obj
+
+
+def _intern_meta(obj):
+    """Return the canonical, interned instance for a meta object."""
+    base_obj = obj.obj
+
+    if isvar(base_obj):
+        return obj
+
+    try:
+        rands = obj.rands
+    except NotImplementedError:
+        # Without properties, meta objects are only equal when their base
+        # objects are.
+        if base_obj is None:
+            return obj
+        rands = ()
+
+    if not _meta_is_ground(rands):
+        return obj
+
+    try:
+        key = _MetaInternKey((type(obj), rands, _base_intern_key(base_obj)))
+        existing = meta_intern_table.get(key)
+    except TypeError:
+        # Some rands (or the base object) aren't hashable.
+        return obj
+
+    if existing is not None:
+        return existing
+
+    object.__setattr__(obj, "_intern_key", key)
+    meta_intern_table[key] = obj
+
+    return obj
+
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def _hash_combine(seed, value):
+    """Combine a hash value into a seed hash value (i.e. Boost's `hash_combine` for 64-bit values)."""
+    return (
+        seed
+        ^ ((value & _HASH_MASK) + 0x9E3779B97F4A7C15 + ((seed << 6) & _HASH_MASK) + (seed >> 2))
+    ) & _HASH_MASK
+
+
+def _hash_rands(seed, rands):
+    """Compute a hash value for rands from the (cached) hash values of their elements."""
+    h = seed
+    for r in rands:
+        if type(r) is tuple:
+            r_hash = _hash_rands(len(r), r)
+        else:
+            r_hash = hash(r)
+        h = _hash_combine(h, r_hash)
+    return h
+
+
+def _prehash_meta_graph(obj):
+    """Compute and cache the hash values of an object's un-hashed meta descendants, children first.
+
+    This keeps the hash computations for a new meta graph from recursing
+    through the entire graph.
+    """
+    stack = [(obj, False)]
+    visited = set()
+
+    while stack:
+        node, expanded = stack.pop()
+
+        if expanded:
+            if node is not obj:
+                hash(node)
+            continue
+
+        if id(node) in visited:
+            continue
+
+        visited.add(id(node))
+        stack.append((node, True))
+
+        try:
+            rands = node.rands
+        except NotImplementedError:
+            continue
+
+        stack.extend((c, False) for c in _meta_children(rands) if getattr(c, "_hash", None) is None)
+
+
+def _register_dependent(obj):
+    """Register an object with the meta objects in its rands, so that their changes can reach it."""
+    try:
+        rands = obj.rands
+    except NotImplementedError:
+        return
+
+    obj_id = id(obj)
+    registries = []
+
+    def _unregister(ref):
+        # Remove the entries for a collected object, unless its `id` has
+        # since been reused by another dependent.
+        for dependents in registries:
+            if dependents.get(obj_id) is ref:
+                del dependents[obj_id]
+
+    obj_ref = None
+    for c in _meta_children(rands):
+        dependents = getattr(c, "_dependents", None)
+        if dependents is None:
+            dependents = {}
+            object.__setattr__(c, "_dependents", dependents)
+        if obj_ref is None:
+            obj_ref = weakref.ref(obj, _unregister)
+        registries.append(dependents)
+        dependents[obj_id] = obj_ref
+
+
+def _invalidate_dependents(obj):
+    """Clear the cached hash values of every meta object that (transitively) contains this one."""
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        dependents = getattr(node, "_dependents", None)
+
+        if not dependents:
+            continue
+
+        for parent_ref in tuple(dependents.values()):
+            parent = parent_ref()
+
+            # If a parent's hash and free variables aren't cached, then
+            # neither are those of its dependents (they were either
+            # invalidated or never computed).
+            if parent is None or (
+                getattr(parent, "_hash", None) is None
+                and getattr(parent, "_free_vars", None) is None
+            ):
+                continue
+
+            object.__setattr__(parent, "_hash", None)
+            object.__setattr__(parent, "_free_vars", None)
+            _uninterned(parent)
+            stack.append(parent)
+
+
+def meta_free_vars(obj):
+    """Return the logic variables in a meta object's rands and base objects (including descendants).
+
+    The results are cached on each meta object in the graph, and they're
+    invalidated in the same way as cached hash values.  Objects with no free
+    variables are ground, so reification and unification can skip them.
+
+    Results aren't cached while global logic variables are in use (i.e. within
+    `unification.variables`), since they can make any object a logic variable.
+
+    Parameters
+    ----------
+      obj: MetaSymbol
+        The meta object to search.
+
+    Returns
+    -------
+      A `frozenset` of logic variables.
+    """
+    use_cache = not _glv
+    results = {}
+
+    def _get_free_vars(o):
+        if use_cache:
+            return getattr(o, "_free_vars", None)
+        return results.get(id(o))
+
+    stack = [(obj, False)]
+
+    while stack:
+        node, expanded = stack.pop()
+
+        if _get_free_vars(node) is not None:
+            continue
+
+        try:
+            rands = node.rands
+        except NotImplementedError:
+            rands = ()
+
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((c, False) for c in _meta_children(rands) if _get_free_vars(c) is None)
+            continue
+
+        free_vars = set()
+
+        if isvar(node.obj):
+            free_vars.add(node.obj)
+
+        rands_stack = [rands]
+        while rands_stack:
+            o = rands_stack.pop()
+            if isvar(o):
+                free_vars.add(o)
+            elif isinstance(o, MetaSymbol):
+                free_vars.update(_get_free_vars(o))
+            elif isinstance(o, (list, tuple, Set, ExpressionTuple)):
+                rands_stack.extend(o)
+            elif isinstance(o, Mapping):
+                rands_stack.extend(o.keys())
+                rands_stack.extend(o.values())
+
+        free_vars = frozenset(free_vars)
+
+        if use_cache:
+            object.__setattr__(node, "_free_vars", free_vars)
+            _register_dependent(node)
+        else:
+            results[id(node)] = free_vars
+
+    return _get_free_vars(obj)
+
+
 class MetaSymbolType(abc.ABCMeta):
     def __new__(cls, name, bases, clsdict):
 
         # We need to track the cumulative slots, because subclasses can define
         # their own--yet we'll need to track changes across all of them.
-        slots = clsdict.get("__slots__", ())
+        # Python-reserved slots (e.g. `__weakref__`) aren't tracked.
+        slots = tuple(s for s in clsdict.get("__slots__", ()) if not s.startswith("__"))
         all_slots = tuple(
             OrderedDict.fromkeys(
                 chain(
@@ -172,14 +746,36 @@ class MetaSymbolType(abc.ABCMeta):
         if clsdict["__volatile_slots__"]:
 
             def reset(self):
+                # The object's structure is changing, so it can no longer
+                # be the canonical instance, and the hash values of the objects
+                # that contain it are no longer valid.
+                _uninterned(self)
+                _invalidate_dependents(self)
+
                 for s in self.__volatile_slots__:
-                    object.__setattr__(self, s, None)
+                    if s != "_frozen":
+                        object.__setattr__(self, s, None)
 
             clsdict["reset"] = reset
 
             def __setattr__(self, attr, obj):
                 """If a slot value is changed, reset cached slots."""
 
+                if getattr(self, "_frozen", False):
+                    if attr in getattr(self, "__all_props__", ()):
+                        raise MetaFrozenError(
+                            f"Cannot set {attr} on a frozen {type(self).__name__}; use `evolve`"
+                        )
+                    elif (
+                        attr == "_obj"
+                        and obj is not None
+                        and obj is not self.obj
+                        and not (self.obj is None or isvar(self.obj))
+                    ):
+                        raise MetaFrozenError(
+                            f"Cannot replace the base object of a frozen {type(self).__name__}"
+                        )
+
                 # Underscored-prefixed/volatile/stateful slots can be set
                 # without affecting other such slots.
                 if (
@@ -193,6 +789,28 @@ class MetaSymbolType(abc.ABCMeta):
                 ):
                     self.reset()
 
+                if (
+                    attr == "_obj"
+                    and getattr(self, "_free_vars", None) is not None
+                    and (isvar(obj) or isvar(self.obj))
+                ):
+                    # Logic variable base objects are free variables.
+                    object.__setattr__(self, "_free_vars", None)
+                    _invalidate_dependents(self)
+
+                if (
+                    attr == "_obj"
+                    and _meta_modes.weak_base_refs_enabled
+                    and obj is not None
+                    and getattr(self, "__all_props__", ())
+                    and not isvar(obj)
+                ):
+                    try:
+                        obj = _WeakBaseRef(obj)
+                    except TypeError:
+                        # The object doesn't support weak references.
+                        pass
+
                 object.__setattr__(self, attr, obj)
 
             clsdict["__setattr__"] = __setattr__
@@ -207,8 +825,11 @@ class MetaSymbolType(abc.ABCMeta):
         new_cls = super().__new__(cls, name, bases, clsdict)
 
         # Wrap the class implementation of `__hash__` with this value-caching
-        # code.
-        if "_hash" in clsdict["__volatile_slots__"]:
+        # code.  Classes that don't implement `__hash__` inherit a wrapped
+        # implementation.
+        if "_hash" in clsdict["__volatile_slots__"] and (
+            new_cls.__dict__.get("__hash__") is not None or not hasattr(new_cls, "_orig_hash")
+        ):
             _orig_hash = new_cls.__hash__
             new_cls._orig_hash = _orig_hash
 
@@ -216,24 +837,54 @@ class MetaSymbolType(abc.ABCMeta):
                 if getattr(self, "_hash", None) is not None:
                     return self._hash
 
-                # TODO: We could also descend into `__props__` and reset their
-                # `_hash` values, as well.
+                # Hash the sub-graph from the bottom up, then register this
+                # object with its children, so that changes to them will
+                # invalidate its hash value.
+                _prehash_meta_graph(self)
+
                 object.__setattr__(self, "_hash", _orig_hash(self))
 
+                _register_dependent(self)
+
                 return self._hash
 
             new_cls.__hash__ = _cached_hash
 
         return new_cls
 
+    def __call__(cls, *args, **kwargs):
+        res = super().__call__(*args, **kwargs)
+
+        meta_modes = _meta_modes
+
+        if meta_modes.meta_interning_enabled and isinstance(res, MetaSymbol):
+            res = _intern_meta(res)
+
+        if meta_modes.frozen_meta_enabled and isinstance(res, MetaSymbol):
+            res.freeze()
+
+        return res
+
 
 class MetaSymbol(metaclass=MetaSymbolType):
     """Meta objects for unification and such.
 
-    TODO: Should `MetaSymbol.obj` be an abstract property and a `weakref`?
+    The base object, `MetaSymbol.obj`, can be weakly referenced; see
+    `enable_weak_base_refs`.
+
+    TODO: Should `MetaSymbol.obj` be an abstract property?
     """
 
-    __slots__ = ("_obj", "_hash", "_rands")
+    __slots__ = (
+        "_obj",
+        "_hash",
+        "_rands",
+        "_intern_key",
+        "_dependents",
+        "_frozen",
+        "_free_vars",
+        "__weakref__",
+    )
 
     @property
     @abc.abstractmethod
@@ -243,7 +894,13 @@ class MetaSymbol(metaclass=MetaSymbolType):
 
     @property
     def obj(self):
-        return object.__getattribute__(self, "_obj")
+        obj = object.__getattribute__(self, "_obj")
+
+        if type(obj) is _WeakBaseRef:
+            # This is `None` when the base object has been garbage collected.
+            return obj()
+
+        return obj
 
     @classmethod
     def base_subclasses(cls):
@@ -276,6 +933,81 @@ class MetaSymbol(metaclass=MetaSymbolType):
 
         return self._rands
 
+    @property
+    def free_vars(self):
+        """Get the logic variables contained in this meta object.
+
+        See `meta_free_vars`.
+        """
+        return meta_free_vars(self)
+
+    def freeze(self):
+        """Prevent in-place changes to this object's properties; see `enable_frozen_meta`."""
+        object.__setattr__(self, "_frozen", True)
+        return self
+
+    def evolve(self, **changes):
+        """Return a copy of this object with the given properties changed.
+
+        Unchanged properties are shared with this object, and the copy is
+        frozen when this object is.  When nothing changes, the cached values
+        (and base object) are kept, as well.
+        """
+        cls = type(self)
+        all_props = getattr(cls, "__all_props__", ())
+
+        unknown_props = set(changes) - set(all_props)
+        if unknown_props:
+            raise TypeError(f"{cls.__name__} has no properties named {unknown_props}")
+
+        changed = any(getattr(self, k) is not v for k, v in changes.items())
+
+        res = object.__new__(cls)
+
+        for s in cls.__all_slots__:
+            if s == "_frozen":
+                continue
+            elif s in changes:
+                value = changes[s]
+            elif s in ("_intern_key", "_dependents") or (changed and s in cls.__volatile_slots__):
+                # These are either specific to the original object or--as
+                # `reset` would do after an in-place change--invalid.
+                value = None
+            else:
+                try:
+                    value = object.__getattribute__(self, s)
+                except AttributeError:
+                    continue
+
+            object.__setattr__(res, s, value)
+
+        if not changed:
+            # The copy shares cached values that depend on the children.
+            _register_dependent(res)
+
+        if _meta_modes.meta_interning_enabled:
+            res = _intern_meta(res)
+
+        if getattr(self, "_frozen", False):
+            res.freeze()
+
+        return res
+
+    def _refine(self, **changes):
+        """Change properties in-place or, when this object is frozen, in an evolved copy."""
+        changes = {k: v for k, v in changes.items() if getattr(self, k) is not v}
+
+        if not changes:
+            return self
+
+        if getattr(self, "_frozen", False):
+            return self.evolve(**changes)
+
+        for k, v in changes.items():
+            setattr(self, k, v)
+
+        return self
+
     def reify(self):
         """Attempt to create a concrete base object from this meta object.
 
@@ -289,7 +1021,7 @@ class MetaSymbol(metaclass=MetaSymbolType):
 
         This function will set any unspecified properties (e.g. dtype and shape
         values for the previous example), mutating the object in-place when
-        possible.  It will return a [refined/partially reified] meta object
+        possible (i.e. when the object isn't frozen).  It will return a [refined/partially reified] meta object
         when it can't fully reify to a base object (in which case, it will
         return the base object) or when partial reification results in a meta
         object from a subclass.
@@ -335,12 +1067,20 @@ class MetaSymbol(metaclass=MetaSymbolType):
         return not self.__eq__(other)
 
     def __hash__(self):
+        """Compute a structural hash value from the hash values of the rands.
+
+        The hash values of meta objects are cached, so this is a Merkle-style
+        hash: each object combines its children's cached values only once.
+        """
         try:
             rands = self.rands
         except NotImplementedError:  # pragma: no cover
             return NotImplemented
 
-        return hash((self.base, rands))
+        h = _hash_rands(hash(self.base), rands)
+
+        # Use a signed value within `sys.hash_info.width`.
+        return h - (1 << 64) if h >= (1 << 63) else h
 
     def __str__(self):
         return self.__repr__(show_obj=False, _repr=str)
@@ -463,6 +1203,39 @@ class MetaVariable(MetaSymbol):
         raise NotImplementedError()
 
 
+def dynamic_meta_type(meta_cls, obj_type, name=None):
+    """Return the meta type for `obj_type` derived from `meta_cls`, creating it only once.
+
+    Meta types are generated dynamically for base types that don't have an
+    explicitly implemented meta type (e.g. subclasses of a base `Op` type).
+    These types are cached in `dynamic_meta_types` and keyed on
+    `(meta_cls, obj_type)`, so that every instance of a base type shares the
+    same meta type.
+
+    Parameters
+    ----------
+    meta_cls: type
+        The meta type to subclass.
+    obj_type: type
+        The base type of the new meta type.
+    name: str (optional)
+        The name of the new meta type.  Defaults to `Meta<obj_type name>`.
+    """
+    key = (meta_cls, obj_type)
+    try:
+        return dynamic_meta_types[key]
+    except KeyError:
+        pass
+
+    if name is None:
+        name = f"Meta{obj_type.__name__}"
+
+    new_type = type(name, (meta_cls,), {"base": obj_type})
+    dynamic_meta_types[key] = new_type
+
+    return new_type
+
+
 def _find_meta_type(obj_type, meta_abs_type):
     cls = meta_abs_type
     obj_cls = None
@@ -496,15 +1269,13 @@ def _find_meta_type(obj_type, meta_abs_type):
             # SVD is just the base `TheanoMetaOp.__init__`, which doesn't account for those.
             # To do this correctly, we would need to dynamically metatize the underlying
             # `Op`'s `__init__` and so on.
-            new_type = type(f"Meta{obj_type.__name__}", (obj_cls,), {"base": obj_type})
-
-            return new_type
+            return dynamic_meta_type(obj_cls, obj_type)
         else:
             cls = obj_cls
 
 
 @_metatize.register(type)
-@cached(metatize_cache)
+@_metatize_cached
 def _metatize_type(obj_type):
     """Return an existing meta type/class, or create a new one."""
     for meta_type in MetaSymbol.__subclasses__():
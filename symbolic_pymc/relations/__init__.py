@@ -1,13 +1,236 @@
+from numbers import Number
+from types import BuiltinFunctionType, FunctionType
+
+from cons.core import ConsError
+
+from etuples import rator, rands
+from etuples.core import ExpressionTuple
+
 from kanren.facts import Relation
 
-from unification import unify, reify, Var
+from unification import unify, reify, Var, isvar
+
+from ..meta import MetaSymbol, MetaOp, meta_free_vars
+from ..dispatch import MetaPattern
+
+
+class _Arity(object):
+    """A discrimination tree key for a compound term with a given number of sub-terms."""
+
+    __slots__ = ("n",)
+
+    def __init__(self, n):
+        self.n = n
+
+    def __eq__(self, other):
+        return type(other) is _Arity and self.n == other.n
+
+    def __hash__(self):
+        return hash((_Arity, self.n))
+
+    def __repr__(self):
+        return f"_Arity({self.n})"
+
+
+_wildcard = object()
+_leaf = object()
+
+
+def term_key(term):
+    """Return the discrimination tree key of a term and its sub-terms.
+
+    Compound terms--i.e. meta variables, etuples and other `cons`-able
+    sequences--are keyed on their number of sub-terms, and their sub-terms are
+    the operator followed by the operands.  Ground meta objects are keyed
+    like compound terms, with their types as operators and their properties
+    as operands.  Other ground atoms are keyed on themselves.  Everything that might unify with more than its equals
+    (e.g. logic variables and meta objects containing them) is keyed by a
+    wildcard.
+
+    Parameters
+    ----------
+    term: object
+        The term to key.
+
+    Returns
+    -------
+    A tuple containing the key and a sequence of sub-terms (empty for atoms).
+
+    """
+    if isvar(term):
+        return _wildcard, ()
+
+    if not isinstance(term, (str, bytes)):
+        try:
+            term_rator, term_rands = rator(term), rands(term)
+        except (ConsError, NotImplementedError, AttributeError):
+            # `AttributeError`s are raised by meta variables with logic
+            # variable owners.
+            pass
+        else:
+            if not isinstance(term_rands, (tuple, list, ExpressionTuple)):
+                # An improper `cons` (e.g. one with a logic variable tail)
+                # could unify with any number of operands.
+                return _wildcard, ()
+
+            return _Arity(len(term_rands) + 1), (term_rator,) + tuple(term_rands)
+
+    if isinstance(term, MetaSymbol):
+        if meta_free_vars(term):
+            return _wildcard, ()
+
+        props = getattr(term, "__all_props__", None)
+
+        if props:
+            # Ground meta objects unify when their types and properties do
+            # (see `unify_MetaSymbol`), but their `__eq__` methods can also
+            # compare base objects, so they're keyed structurally.
+            return (
+                _Arity(len(props) + 1),
+                (type(term),) + tuple(getattr(term, prop) for prop in props),
+            )
+
+        if not isinstance(term, MetaOp):
+            # These are only compared by type during unification.
+            return type(term), ()
+
+        return term, ()
+
+    if isinstance(term, (str, bytes, Number, type(None), type, FunctionType, BuiltinFunctionType)):
+        return term, ()
+
+    return _wildcard, ()
+
+
+class DiscriminationTree(object):
+    """A term index that returns the stored values whose terms could unify with a query.
+
+    Each stored sequence of terms is flattened, in pre-order, into the keys
+    produced by `term_key`, and the values are kept in a trie over those keys.
+    A lookup only descends into the branches that match the query's operators
+    and ground atoms (or the stored terms' wildcards), so its cost depends on
+    the number of similar terms and not the total number of stored values.
+
+    The results are candidates: they still need to be unified with the query.
+
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, terms, value):
+        """Add a value keyed on a sequence of terms."""
+        node = self.root
+        stack = [tuple(terms)]
+
+        while stack:
+            term = stack.pop()
+            key, sub_terms = term_key(term)
+            node = node.setdefault(key, {})
+            stack.extend(reversed(sub_terms))
+
+        node.setdefault(_leaf, []).append(value)
+        self.size += 1
+
+    @staticmethod
+    def _skip(node, n):
+        """Return the nodes reached by skipping over `n` stored sub-terms."""
+        stack = [(node, n)]
+        while stack:
+            node, n = stack.pop()
+            if n == 0:
+                yield node
+                continue
+
+            for key, child in node.items():
+                if key is _leaf:
+                    continue
+
+                m = n - 1
+                if type(key) is _Arity:
+                    m += key.n
+
+                stack.append((child, m))
+
+    def candidates(self, terms):
+        """Return the values that were stored with terms that could unify with `terms`."""
+        results = {}
+        # The pending query sub-terms are kept in a linked list of pairs, so
+        # that branches can share them.
+        stack = [(self.root, (tuple(terms), None))]
+
+        while stack:
+            node, pending = stack.pop()
+
+            if pending is None:
+                results.update((id(v), v) for v in node.get(_leaf, ()))
+                continue
+
+            term, pending = pending
+            key, sub_terms = term_key(term)
+
+            if key is _wildcard:
+                stack.extend((child, pending) for child in self._skip(node, 1))
+                continue
+
+            wildcard_child = node.get(_wildcard)
+            if wildcard_child is not None:
+                stack.append((wildcard_child, pending))
+
+            child = node.get(key)
+            if child is not None:
+                for sub_term in reversed(sub_terms):
+                    pending = (sub_term, pending)
+                stack.append((child, pending))
+
+        return list(results.values())
+
+    def __len__(self):
+        return self.size
+
+
+class IndexedRelation(Relation):
+    """A `Relation` that uses a `DiscriminationTree` to find the facts that match a goal's arguments.
+
+    Facts are meta objects and etuples, so `Relation`'s exact-value index
+    doesn't help.  Instead, only the facts with compatible operators and
+    ground atoms are unified with a goal's arguments.  The facts are compiled
+    into `MetaPattern`s for that.
+
+    """
+
+    def __init__(self, name=None):
+        super().__init__(name=name)
+        self.term_index = DiscriminationTree()
+
+    def add_fact(self, *inputs):
+        fact = tuple(inputs)
+
+        if fact not in self.facts:
+            self.term_index.add(fact, MetaPattern(fact))
+
+        super().add_fact(*inputs)
+
+    def __call__(self, *args):
+        def goal(S):
+            args_rf = reify(args, S)
+
+            for fact_pattern in self.term_index.candidates(args_rf):
+                S_new = fact_pattern.match(args_rf, S)
+                if S_new is not False:
+                    yield S_new
+
+        return goal
 
 
 # Hierarchical models that we recognize.
-hierarchical_model = Relation("hierarchical")
+hierarchical_model = IndexedRelation("hierarchical")
 
 # Conjugate relationships
-conjugate = Relation("conjugate")
+conjugate = IndexedRelation("conjugate")
 
 
 def concat(a, b, out):
@@ -4,16 +4,18 @@ from unification import var
 from etuples import etuple
 
 from kanren import conde, eq
-from kanren.facts import fact, Relation
+from kanren.facts import fact
 
 from . import constant_neq
-from .. import concat
+from .. import concat, IndexedRelation
+from ...dispatch import MetaPattern
 from ...theano.meta import mt
+from ...theano.opt import relation_tracks
 
 
-derived_dist = Relation("derived_dist")
-stable_dist = Relation("stable_dist")
-generalized_gamma_dist = Relation("generalized_gamma_dist")
+derived_dist = IndexedRelation("derived_dist")
+stable_dist = IndexedRelation("stable_dist")
+generalized_gamma_dist = IndexedRelation("generalized_gamma_dist")
 
 uniform_mt = mt.UniformRV(var(), var(), size=var(), rng=var(), name=var())
 normal_mt = mt.NormalRV(var(), var(), size=var(), rng=var(), name=var())
@@ -22,6 +24,9 @@ halfcauchy_mt = mt.HalfCauchyRV(var(), var(), size=var(), rng=var(), name=var())
 gamma_mt = mt.GammaRV(var(), var(), size=var(), rng=var(), name=var())
 exponential_mt = mt.ExponentialRV(var(), size=var(), rng=var(), name=var())
 
+normal_pattern = MetaPattern(normal_mt)
+cauchy_pattern = MetaPattern(cauchy_mt)
+
 # TODO: Add constraints for different variations of this.  Also, consider a
 # check for exact equality of the two dists, or simply normalize/canonicalize
 # the graph first.
@@ -52,6 +57,7 @@ fact(
 #      None)
 
 
+@relation_tracks(mt.NormalRV, mt.CauchyRV)
 def scale_loc_transform(in_expr, out_expr):
     """Create relations for lifting and sinking scale and location parameters of distributions.
 
@@ -66,9 +72,9 @@ def scale_loc_transform(in_expr, out_expr):
 
     """
     # Scale and location transform expression "pattern" for a Normal term.
-    normal_mt = mt.NormalRV(var(), var(), size=var(), rng=var(), name=var())
-    n_name_lv = normal_mt.name
-    n_mean_lv, n_sd_lv, n_size_lv, n_rng_lv = normal_mt.owner.inputs
+    normal_pat = normal_pattern.fresh()
+    n_name_lv = normal_pat[normal_mt.name]
+    n_mean_lv, n_sd_lv, n_size_lv, n_rng_lv = [normal_pat[lv] for lv in normal_mt.owner.inputs]
     offset_name_mt = var()
     rct_norm_offset_mt = etuple(
         mt.add,
@@ -81,9 +87,9 @@ def scale_loc_transform(in_expr, out_expr):
     )
 
     # Scale and location transform expression "pattern" for a Cauchy term.
-    cauchy_mt = mt.CauchyRV(var(), var(), size=var(), rng=var(), name=var())
-    c_name_lv = cauchy_mt.name
-    c_mean_lv, c_beta_lv, c_size_lv, c_rng_lv = cauchy_mt.owner.inputs
+    cauchy_pat = cauchy_pattern.fresh()
+    c_name_lv = cauchy_pat[cauchy_mt.name]
+    c_mean_lv, c_beta_lv, c_size_lv, c_rng_lv = [cauchy_pat[lv] for lv in cauchy_mt.owner.inputs]
     rct_cauchy_offset_mt = etuple(
         mt.add,
         c_mean_lv,
@@ -111,14 +117,14 @@ def scale_loc_transform(in_expr, out_expr):
 
     rels = conde(
         [
-            eq(in_expr, normal_mt),
+            eq(in_expr, normal_pat),
             constant_neq(n_sd_lv, 1),
             constant_neq(n_mean_lv, 0),
             eq(out_expr, rct_norm_offset_mt),
             concat(n_name_lv, "_offset", offset_name_mt),
         ],
         [
-            eq(in_expr, cauchy_mt),
+            eq(in_expr, cauchy_pat),
             constant_neq(c_beta_lv, 1),
             # TODO: Add a positivity constraint for the scale.
             constant_neq(c_mean_lv, 0),
@@ -14,6 +14,7 @@ from kanren.constraints import neq
 from etuples import etuple, etuplize
 
 from ...theano.meta import mt
+from ...theano.opt import relation_tracks
 
 
 mt.nlinalg.qr_full = mt(QRFull("reduced"))
@@ -49,6 +50,7 @@ def normal_normal_regression(Y, X, beta, Y_args_tail=None, beta_args=None):
     return res
 
 
+@relation_tracks(mt.observed)
 def normal_qr_transform(in_expr, out_expr):
     """Produce a relation for normal-normal regression and its QR-reduced form.
 
@@ -333,10 +333,10 @@ class TFlowMetaNodeDef(TFlowMetaSymbol):
         res = super()._metatize(obj)
 
         if obj.op != "Const" and "node_attrs" in meta._lvar_defaults_enabled:
-            res.attr = var()
+            res = res.evolve(attr=var())
 
         if "names" in meta._lvar_defaults_enabled:
-            res.name = var()
+            res = res.evolve(name=var())
 
         return res
 
@@ -1030,17 +1030,17 @@ class TFlowMetaOperator(TFlowMetaSymbol, MetaOp):
 
                 res_var = metatize(tf_out)
 
+            # `metatize` could return shared (e.g. cached or frozen) objects,
+            # so we use updated copies instead of changing them in-place.
             if "names" in meta._lvar_defaults_enabled:
                 # This should also reset the NodeDef's `obj`
-                res_var.op.node_def.name = var()
-                res_var.op.reset()
-                res_var.reset()
+                node_def = res_var.op.node_def.evolve(name=var())
+                res_var = res_var.evolve(op=res_var.op.evolve(node_def=node_def))
 
             if "node_attrs" in meta._lvar_defaults_enabled:
                 # This should also reset the NodeDef's `obj`
-                res_var.op.node_def.attr = var()
-                res_var.op.reset()
-                res_var.reset()
+                node_def = res_var.op.node_def.evolve(attr=var())
+                res_var = res_var.evolve(op=res_var.op.evolve(node_def=node_def))
         else:
             #
             # If we're here, we have to create the meta objects manually.
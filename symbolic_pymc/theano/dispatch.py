@@ -4,7 +4,8 @@ from collections.abc import Mapping
 
 from kanren.term import term, operator, arguments
 
-from unification.core import _reify, _unify, reify
+from unification import isvar
+from unification.core import _reify, _reify_Var, _unify, _unify_Var_object, reify
 
 from cons.core import _car, _cdr
 
@@ -18,22 +19,29 @@ from ..dispatch import unify_MetaSymbol
 
 tt_class_abstractions = tuple(c.base for c in TheanoMetaSymbol.base_subclasses())
 
-_unify.add(
-    (TheanoMetaSymbol, tt_class_abstractions, Mapping),
-    lambda u, v, s: unify_MetaSymbol(u, metatize(v), s),
-)
-_unify.add(
-    (tt_class_abstractions, TheanoMetaSymbol, Mapping),
-    lambda u, v, s: unify_MetaSymbol(metatize(u), v, s),
-)
-_unify.add(
-    (tt_class_abstractions, tt_class_abstractions, Mapping),
-    lambda u, v, s: unify_MetaSymbol(metatize(u), metatize(v), s),
-)
+
+def _unify_TheanoClasses(u, v, s):
+    u, v = metatize(u), metatize(v)
+
+    if isvar(u) or isvar(v):
+        # Theano objects can be logic variables (e.g. `KanrenRelationSub`'s
+        # `relation_lvars`), and `metatize` leaves those as they are.
+        return _unify_Var_object(u, v, s)
+
+    return unify_MetaSymbol(u, v, s)
+
+
+_unify.add((TheanoMetaSymbol, tt_class_abstractions, Mapping), _unify_TheanoClasses)
+_unify.add((tt_class_abstractions, TheanoMetaSymbol, Mapping), _unify_TheanoClasses)
+_unify.add((tt_class_abstractions, tt_class_abstractions, Mapping), _unify_TheanoClasses)
 
 
 def _reify_TheanoClasses(o, s):
     meta_obj = metatize(o)
+
+    if isvar(meta_obj):
+        return _reify_Var(meta_obj, s)
+
     return reify(meta_obj, s)
 
 
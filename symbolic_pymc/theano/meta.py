@@ -137,9 +137,10 @@ class TheanoMetaOp(MetaOp, TheanoMetaSymbol, metaclass=TheanoMetaOpType):
 
     def __new__(cls, *args, obj=None, **kwargs):
 
-        # Create a new class for any subclasses so that we can refine the call
-        # signature--without having to construct a signature for every instance.
-        # `metatize` should pick up the new class hereafter.
+        # Use a distinct class for any subclasses so that we can refine the
+        # call signature--without having to construct a signature for every
+        # instance.  These classes are only created once per `Op` type, and
+        # `metatize` should pick them up hereafter.
 
         if obj is not None:
             obj_type = type(obj)
@@ -151,18 +152,13 @@ class TheanoMetaOp(MetaOp, TheanoMetaSymbol, metaclass=TheanoMetaOpType):
 
             if obj_type != cls.base:
 
-                new_type = type(
-                    obj_type.__name__,
-                    (cls,),
-                    {"base": obj_type, "_op_sig": inspect.signature(obj.make_node)},
-                )
-
-                res = super().__new__(new_type)
+                new_type = meta.dynamic_meta_type(cls, obj_type, name=obj_type.__name__)
 
                 # Make sure that dispatch is aware of this new type
-                meta._metatize.add((obj_type,), res._metatize)
+                if (obj_type,) not in meta._metatize.funcs:
+                    meta._metatize.add((obj_type,), new_type._metatize)
 
-                return res
+                return super().__new__(new_type)
 
         res = super().__new__(cls)
         return res
@@ -240,7 +236,9 @@ class TheanoMetaOp(MetaOp, TheanoMetaSymbol, metaclass=TheanoMetaOpType):
                 # possible.
                 if TheanoMetaSymbol.is_meta(name):
                     # This should also invalidate `res_var.obj`.
-                    res_var.name = name
+                    # We use a copy, because `metatize` could return a shared
+                    # (e.g. interned or frozen) object.
+                    res_var = res_var.evolve(name=name)
                     # Allow the base object to be unified, so that reification
                     # can recover the underlying object--instead of recreating
                     # it and sacrificing equality.
@@ -248,7 +246,7 @@ class TheanoMetaOp(MetaOp, TheanoMetaSymbol, metaclass=TheanoMetaOpType):
 
                 elif tt_out.name != name:
                     tt_out.name = name
-                    res_var.name = name
+                    res_var = res_var.evolve(name=name)
 
         else:
             # XXX: It's not always clear how `Op.make_node` arguments map to
@@ -439,6 +437,10 @@ class TheanoMetaVariable(MetaVariable, TheanoMetaSymbol):
         tt_apply = self.owner.obj
 
         if tt_apply and not isvar(tt_apply):
+            # Refinements are made in-place, unless this object is frozen, in
+            # which case `refined` is a refined copy.
+            refined = self
+
             # If the owning `Apply` reified, then one of its `outputs`
             # corresponds to this variable.  Our `self.index` value should
             # tell us which, but, when that's not available, we can
@@ -448,11 +450,11 @@ class TheanoMetaVariable(MetaVariable, TheanoMetaSymbol):
                 # Make sure we didn't have a mismatched non-meta index value.
                 assert isvar(self.index) or self.index is None or self.index == 0
                 # Set/replace `None` or meta value
-                self.index = 0
+                refined = refined._refine(index=0)
             elif self.index is None or isvar(self.index):
                 try:
                     tt_var = tt_apply.default_output()
-                    self.index = tt_apply.outputs.index(tt_var)
+                    refined = refined._refine(index=tt_apply.outputs.index(tt_var))
                 except AttributeError:
                     # This an undesirable scenario, because we have to
                     # determine/guess which base object in `self.outputs`
@@ -479,7 +481,7 @@ class TheanoMetaVariable(MetaVariable, TheanoMetaSymbol):
                                         # variable
                                         return o
                                     else:
-                                        self.index = i
+                                        refined = refined._refine(index=i)
                                 else:
                                     # This output matches but, because it's a
                                     # more specific type/class, we can't simply
@@ -488,7 +490,7 @@ class TheanoMetaVariable(MetaVariable, TheanoMetaSymbol):
                                     if not isvar(self.index):
                                         # Same here: we don't want overwrite
                                         # the logic variable
-                                        self.index = i
+                                        refined = refined._refine(index=i)
                                     return o
                                 break
                     else:
@@ -499,11 +501,11 @@ class TheanoMetaVariable(MetaVariable, TheanoMetaSymbol):
             # If our name value is not set/concrete, then use the reified
             # value's.  Otherwise, use ours.
             if isvar(self.name) or self.name is None:
-                self.name = tt_var.name
+                refined = refined._refine(name=tt_var.name)
             else:
                 tt_var.name = self.name
             assert tt_var is not None
-            self._obj = tt_var
+            refined._obj = tt_var
             return tt_var
 
         return super().reify()
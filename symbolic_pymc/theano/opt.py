@@ -1,261 +1,2752 @@
+import os
+import time
 import types
+import weakref
 
 import numpy as np
 
 import theano
+import theano.scalar as ts
 import theano.tensor as tt
 
 from copy import copy
+from bisect import bisect_left
+from warnings import warn
 from functools import wraps
+from contextlib import ExitStack
+from itertools import chain, islice, product
 from unittest.mock import patch
-from collections import namedtuple, OrderedDict
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from theano.gof.opt import (
+    EquilibriumOptimizer,
+    LocalOptimizer,
+    NavigatorOptimizer,
+    local_optimizer,
+)
+from theano.gof.graph import clone_get_equiv, inputs as tt_inputs, io_toposort
+from theano.scalar import basic_scipy
+from theano.scan_module.scan_op import Scan
+from theano.scan_module.scan_utils import scan_args, clone as tt_clone
+
+from unification import var, variables
+
+from kanren.facts import Relation
+
+from etuples.core import ExpressionTuple
+
+from .meta import MetaSymbol, TheanoMetaOp, TheanoMetaVariable
+from .ops import RandomVariable
+from .. import meta as base_meta
+from .. import dispatch as meta_dispatch
+from ..meta import meta_reify_graph, metatize
+from ..utils import InstrumentedLRUCache, run
+
+
+def eval_and_reify_meta(x):
+    """Get Theano objects from combinations of `etuple`s and meta objects."""
+    res = x
+
+    # Create base objects from the resulting meta object
+    if isinstance(res, ExpressionTuple):
+        res = res.eval_obj
+
+    if isinstance(res, MetaSymbol):
+        # Reify the entire graph from the bottom up, so that `res.reify` won't
+        # need to recurse.
+        meta_reify_graph(res)
+        res = res.reify()
+
+    if MetaSymbol.is_meta(res):
+        raise ValueError("Kanren results not fully reifiable: {}".format(res))
+
+    return res
+
+
+def safe_index(lst, x):
+    try:
+        return lst.index(x)
+    except ValueError:
+        return None
+
+
+def _list_mutator(method):
+    @wraps(method)
+    def _mutator(self, *args, **kwargs):
+        res = method(self, *args, **kwargs)
+        self._changed()
+        return res
+
+    return _mutator
+
+
+class IndexedList(list):
+    """A list that keeps a map of the positions of its elements.
+
+    Membership tests, `index`, `replace` and `remove` take time proportional
+    to the number of occurrences of their elements (and, for `remove`, the
+    number of elements after the removed one).  The map is updated by
+    `append`, `replace` and `remove`, and rebuilt--lazily--after other
+    changes.  `version` is incremented by every change.
+
+    Unhashable elements (e.g. nested lists) aren't in the map, so they're
+    found by linear scans.
+
+    """
+
+    version = 0
+    _positions = None
+
+    @property
+    def positions(self):
+        """Map the hashable elements to the (ascending) lists of their positions."""
+        if self._positions is None:
+            positions = {}
+            for n, v in enumerate(self):
+                try:
+                    positions.setdefault(v, []).append(n)
+                except TypeError:
+                    pass
+            self._positions = positions
+        return self._positions
+
+    def _changed(self, positions=None):
+        """Record a change, along with the updated map of positions, if it's known."""
+        self.version += 1
+        self._positions = positions
+
+    def __copy__(self):
+        return type(self)(self)
+
+    def __contains__(self, x):
+        try:
+            return x in self.positions
+        except TypeError:
+            return super().__contains__(x)
+
+    def index(self, x, *args):
+        if args:
+            return super().index(x, *args)
+
+        try:
+            return self.positions[x][0]
+        except KeyError:
+            raise ValueError(f"{x} is not in list")
+        except TypeError:
+            return super().index(x)
+
+    def append(self, x):
+        super().append(x)
+        positions = self._positions
+        if positions is not None:
+            try:
+                positions.setdefault(x, []).append(len(self) - 1)
+            except TypeError:
+                pass
+        self._changed(positions)
+
+    def replace(self, old, new):
+        """Replace every occurrence of `old` with `new`."""
+        positions = self.positions
+
+        try:
+            old_pos = positions.pop(old)
+        except KeyError:
+            raise ValueError(f"{old} is not in list")
+        except TypeError:
+            old_pos = [n for n, v in enumerate(self) if v == old]
+            if not old_pos:
+                raise ValueError(f"{old} is not in list")
+
+        for n in old_pos:
+            super().__setitem__(n, new)
+
+        try:
+            new_pos = positions.get(new)
+        except TypeError:
+            pass
+        else:
+            positions[new] = old_pos if new_pos is None else sorted(new_pos + old_pos)
+
+        self._changed(positions)
+
+    def remove(self, x):
+        """Remove the first occurrence of `x`.
+
+        Only the positions of the elements after it are updated.
+        """
+        positions = self.positions
+
+        try:
+            x_pos = positions[x]
+        except KeyError:
+            raise ValueError(f"{x} is not in list")
+        except TypeError:
+            n = super().index(x)
+        else:
+            n = x_pos.pop(0)
+            if not x_pos:
+                del positions[x]
+
+        super().__delitem__(n)
+
+        for m in range(n, len(self)):
+            try:
+                v_pos = positions[self[m]]
+            except TypeError:
+                continue
+            v_pos[bisect_left(v_pos, m + 1)] = m
+
+        self._changed(positions)
+
+    __setitem__ = _list_mutator(list.__setitem__)
+    __delitem__ = _list_mutator(list.__delitem__)
+    __iadd__ = _list_mutator(list.__iadd__)
+    __imul__ = _list_mutator(list.__imul__)
+    insert = _list_mutator(list.insert)
+    extend = _list_mutator(list.extend)
+    pop = _list_mutator(list.pop)
+    clear = _list_mutator(list.clear)
+    sort = _list_mutator(list.sort)
+    reverse = _list_mutator(list.reverse)
+
+
+class FunctionGraph(theano.gof.fg.FunctionGraph):
+    """A version of `FunctionGraph` that knows not to merge non-deterministic `Op`s.
+
+    It also performs common operations for input cloning and keeps a map of
+    original/cloned nodes, making the graph much easier to use.
+
+    """
+
+    def __init__(
+        self,
+        inputs,
+        outputs,
+        features=None,
+        clone=True,
+        memo=None,
+        update_mapping=None,
+        copy_inputs=True,
+        copy_orphans=None,
+    ):
+
+        if clone:
+            if copy_orphans is None:
+                copy_orphans = copy_inputs
+
+            self.memo = theano.gof.graph.clone_get_equiv(
+                inputs, outputs, copy_inputs, copy_orphans, memo
+            )
+
+            inputs = [self.memo[i] for i in inputs]
+            outputs = [self.memo[o] for o in outputs]
+        else:
+            # We make it possible to use a non-cloned set of inputs and outputs
+            # by cloning only the cached constants and replacing them in the
+            # inputs and output graphs.
+            cached_constants = [x for x in inputs if getattr(x, "cached", False)]
+            copied_constants = tt_clone(cached_constants, share_inputs=False)
+            replacements = list(zip(cached_constants, copied_constants))
+            inputs = list(set(inputs) - set(cached_constants)) + list(copied_constants)
+            outputs = tt_clone(outputs, share_inputs=True, replace=replacements)
+
+        assert not any(getattr(v, "cached", False) for v in inputs + outputs)
+
+        super().__init__(inputs, outputs, features=features, clone=False, update_mapping=None)
+
+    @property
+    def inputs(self):
+        return self.__dict__.get("inputs")
+
+    @inputs.setter
+    def inputs(self, inputs):
+        if inputs is not None and not isinstance(inputs, IndexedList):
+            inputs = IndexedList(inputs)
+        self.__dict__["inputs"] = inputs
+
+    def attach_feature(self, feature):
+        if isinstance(feature, theano.gof.opt.MergeFeature):
+            _process_node = feature.process_node
+
+            @wraps(feature.process_node)
+            def _f(self, fgraph, node):
+                if getattr(node.op, "nondeterministic", False):
+                    return
+                return _process_node(fgraph, node)
+
+            feature.process_node = types.MethodType(_f, feature)
+
+        return super().attach_feature(feature)
+
+    def replace(self, r, new_r, reason=None, verbose=None, remove_dup_inputs=True):
+        """See `theano.gof.fg.FunctionGraph.replace`.
+
+        The original `FunctionGraph.replace` will not replace the actual
+        input list.  This one will.
+
+        """
+        super().replace(r, new_r, reason=reason, verbose=verbose)
+
+        inputs = self.inputs
+
+        if r in inputs:
+            # Remove duplicate inputs, if any.
+            if remove_dup_inputs and new_r in inputs:
+                inputs.remove(new_r)
+
+            assert r not in self.variables
+
+            # The inputs are changed in-place, so `inputs.version` is the way
+            # to tell that they've changed.
+            inputs.replace(r, new_r)
+
+            # TODO: Inputs-changed callback?
+
+            assert r not in inputs
+
+    def clone_get_equiv(self, *args, **kwargs):
+        fg, var_map = super().clone_get_equiv(*args, **kwargs)
+        fg.__class__ = self.__class__
+        fg.inputs = fg.inputs
+        return fg, var_map
+
+
+class SubgraphFingerprints(theano.gof.toolbox.Feature):
+    """A `FunctionGraph` feature that caches structural fingerprints of variables.
+
+    A variable's fingerprint is a hash of its type, its name, its output
+    index, its owner's `Op` and the fingerprints of its owner's inputs.
+    Constants are fingerprinted by value and the graph's inputs by position,
+    so structurally identical subgraphs--even ones in different graphs--have
+    the same fingerprint.
+
+    A cached fingerprint is dropped when its variable, or one of its
+    ancestors, has an input changed.  After the feature is detached, the
+    graph's last input positions are still used to fingerprint its variables,
+    but nothing is cached.
+
+    """
+
+    def __init__(self):
+        self.fgraph = None
+        self.fingerprints = {}
+        self._inputs = None
+        self._inputs_version = None
+        self._input_idx = {}
+
+    def on_attach(self, fgraph):
+        if self.fgraph is not None or hasattr(fgraph, "subgraph_fingerprints"):
+            # `FunctionGraph.clone` attaches the features of the original
+            # graph, but this one only tracks a single graph.
+            raise theano.gof.toolbox.AlreadyThere()
+
+        self.fgraph = fgraph
+        fgraph.subgraph_fingerprints = self
+
+    def on_detach(self, fgraph):
+        self.input_index(None)
+        del fgraph.subgraph_fingerprints
+        self.fgraph = None
+        self.fingerprints.clear()
+
+    def on_prune(self, fgraph, node, reason):
+        for o in node.outputs:
+            self.fingerprints.pop(o, None)
+
+    def on_change_input(self, fgraph, node, i, r, new_r, reason=None):
+        if node == "output":
+            return
+
+        stack = list(node.outputs)
+        while stack:
+            v = stack.pop()
+            if self.fingerprints.pop(v, None) is None:
+                # The fingerprints of a variable's descendants are only
+                # cached when the variable's fingerprint is.
+                continue
+            stack.extend(o for c, _ in v.clients if c != "output" for o in c.outputs)
+
+    def input_index(self, var):
+        """Get the position of a variable in the graph's inputs, or `None`."""
+        if self.fgraph is None:
+            return self._input_idx.get(var)
+
+        inputs = self.fgraph.inputs
+        inputs_version = getattr(inputs, "version", None)
+        if (
+            self._inputs is not inputs
+            or self._inputs_version != inputs_version
+            or len(self._input_idx) != len(inputs)
+        ):
+            # The inputs changed, so the fingerprints of their descendants
+            # could have, too.
+            self.fingerprints.clear()
+            self._inputs = inputs
+            self._inputs_version = inputs_version
+            self._input_idx = {v: n for n, v in enumerate(inputs)}
+
+        return self._input_idx.get(var)
+
+    def _leaf_fingerprint(self, var):
+        if isinstance(var, theano.gof.Constant):
+            data = var.data
+            if isinstance(data, np.ndarray):
+                return hash((var.type, var.name, data.dtype.str, data.shape, data.tobytes()))
+            try:
+                return hash((var.type, var.name, data))
+            except TypeError:
+                return hash(var)
+
+        idx = self.input_index(var)
+
+        if idx is None:
+            return hash(var)
+
+        return hash((var.type, var.name, idx))
+
+    def fingerprint(self, var):
+        """Compute--or get the cached--fingerprint of a variable.
+
+        Only the fingerprints of variables in the graph are cached, since
+        changes to the others (e.g. pruned variables) aren't tracked.
+        """
+        # Make sure the input positions are current.
+        self.input_index(None)
+
+        fps = self.fingerprints
+
+        try:
+            return fps[var]
+        except KeyError:
+            pass
+
+        variables = self.fgraph.variables if self.fgraph is not None else ()
+        local_fps = {}
+
+        def _get_fp(v):
+            return fps[v] if v in fps else local_fps[v]
+
+        def _set_fp(v, fp):
+            if v in variables:
+                fps[v] = fp
+            else:
+                local_fps[v] = fp
+
+        stack = [var]
+        while stack:
+            v = stack[-1]
+
+            if v in fps or v in local_fps:
+                stack.pop()
+                continue
+
+            node = v.owner
+
+            if node is None:
+                _set_fp(v, self._leaf_fingerprint(v))
+                stack.pop()
+                continue
+
+            missing = [i for i in node.inputs if i not in fps and i not in local_fps]
+
+            if missing:
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+
+            node_fp = hash((node.op, tuple(_get_fp(i) for i in node.inputs)))
+            for o in node.outputs:
+                _set_fp(o, hash((node_fp, o.index, o.type, o.name)))
+
+        return _get_fp(var)
+
+
+def match_subgraphs(old_var, new_var, mapping=None):
+    """Map the variables in one subgraph to those in a structurally identical subgraph.
+
+    The subgraphs' corresponding variables need to have the same types and
+    names, and their non-constant leaves are otherwise unrestricted.
+
+    Parameters
+    ----------
+    old_var: Variable
+    new_var: Variable
+    mapping: dict (optional)
+        An existing mapping to extend in-place (e.g. from other matched
+        subgraphs that share variables).  It could be left partially extended
+        when the subgraphs don't match.
+
+    Returns
+    -------
+    A `dict` mapping the variables in `old_var`'s graph to the corresponding
+    variables in `new_var`'s graph, or `None` if the graphs aren't
+    structurally identical.
+    """
+    if mapping is None:
+        mapping = {}
+
+    stack = [(old_var, new_var)]
+
+    while stack:
+        o, n = stack.pop()
+
+        if o in mapping:
+            if mapping[o] is not n:
+                return None
+            continue
+
+        mapping[o] = n
+
+        if o is n:
+            continue
+
+        if o.type != n.type or o.name != n.name or (o.owner is None) != (n.owner is None):
+            return None
+
+        if o.owner is None:
+            if isinstance(o, theano.gof.Constant) or isinstance(n, theano.gof.Constant):
+                if not (
+                    isinstance(o, theano.gof.Constant)
+                    and isinstance(n, theano.gof.Constant)
+                    and o.equals(n)
+                ):
+                    return None
+            continue
+
+        o_node, n_node = o.owner, n.owner
+
+        if (
+            o.index != n.index
+            or o_node.op != n_node.op
+            or len(o_node.inputs) != len(n_node.inputs)
+            or len(o_node.outputs) != len(n_node.outputs)
+        ):
+            return None
+
+        stack.extend(zip(o_node.outputs, n_node.outputs))
+        stack.extend(zip(o_node.inputs, n_node.inputs))
+
+    return mapping
+
+
+def replacements_valid(outputs, mapping, variables=()):
+    """Check that replacements only use mapped variables, variables in `variables`, or constants."""
+    stack = list(outputs)
+    visited = set()
+    while stack:
+        v = stack.pop()
+
+        if v in visited or v in mapping or v in variables:
+            continue
+
+        visited.add(v)
+
+        if v.owner is not None:
+            stack.extend(v.owner.inputs)
+        elif not isinstance(v, theano.gof.Constant):
+            return False
+
+    return True
+
+
+def clone_replacements(replacements, mapping, variables=()):
+    """Clone `KanrenRelationSub` replacements onto the variables they're mapped to by `mapping`.
+
+    Parameters
+    ----------
+    replacements: list or dict
+        The new outputs of a node, or a `dict` of variable replacements.
+    mapping: dict
+        A map from the variables in the replacements' subgraph to the
+        variables that should take their place (e.g. from `match_subgraphs`).
+    variables: Container
+        Other variables that the replacements can use as-is.
+
+    Returns
+    -------
+    The cloned replacements, or `None` if the replacements use variables
+    that aren't in `mapping` or `variables`.
+    """
+    if isinstance(replacements, dict):
+        if not all(mapping.get(k, k) in variables for k in replacements.keys()):
+            return None
+
+        outputs = list(replacements.values())
+    else:
+        outputs = replacements
+
+    if not replacements_valid(outputs, mapping, variables):
+        return None
+
+    # Clone the replacements' graphs between the old subgraph's variables
+    # and the replacements, using the new subgraph's variables in place of
+    # the old ones.
+    memo = theano.gof.graph.clone_get_equiv(
+        list(mapping.keys()), outputs, copy_inputs=False, copy_orphans=False, memo=dict(mapping)
+    )
+    outputs = [memo[o] for o in outputs]
+
+    if isinstance(replacements, dict):
+        return dict(zip((mapping.get(k, k) for k in replacements.keys()), outputs))
+
+    return outputs
+
+
+def subgraph_paths(outputs, targets):
+    """Find the paths from a node's outputs to variables in its subgraph.
+
+    A path starts with the index of an output.  Each following step is either
+    the index of an input of the current variable's owner or, when negative,
+    the (negated and decremented) index of an output of that owner.
+
+    Returns
+    -------
+    A `dict` mapping each variable in `targets` to a (shortest) path, or
+    `None` if any of them aren't in the subgraph.
+    """
+    remaining = set(targets)
+    paths = {}
+    visited = set()
+    queue = deque((o, (n,)) for n, o in enumerate(outputs))
+
+    while queue and remaining:
+        v, path = queue.popleft()
+
+        if v in visited:
+            continue
+
+        visited.add(v)
+
+        if v in remaining:
+            paths[v] = path
+            remaining.discard(v)
+
+        if v.owner is not None:
+            queue.extend((o, path + (-n - 1,)) for n, o in enumerate(v.owner.outputs))
+            queue.extend((i, path + (n,)) for n, i in enumerate(v.owner.inputs))
+
+    if remaining:
+        return None
+
+    return paths
+
+
+def follow_subgraph_path(outputs, path):
+    """Get the variable at the end of a `subgraph_paths` path, or `None` if there isn't one."""
+    if path[0] >= len(outputs):
+        return None
+
+    v = outputs[path[0]]
+
+    for step in path[1:]:
+        if v.owner is None:
+            return None
+
+        nodes_vars = v.owner.inputs if step >= 0 else v.owner.outputs
+        idx = step if step >= 0 else -step - 1
+
+        if idx >= len(nodes_vars):
+            return None
+
+        v = nodes_vars[idx]
+
+    return v
+
+
+class _SubgraphKey(object):
+    """A `KanrenRelationSub` results cache key for the subgraph of a node's input term.
+
+    Keys are hashed by their subgraphs' fingerprints and compared with
+    `match_subgraphs`, so subgraphs with colliding fingerprints aren't
+    confused.  The logic variables among the leaves have to be identical, too.
+    """
+
+    __slots__ = ("outputs", "fingerprint", "lvars")
+
+    def __init__(self, outputs, fingerprint, lvars):
+        self.outputs = tuple(outputs)
+        self.fingerprint = fingerprint
+        self.lvars = lvars
+
+    def detached(self):
+        """Copy this key with its subgraph cloned into variables that aren't in a `FunctionGraph`."""
+        memo = {lv: lv for lv in self.lvars if isinstance(lv, theano.gof.Variable)}
+        equiv = clone_get_equiv(tt_inputs(self.outputs), self.outputs, memo=memo)
+        return type(self)([equiv[o] for o in self.outputs], self.fingerprint, self.lvars)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+
+        if (
+            type(other) is not type(self)
+            or self.fingerprint != other.fingerprint
+            or self.lvars != other.lvars
+            or len(self.outputs) != len(other.outputs)
+        ):
+            return False
+
+        mapping = {}
+        for o, n in zip(self.outputs, other.outputs):
+            if match_subgraphs(o, n, mapping) is None:
+                return False
+
+        lvars = self.lvars
+        return all(o is n or (o not in lvars and n not in lvars) for o, n in mapping.items())
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+
+_CachedReplacements = namedtuple("_CachedReplacements", ("replacements", "leaves"))
+_CachedMiss = namedtuple("_CachedMiss", ("fingerprints_ref",))
+
+
+def _detach_replacements(node, replacements, variables):
+    """Create a `KanrenRelationSub` results cache entry for a node's replacements.
+
+    The graph variables that the replacements use are replaced by
+    placeholders, which are paired with their `subgraph_paths` from the node,
+    so that the entry doesn't reference the node's graph.
+
+    Returns `None` when the replacements use variables outside of the node's
+    subgraph.
+    """
+    if isinstance(replacements, dict):
+        used = list(replacements.keys())
+        outputs = list(replacements.values())
+    else:
+        used = []
+        outputs = list(replacements)
+
+    stack = list(outputs)
+    visited = set()
+    while stack:
+        v = stack.pop()
+
+        if v in visited:
+            continue
+
+        visited.add(v)
+
+        if v in variables:
+            used.append(v)
+        elif v.owner is not None:
+            stack.extend(v.owner.inputs)
+        elif not isinstance(v, theano.gof.Constant):
+            return None
+
+    used = list(OrderedDict.fromkeys(used))
+    paths = subgraph_paths(node.outputs, used)
+
+    if paths is None:
+        return None
+
+    placeholders = [v.type() for v in used]
+    detached = clone_replacements(
+        replacements, dict(zip(used, placeholders)), frozenset(placeholders)
+    )
+
+    return _CachedReplacements(detached, tuple((p, paths[v]) for p, v in zip(placeholders, used)))
+
+
+def relation_tracks(*ops):
+    """Annotate a miniKanren relation with the `Op`s its input terms can have.
+
+    `KanrenRelationSub` uses these to skip the nodes that a relation can't
+    match.  See `KanrenRelationSub.tracks`.
+
+    Parameters
+    ----------
+    ops: Op, Op type, or TheanoMetaOp
+        The `Op`s--or `Op` types--of the input terms the relation can match.
+    """
+
+    def _relation_tracks(relation):
+        relation.tracks = ops
+        return relation
+
+    return _relation_tracks
+
+
+def _base_op(op):
+    """Get the base `Op` or `Op` type that a (meta) `Op` matches."""
+    if isinstance(op, TheanoMetaOp):
+        return op.obj if isinstance(op.obj, theano.gof.Op) else op.base
+    elif isinstance(op, type) and issubclass(op, TheanoMetaOp):
+        return op.base
+    elif isinstance(op, theano.gof.Op) or (isinstance(op, type) and issubclass(op, theano.gof.Op)):
+        return op
+
+    raise TypeError(f"{op} is not an `Op`, `Op` type, or meta `Op`")
+
+
+def _term_op(term):
+    """Get the `Op` at the head of an input term, or `None` if it isn't known."""
+    if isinstance(term, ExpressionTuple):
+        op = term[0]
+    elif isinstance(term, TheanoMetaVariable) and isinstance(term.owner, MetaSymbol):
+        op = term.owner.op
+    elif isinstance(term, tt.Variable) and term.owner is not None:
+        op = term.owner.op
+    else:
+        return None
+
+    if isinstance(op, (TheanoMetaOp, theano.gof.Op)):
+        return _base_op(op)
+
+    return None
+
+
+def relation_input_ops(kanren_relation):
+    """Determine the `Op`s of the input terms that a miniKanren relation can match.
+
+    Relations annotated with `relation_tracks` use their annotation.  For
+    `kanren.facts.Relation`s, the `Op`s are derived from the input terms of
+    their facts.
+
+    Returns
+    -------
+    A tuple of `Op`s and `Op` types, or `None` when any `Op` could match.
+    """
+    tracks = getattr(kanren_relation, "tracks", None)
+
+    if tracks is not None and not callable(tracks):
+        return tuple(_base_op(op) for op in tracks)
+
+    if isinstance(kanren_relation, Relation):
+        ops = []
+        for in_term, *_ in kanren_relation.facts:
+            op = _term_op(in_term)
+
+            if op is None:
+                return None
+
+            if op not in ops:
+                ops.append(op)
+
+        return tuple(ops)
+
+    return None
+
+
+class KanrenBudgetExceeded(Exception):
+    """Raised when a miniKanren search exceeds its budget."""
+
+
+BudgetExceededInfo = namedtuple("BudgetExceededInfo", ("node", "relation", "budget"))
+
+
+class SearchBudget(object):
+    """Step and time limits for a miniKanren search.
+
+    A step is an attempt to take a state from the search's goal stream (i.e.
+    the stream that `run` consumes).
+    """
+
+    __slots__ = ("max_steps", "deadline", "steps")
+
+    def __init__(self, max_steps=None, timeout=None):
+        self.max_steps = max_steps
+        self.deadline = time.perf_counter() + timeout if timeout is not None else None
+        self.steps = 0
+
+    def step(self):
+        """Count a step and raise `KanrenBudgetExceeded` if a limit was exceeded."""
+        self.steps += 1
+
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise KanrenBudgetExceeded("steps")
+
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise KanrenBudgetExceeded("time")
+
+    def count(self, stream):
+        """Count each attempt to take a state from a stream as a step."""
+        stream = iter(stream)
+        while True:
+            self.step()
+
+            try:
+                s = next(stream)
+            except StopIteration:
+                return
+
+            yield s
+
+
+def budgeted_goal(goal, max_steps=None, timeout=None):
+    """Limit the number of states taken from a goal's stream, and the time it takes to take them.
+
+    `KanrenBudgetExceeded` is raised when a limit is exceeded.  The limits are
+    only checked when a state is taken from the goal's stream, so goals that
+    don't produce states (e.g. endless disjunctions of failing goals) can't
+    be interrupted.  Other searches--including ones run by the goal--aren't
+    affected.
+    """
+
+    def _budgeted_goal(S):
+        budget = SearchBudget(max_steps, timeout)
+        return budget.count(goal(S))
+
+    return _budgeted_goal
+
+
+def first_result(results):
+    """Return the first miniKanren result, or `None`."""
+    return next(results, None)
+
+
+def no_node_filter(node):
+    """Don't skip any nodes."""
+    return False
+
+
+class GraphCostModel(object):
+    """A rough cost model for Theano graphs with `RandomVariable`s.
+
+    The cost of an `Apply` node is one (for its overhead), plus an estimate of
+    the floating-point operations it performs--including the sampling of
+    random variables--plus `memory_weight` times the number of bytes in its
+    outputs.
+
+    Shapes are taken from test values, shared variables and constants, when
+    available; otherwise, each non-broadcastable dimension is assumed to have
+    `default_dim_size` elements.
+
+    """
+
+    elemwise_flops = {
+        ts.TrueDiv: 4,
+        ts.Sqrt: 4,
+        ts.Pow: 20,
+        ts.Exp: 10,
+        ts.Exp2: 10,
+        ts.Expm1: 10,
+        ts.Log: 10,
+        ts.Log2: 10,
+        ts.Log10: 10,
+        ts.Log1p: 10,
+        ts.Sin: 10,
+        ts.Cos: 10,
+        ts.Tanh: 10,
+        ts.ArcTan: 10,
+        basic_scipy.Erf: 20,
+        basic_scipy.Erfc: 20,
+        basic_scipy.Gamma: 20,
+        basic_scipy.GammaLn: 20,
+        basic_scipy.Psi: 20,
+    }
+    """The operations per element of `Elemwise` `Op`s, by scalar `Op` type (the default is one)."""
+
+    rv_flops = {
+        "uniform": 5,
+        "normal": 10,
+        "halfnormal": 10,
+        "exponential": 10,
+        "cauchy": 15,
+        "halfcauchy": 15,
+        "truncexpon": 15,
+        "bernoulli": 5,
+        "categorical": 10,
+        "poisson": 30,
+        "binomial": 30,
+        "gamma": 40,
+        "invgamma": 40,
+        "beta": 80,
+        "neg-binomial": 50,
+        "beta_binomial": 120,
+        "multivariate_normal": 10,
+        "dirichlet": 40,
+        "multinomial": 30,
+        "polya-gamma": 200,
+    }
+    """The operations per sampled element of `RandomVariable`s, by `Op` name.
+
+    The costs of multivariate random variables are also multiplied by the
+    size of their last dimension.
+    """
+
+    def __init__(
+        self,
+        default_dim_size=100,
+        memory_weight=0.1,
+        default_rv_flops=20,
+        elemwise_flops=None,
+        rv_flops=None,
+    ):
+        """Create a `GraphCostModel`.
+
+        Parameters
+        ----------
+        default_dim_size: int
+            The assumed size of dimensions with unknown sizes.
+        memory_weight: float
+            The cost per byte of the outputs of a node.
+        default_rv_flops: int or float
+            The operations per sampled element of random variables that aren't
+            in `rv_flops`.
+        elemwise_flops: dict (optional)
+            Overrides for the class-level `elemwise_flops`.
+        rv_flops: dict (optional)
+            Overrides for the class-level `rv_flops`.
+        """
+        self.default_dim_size = default_dim_size
+        self.memory_weight = memory_weight
+        self.default_rv_flops = default_rv_flops
+        self.elemwise_flops = dict(self.elemwise_flops, **(elemwise_flops or {}))
+        self.rv_flops = dict(self.rv_flops, **(rv_flops or {}))
+
+    def shape(self, var):
+        """Estimate the shape of a tensor variable."""
+        value = getattr(var.tag, "test_value", None)
+
+        if value is None:
+            if isinstance(var, tt.Constant):
+                value = var.data
+            elif isinstance(var, theano.compile.SharedVariable):
+                value = var.get_value(borrow=True)
+
+        if value is not None:
+            return np.shape(value)
+
+        return tuple(1 if b else self.default_dim_size for b in var.broadcastable)
+
+    def size(self, var):
+        """Estimate the number of elements in a variable (zero for non-tensors)."""
+        if not isinstance(var.type, tt.TensorType):
+            return 0
+        return int(np.prod(self.shape(var)))
+
+    def flops(self, node):
+        """Estimate the number of operations performed by a node."""
+        op = node.op
+
+        if isinstance(op, RandomVariable):
+            smpl_var = node.outputs[1]
+            flops = self.rv_flops.get(op.name, self.default_rv_flops) * self.size(smpl_var)
+
+            if op.ndim_supp > 0 and smpl_var.ndim > 0:
+                flops *= self.shape(smpl_var)[-1]
+
+            return flops
+        elif isinstance(op, (tt.basic.Dot, tt.blas.Dot22)):
+            a, b = node.inputs[:2]
+            return 2 * self.size(a) * (self.shape(b)[-1] if b.ndim == 2 else 1)
+        elif isinstance(op, tt.elemwise.Elemwise):
+            scalar_flops = self.elemwise_flops.get(type(op.scalar_op), 1)
+            return scalar_flops * max(self.size(o) for o in node.outputs)
+        elif isinstance(op, tt.elemwise.CAReduce):
+            return self.size(node.inputs[0])
+
+        return max([self.size(o) for o in node.outputs] + [0])
+
+    def memory(self, node):
+        """Estimate the number of bytes in a node's outputs."""
+        return sum(
+            self.size(o) * np.dtype(o.dtype).itemsize
+            for o in node.outputs
+            if isinstance(o.type, tt.TensorType)
+        )
+
+    def __call__(self, node):
+        """Estimate the cost of a node."""
+        return 1 + self.flops(node) + self.memory_weight * self.memory(node)
+
+    def graph_cost(self, outputs, inputs=None):
+        """Estimate the cost of the nodes between `inputs` (default: all inputs) and `outputs`."""
+        if inputs is None:
+            inputs = tt_inputs(outputs)
+        return sum(self(node) for node in io_toposort(inputs, outputs))
+
+    @staticmethod
+    def reify_result(result):
+        """Reify the graphs in a miniKanren result.
+
+        Returns the reified result--in the form of `result`--and its graphs'
+        output variables, or `None` when the result can't be reified.
+        """
+        if isinstance(result, dict):
+            result = list(result.items())
+
+        try:
+            if isinstance(result, list):
+                result = [(k, eval_and_reify_meta(v)) for k, v in result]
+                values = [v for _, v in result]
+            else:
+                result = eval_and_reify_meta(result)
+                values = [result]
+        except ValueError:
+            return None
+
+        if not all(isinstance(v, tt.Variable) for v in values):
+            return None
+
+        return result, values
+
+    def result_cost(self, result):
+        """Estimate the cost of the graphs in a miniKanren result.
+
+        Results that can't be reified have an infinite cost.
+        """
+        reified = self.reify_result(result)
+
+        if reified is None:
+            return np.inf
+
+        return self.graph_cost(reified[1])
+
+
+default_cost_model = GraphCostModel()
+"""The default `GraphCostModel`."""
+
+
+def cheapest_result(results, n=10, cost_model=None):
+    """Return the cheapest of the first `n` miniKanren results, or `None`.
+
+    The results are reified once, in order to estimate their costs, and the
+    cheapest one is returned in its reified form.  Results that can't be
+    reified are only returned when no other result can.
+
+    Use `functools.partial` to set `n` and `cost_model` (default:
+    `default_cost_model`) for a `KanrenRelationSub` `results_filter`.
+    """
+    cost_model = cost_model or default_cost_model
+    best_res, best_cost = None, None
+
+    for res in islice(results, n):
+        reified = cost_model.reify_result(res)
+
+        if reified is None:
+            cost = np.inf
+        else:
+            res, values = reified
+            cost = cost_model.graph_cost(values)
+
+        if best_cost is None or cost < best_cost:
+            best_res, best_cost = res, cost
+
+    return best_res
+
+
+class KanrenRelationSub(LocalOptimizer):
+    """A local optimizer that uses miniKanren goals to match and replace terms in a Theano `FunctionGraph`.
+
+    Only *one* miniKanren `run` result is used (chosen by a configurable filter
+    function).  See `KanrenEGraphOptimizer` for an optimizer that uses
+    multiple results.
+
+    """
+
+    reentrant = True
+
+    def __init__(
+        self,
+        kanren_relation,
+        relation_lvars=None,
+        results_filter=first_result,
+        node_filter=no_node_filter,
+        tracks=None,
+        results_cache=None,
+        max_steps=None,
+        timeout=None,
+    ):
+        """Create a `KanrenRelationSub`.
+
+        Parameters
+        ----------
+        kanren_relation: kanren.Relation or goal
+            The miniKanren relation store or goal to use.  Custom goals should
+            take an input and output argument, respectively.
+        relation_lvars: Iterable
+            A collection of terms to be considered logic variables by miniKanren
+            (i.e. Theano terms used as "unknowns" in `kanren_relation`).
+        results_filter: function
+            A function that returns a single result from a stream of
+            miniKanren results.  The default function returns the first result.
+        node_filter: function
+            A function taking a single node as an argument that returns `True`
+            when the node should be skipped.
+        tracks: Iterable (optional)
+            The `Op`s--or `Op` types, or meta `Op`s--of the nodes that
+            `kanren_relation` can match.  When not given, they're determined by
+            `relation_input_ops`.  Other nodes are skipped without running
+            miniKanren.
+        results_cache: MutableMapping or bool (optional)
+            A cache used to reuse results between nodes with structurally
+            identical subgraphs (e.g. the same node in consecutive
+            `EquilibriumOptimizer` passes).  `True` creates an
+            `InstrumentedLRUCache` for this optimizer; by default, results
+            aren't cached.  Cached replacements don't reference the graphs
+            they were produced in, and failed searches are only reused within
+            the graph they were run in.  Cached results assume that
+            `kanren_relation` doesn't change (e.g. by adding facts); clear the
+            cache when it does.
+        max_steps: int (optional)
+            The maximum number of miniKanren search steps taken for a node.
+            See `SearchBudget` for what counts as a step.
+        timeout: float (optional)
+            The maximum number of seconds spent searching for a node.  The
+            time is checked at each search step, so a search that stalls
+            without producing states isn't interrupted (see `budgeted_goal`).
+
+        When a node's search exceeds `max_steps` or `timeout`, it's abandoned,
+        the node is left unchanged, and the node, relation and exceeded budget
+        are recorded in `budget_exceeded`.
+        """
+        self.kanren_relation = kanren_relation
+        self.relation_lvars = relation_lvars or []
+        self.results_filter = results_filter
+        self.node_filter = node_filter
+
+        if tracks is not None:
+            self._tracks = tuple(_base_op(op) for op in tracks)
+        else:
+            self._tracks = relation_input_ops(kanren_relation)
+
+        if self._tracks is not None:
+            self._tracked_types = tuple(op for op in self._tracks if isinstance(op, type))
+            self._tracked_ops = tuple(op for op in self._tracks if not isinstance(op, type))
+
+        if results_cache is True:
+            results_cache = InstrumentedLRUCache(2 ** 12)
+        elif results_cache is False:
+            results_cache = None
+
+        try:
+            hash((kanren_relation, results_filter))
+        except TypeError:
+            results_cache = None
+
+        self._results_cache = results_cache
+
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.budget_exceeded = []
+
+        self.reset_stats()
+
+        super().__init__()
+
+    def reset_stats(self):
+        """Reset the statistics collected by `transform`."""
+        self.stats = OrderedDict(
+            [
+                ("calls", 0),
+                ("skipped", 0),
+                ("cache_hits", 0),
+                ("runs", 0),
+                ("matches", 0),
+                ("results_consumed", 0),
+                ("budget_exceeded", 0),
+                ("run_time", 0.0),
+                ("reify_time", 0.0),
+                ("metatize_calls", 0),
+                ("meta_reify_calls", 0),
+            ]
+        )
+
+    def profile_stats(self):
+        """Return a copy of the statistics collected by `transform`.
+
+        The statistics are:
+            - `calls`: the number of nodes `transform` was called on,
+            - `skipped`: nodes skipped by `is_candidate` or `node_filter`,
+            - `cache_hits`: nodes with reused cached results,
+            - `runs`: miniKanren runs,
+            - `matches`: runs that produced a replacement,
+            - `results_consumed`: miniKanren results taken by `results_filter`,
+            - `budget_exceeded`: runs abandoned by `max_steps` or `timeout`,
+            - `run_time`: seconds spent running miniKanren and `results_filter`,
+            - `reify_time`: seconds spent reifying the chosen results,
+            - `metatize_calls`: `metatize` dispatches during the runs, and
+            - `meta_reify_calls`: meta objects reified by `unification.reify`
+              during the runs (only counted when
+              `theano.config.profile_optimizer` is enabled).
+
+        `KanrenEquilibriumOptimizer` adds these statistics to its profiles.
+        """
+        return OrderedDict(self.stats)
+
+    @staticmethod
+    def print_profile(stream, prof, level=0):
+        """Print the profile of a `KanrenRelationSub`.
+
+        Parameters
+        ----------
+        prof: tuple
+            A `KanrenRelationSub` and the output of its `profile_stats` method.
+        """
+        opt, stats = prof
+        blanc = "    " * level
+        print(blanc, "KanrenRelationSub", getattr(opt.kanren_relation, "__name__", ""), file=stream)
+
+        if stats["runs"]:
+            run_time = stats["run_time"]
+            print(
+                blanc,
+                "  time %.3fs running (%.3fs per run), %.3fs reifying"
+                % (run_time, run_time / stats["runs"], stats["reify_time"]),
+                file=stream,
+            )
+
+        for name, value in stats.items():
+            if name not in ("run_time", "reify_time"):
+                print(blanc, f"  {name} {value}", file=stream)
+
+    @property
+    def results_cache(self):
+        """Get the results cache, or `None` if results aren't cached."""
+        return self._results_cache
+
+    def cache_info(self):
+        """Return the results cache's statistics, or `None` if results aren't cached."""
+        cache = self.results_cache
+        return getattr(cache, "cache_info", lambda: None)()
+
+    def add_requirements(self, fgraph):
+        if self.results_cache is not None:
+            fgraph.attach_feature(SubgraphFingerprints())
+
+    def tracks(self):
+        """Return the `Op`s and `Op` types of the nodes this optimizer can change, if known."""
+        return self._tracks
+
+    def is_candidate(self, node):
+        """Determine whether or not the relation could match a node based on its `Op`."""
+        if self._tracks is None:
+            return True
+
+        return isinstance(node.op, self._tracked_types) or node.op in self._tracked_ops
+
+    def adjust_outputs(self, node, new_node, old_node=None):
+        """Make adjustments for multiple outputs.
+
+        This handles (some) nodes with multiple outputs by returning a list
+        with the appropriate length and containing the new node (at the correct
+        index if `default_output` is available and correct, or 0--and it
+        happens to be the correct one).
+
+        TODO: We should be able to get the correct index from the something
+        like `node.outputs.index(old_node)`, but we don't exactly have
+        `old_node` unless the miniKanren results give it to us.
+
+        """
+        res = list(node.outputs)
+        try:
+            new_node_idx = res.index(old_node)
+        except ValueError:
+            # Guesstimate it
+            new_node_idx = getattr(node.op, "default_output", 0) or 0
+
+        res[new_node_idx] = new_node
+        return res
+
+    def transform(self, node):
+        if not isinstance(node, tt.Apply):
+            return False
+
+        stats = self.stats
+        stats["calls"] += 1
+
+        if not self.is_candidate(node) or self.node_filter(node):
+            stats["skipped"] += 1
+            return False
+
+        return self._transform_input(node, _node_input_expr(node))
+
+    def _transform_input(self, node, input_expr, search_expr=None):
+        """Produce the replacements for a node's input term.
+
+        `search_expr` is an equivalent term (e.g. the metatized `input_expr`)
+        that's used in the miniKanren search instead of `input_expr`.
+        """
+        cache_key, new_node = self._cached_transform(node, input_expr)
+
+        if new_node is not None:
+            self.stats["cache_hits"] += 1
+            return new_node
+
+        new_node = self._kanren_transform(node, input_expr if search_expr is None else search_expr)
+
+        if isinstance(new_node, dict):
+            assert all(k in node.fgraph.variables for k in new_node.keys())
+
+        self._cache_result(cache_key, node, new_node)
+
+        return new_node
+
+    def _cached_transform(self, node, input_expr):
+        """Get a node's cache key and its cached replacements, if there are any usable ones."""
+        cache = self.results_cache
+
+        if cache is None or getattr(node, "fgraph", None) is None:
+            return None, None
+
+        cache_key = self._cache_key(node, input_expr)
+
+        try:
+            cached_res = cache[cache_key]
+        except KeyError:
+            return cache_key, None
+
+        return cache_key, self._reuse_result(node, cached_res)
+
+    def _cache_result(self, cache_key, node, new_node):
+        """Cache a node's replacements (or `False`) under a key from `_cached_transform`."""
+        if cache_key is None:
+            return
+
+        if new_node is False:
+            entry = _CachedMiss(weakref.ref(node.fgraph.subgraph_fingerprints))
+        else:
+            entry = _detach_replacements(node, new_node, node.fgraph.variables)
+
+            if entry is None:
+                return
+
+        # The key shouldn't reference the node's graph, either.
+        cache_key = cache_key[:-1] + (cache_key[-1].detached(),)
+
+        try:
+            self.results_cache[cache_key] = entry
+        except ValueError:  # pragma: no cover
+            # The value is too large.
+            pass
+
+    def _cache_key(self, node, input_expr):
+        """Create a results cache key for a node's subgraph (see `_SubgraphKey`)."""
+        fgraph = node.fgraph
+
+        if getattr(fgraph, "subgraph_fingerprints", None) is None:
+            fgraph.attach_feature(SubgraphFingerprints())
+
+        fingerprints = fgraph.subgraph_fingerprints
+
+        if isinstance(input_expr, list):
+            out_key = None
+            outputs = input_expr
+        else:
+            out_key = input_expr.index
+            outputs = [input_expr]
+
+        subgraph_key = _SubgraphKey(
+            outputs,
+            tuple(fingerprints.fingerprint(o) for o in outputs),
+            frozenset(self.relation_lvars),
+        )
+
+        # Logic variables that are inputs of the graph are identified by their
+        # positions, like the inputs in the fingerprints.
+        lvars_key = []
+        for lv in self.relation_lvars:
+            lv_idx = fingerprints.input_index(lv)
+            lvars_key.append(lv if lv_idx is None else lv_idx)
+
+        lvars_key = tuple(lvars_key)
+
+        return (
+            self.kanren_relation,
+            self.results_filter,
+            self.max_steps,
+            self.timeout,
+            lvars_key,
+            out_key,
+            subgraph_key,
+        )
+
+    def _reuse_result(self, node, cached_res):
+        """Adapt a cached result to a node, or return `None` when it can't be used."""
+        fgraph = node.fgraph
+
+        if isinstance(cached_res, _CachedMiss):
+            # A search could've failed because it exceeded its budget, so
+            # failures are only reused within the same graph.
+            if cached_res.fingerprints_ref() is not fgraph.subgraph_fingerprints:
+                return None
+            return False
+
+        mapping = {}
+        for placeholder, path in cached_res.leaves:
+            v = follow_subgraph_path(node.outputs, path)
+
+            # The fingerprints matched, but make sure the variables that the
+            # replacements use are compatible.
+            if v is None or v.type != placeholder.type:
+                return None
+
+            mapping[placeholder] = v
+
+        return clone_replacements(cached_res.replacements, mapping, fgraph.variables)
+
+    def _kanren_transform(self, node, input_expr):
+        """Run miniKanren on a node and produce its replacements."""
+        chosen_res = self._kanren_search(node, input_expr, self.results_filter)
+
+        if not chosen_res:
+            return False
+
+        self.stats["matches"] += 1
+        start_time = time.perf_counter()
+
+        try:
+            return self._reify_result(node, chosen_res)
+        finally:
+            self.stats["reify_time"] += time.perf_counter() - start_time
+
+    def _kanren_search(self, node, input_expr, results_filter):
+        """Run miniKanren on a node and return the result chosen by `results_filter`.
+
+        Returns `False` when the search exceeds its budget.
+        """
+        stats = self.stats
+        stats["runs"] += 1
+
+        # The `_metatize` dispatcher can be swapped out, so it's looked up
+        # for each search.
+        metatize_dispatcher = base_meta._metatize
+        metatize_calls = metatize_dispatcher.hits + metatize_dispatcher.misses
+        n_results = 0
+
+        def _count_results(results):
+            nonlocal n_results
+            for r in results:
+                n_results += 1
+                yield r
+
+        start_time = time.perf_counter()
+
+        with ExitStack() as stack:
+            # Counting reifications is only worth its overhead while profiling.
+            if theano.config.profile_optimizer:
+                meta_reify_calls = stack.enter_context(meta_dispatch.count_meta_reify_calls())
+            else:
+                meta_reify_calls = [0]
+
+            try:
+                with variables(*self.relation_lvars):
+                    q = var()
+                    goal = self.kanren_relation(input_expr, q)
+
+                    if self.max_steps is not None or self.timeout is not None:
+                        goal = budgeted_goal(goal, self.max_steps, self.timeout)
+
+                    kanren_results = run(None, q, goal)
+                    return results_filter(_count_results(kanren_results))
+            except KanrenBudgetExceeded as e:
+                stats["budget_exceeded"] += 1
+                self.budget_exceeded.append(
+                    BudgetExceededInfo(node, self.kanren_relation, e.args[0])
+                )
+                return False
+            finally:
+                stats["run_time"] += time.perf_counter() - start_time
+                stats["results_consumed"] += n_results
+                stats["metatize_calls"] += (
+                    metatize_dispatcher.hits + metatize_dispatcher.misses - metatize_calls
+                )
+                stats["meta_reify_calls"] += meta_reify_calls[0]
+
+    def _reify_result(self, node, chosen_res):
+        """Turn a miniKanren result into replacements for a node."""
+        if isinstance(chosen_res, (ExpressionTuple, MetaSymbol)):
+            chosen_res = eval_and_reify_meta(chosen_res)
+
+        if isinstance(chosen_res, dict):
+            chosen_res = list(chosen_res.items())
+
+        if isinstance(chosen_res, list):
+            # We got a dictionary of replacements
+            new_node = {eval_and_reify_meta(k): eval_and_reify_meta(v) for k, v in chosen_res}
+        elif isinstance(chosen_res, tt.Variable):
+            # Attempt to automatically format the output for multi-output
+            # `Apply` nodes.
+            new_node = self.adjust_outputs(node, eval_and_reify_meta(chosen_res))
+        else:
+            raise ValueError(
+                "Unsupported FunctionGraph replacement variable type: {chosen_res}"
+            )  # pragma: no cover
+
+        return new_node
+
+
+class KanrenRelationGroup(LocalOptimizer):
+    """A local optimizer that applies multiple miniKanren relations in a single pass.
+
+    Each node is metatized once and shared by the relations without
+    `relation_lvars`, and only the relations that can match its
+    `Op`--according to their `tracks`--are tried, in the order they were
+    given.  The first relation to produce replacements wins.
+
+    """
+
+    reentrant = True
+
+    def __init__(self, relations, **kwargs):
+        """Create a `KanrenRelationGroup`.
+
+        Parameters
+        ----------
+        relations: Iterable of KanrenRelationSub, kanren.Relation or goal
+            The relations to apply.  Relations that aren't `KanrenRelationSub`s
+            are wrapped in one, using `kwargs`.
+        kwargs:
+            Keyword arguments for `KanrenRelationSub`.
+        """
+        self.kanren_opts = [
+            r if isinstance(r, KanrenRelationSub) else KanrenRelationSub(r, **kwargs)
+            for r in relations
+        ]
+
+        self._op_index = {}
+        self._tracked_types = []
+        self._untracked = []
+
+        for n, kanren_opt in enumerate(self.kanren_opts):
+            tracks = kanren_opt.tracks()
+
+            if tracks is None:
+                self._untracked.append(n)
+                continue
+
+            for op in tracks:
+                if isinstance(op, type):
+                    self._tracked_types.append((op, n))
+                else:
+                    self._op_index.setdefault(op, []).append(n)
+
+        self._type_candidates = {}
+
+        super().__init__()
+
+    def tracks(self):
+        if self._untracked:
+            return None
+
+        return tuple(self._op_index.keys()) + tuple(
+            OrderedDict.fromkeys(op_type for op_type, _ in self._tracked_types)
+        )
+
+    def candidates(self, node):
+        """Return the `KanrenRelationSub`s that could match a node, based on its `Op`."""
+        op_type = type(node.op)
+
+        try:
+            type_candidates = self._type_candidates[op_type]
+        except KeyError:
+            type_candidates = self._untracked + [
+                n for tracked_type, n in self._tracked_types if issubclass(op_type, tracked_type)
+            ]
+            self._type_candidates[op_type] = type_candidates
+
+        try:
+            op_candidates = self._op_index.get(node.op, [])
+        except TypeError:  # pragma: no cover
+            # The `Op` isn't hashable.
+            op_candidates = []
+
+        return [self.kanren_opts[n] for n in sorted(set(type_candidates + op_candidates))]
+
+    def add_requirements(self, fgraph):
+        for kanren_opt in self.kanren_opts:
+            kanren_opt.add_requirements(fgraph)
+
+    def transform(self, node):
+        if not isinstance(node, tt.Apply):
+            return False
+
+        candidates = self.candidates(node)
+
+        if not candidates:
+            return False
+
+        input_expr = _node_input_expr(node)
+        search_expr = None
+
+        for kanren_opt in candidates:
+            kanren_opt.stats["calls"] += 1
+
+            if kanren_opt.node_filter(node):
+                kanren_opt.stats["skipped"] += 1
+                continue
+
+            if kanren_opt.relation_lvars:
+                # `relation_lvars` are only logic variables within the
+                # relation's `variables` context, so metatizing them outside
+                # of it would turn them into regular meta objects.
+                new_node = kanren_opt._transform_input(node, input_expr)
+            else:
+                if search_expr is None:
+                    search_expr = metatize(input_expr)
+
+                new_node = kanren_opt._transform_input(node, input_expr, search_expr)
+
+            if new_node:
+                return new_node
+
+        return False
+
+    def profile_stats(self):
+        """Return the sums of the statistics of the group's `KanrenRelationSub`s."""
+        res = OrderedDict()
+        for kanren_opt in self.kanren_opts:
+            for k, v in kanren_opt.stats.items():
+                res[k] = res.get(k, 0) + v
+        return res
+
+    @staticmethod
+    def print_profile(stream, prof, level=0):
+        group, stats = prof
+        blanc = "    " * level
+        print(blanc, "KanrenRelationGroup", file=stream)
+        for name, value in stats.items():
+            print(blanc, f"  {name} {value}", file=stream)
+        for kanren_opt in group.kanren_opts:
+            kanren_opt.print_profile(
+                stream, (kanren_opt, kanren_opt.profile_stats()), level=level + 1
+            )
+
+    def print_summary(self, stream=None, level=0, depth=-1):
+        print(f"{' ' * level}{self.__class__.__name__} ({id(self)})", file=stream)
+        if depth != 0:
+            for kanren_opt in self.kanren_opts:
+                kanren_opt.print_summary(stream, level=(level + 2), depth=(depth - 1))
+
+
+def _profile_stats_delta(lopt, before):
+    """Get the changes in a local optimizer's statistics since `before`, if it has any."""
+    after = lopt.profile_stats()
+    return (lopt, OrderedDict((k, v - before.get(k, 0)) for k, v in after.items()))
+
+
+def _print_global_opt_profile(stream, prof, level=0):
+    opt, process_count, elapsed, lopt_profs = prof
+    blanc = "    " * level
+    print(blanc, opt.__class__.__name__, getattr(opt, "name", ""), file=stream)
+    print(blanc, "  time %.3fs, %d replacements" % (elapsed, process_count), file=stream)
+    for lopt_prof in lopt_profs:
+        lopt_prof[0].print_profile(stream, lopt_prof, level=level + 1)
+
+
+def _merge_lopt_profs(lopt_profs1, lopt_profs2):
+    """Sum the statistics of the same local optimizers in two lists of `_profile_stats_delta` outputs."""
+    res = OrderedDict()
+    for lopt, stats in chain(lopt_profs1, lopt_profs2):
+        lopt_stats = res.setdefault(lopt, OrderedDict())
+        for k, v in stats.items():
+            lopt_stats[k] = lopt_stats.get(k, 0) + v
+    return list(res.items())
+
+
+class KanrenEquilibriumOptimizer(EquilibriumOptimizer):
+    """An `EquilibriumOptimizer` that adds the statistics of its local optimizers to its profiles.
+
+    The statistics collected by local optimizers with a `profile_stats`
+    method (e.g. `KanrenRelationSub` and `KanrenRelationGroup`) during each
+    `apply` are appended to the `EquilibriumOptimizer` profile, and printed
+    after it by `print_profile`.
+
+    """
+
+    def apply(self, fgraph, start_from=None):
+        profiled_opts = [
+            lopt for lopt in self.get_local_optimizers() if hasattr(lopt, "profile_stats")
+        ]
+        stats_before = [lopt.profile_stats() for lopt in profiled_opts]
+
+        prof = super().apply(fgraph, start_from=start_from)
+
+        return tuple(prof) + (
+            [_profile_stats_delta(lopt, b) for lopt, b in zip(profiled_opts, stats_before)],
+        )
+
+    @staticmethod
+    def print_profile(stream, prof, level=0):
+        EquilibriumOptimizer.print_profile(stream, prof[:-1], level=level)
+        for lopt_prof in prof[-1]:
+            lopt_prof[0].print_profile(stream, lopt_prof, level=level + 1)
+
+    @staticmethod
+    def merge_profile(prof1, prof2):
+        res = EquilibriumOptimizer.merge_profile(prof1[:-1], prof2[:-1])
+        return tuple(res) + (_merge_lopt_profs(prof1[-1], prof2[-1]),)
+
+
+class NodeChangeTracker(theano.gof.toolbox.Feature):
+    """A `FunctionGraph` feature that records the nodes that were imported or had inputs changed.
+
+    Every node in the graph when the feature is attached counts as a change.
+    Each consumer (e.g. an `IncrementalOptimizer`) gets the nodes that changed
+    since its own last request, so consumers don't interfere with each other.
+
+    """
+
+    def __init__(self):
+        self.fgraph = None
+        self.changes = OrderedDict()
+        self.consumers = {}
+        self._seq = 0
+
+    def on_attach(self, fgraph):
+        if self.fgraph is not None or hasattr(fgraph, "node_changes"):
+            raise theano.gof.toolbox.AlreadyThere()
+
+        self.fgraph = fgraph
+        fgraph.node_changes = self
+
+        for node in fgraph.toposort():
+            self._record(node)
+
+    def on_detach(self, fgraph):
+        del fgraph.node_changes
+        self.fgraph = None
+        self.changes.clear()
+        self.consumers.clear()
+
+    def on_import(self, fgraph, node, reason):
+        self._record(node)
+
+    def on_change_input(self, fgraph, node, i, r, new_r, reason=None):
+        if node != "output":
+            self._record(node)
+
+    def on_prune(self, fgraph, node, reason):
+        self.changes.pop(node, None)
+
+    def _record(self, node):
+        self._seq += 1
+        self.changes[node] = self._seq
+        self.changes.move_to_end(node)
+
+    def pop_changed(self, consumer):
+        """Return the nodes that changed since the last time `consumer` asked, oldest first."""
+        last_seq = self.consumers.get(consumer, 0)
+        self.consumers[consumer] = self._seq
+
+        res = []
+        for node, seq in reversed(self.changes.items()):
+            if seq <= last_seq:
+                break
+            res.append(node)
+
+        res.reverse()
+        return res
+
+
+class IncrementalOptimizer(NavigatorOptimizer):
+    """An optimizer that only applies local optimizers to the parts of a graph that changed.
+
+    The first time it's applied to a `FunctionGraph`, every node is
+    considered.  After that--within the same run and in later runs on the same
+    graph--only the nodes recorded by the graph's `NodeChangeTracker` and their
+    downstream clients are.  The optimizations are repeated until no more
+    changes are made.
+
+    """
+
+    def __init__(self, optimizers, max_use_ratio=10, client_depth=1, failure_callback=None):
+        """Create an `IncrementalOptimizer`.
+
+        Parameters
+        ----------
+        optimizers: Iterable of LocalOptimizer
+            The local optimizers to apply.
+        max_use_ratio: int or float
+            The optimizers can replace at most (size of graph * this number)
+            nodes per run.
+        client_depth: int or None
+            How many levels of clients of the changed nodes are also
+            considered.  Optimizers that match deeper terms (e.g.
+            `KanrenRelationSub`s with nested patterns) need larger values.
+            When `None`, all the downstream nodes are considered.
+        failure_callback: function (optional)
+            See `NavigatorOptimizer`.
+        """
+        super().__init__(None, ignore_newtrees=False, failure_callback=failure_callback)
+        self.local_optimizers = list(optimizers)
+        self.max_use_ratio = max_use_ratio
+        self.client_depth = client_depth
+
+    def add_requirements(self, fgraph):
+        super().add_requirements(fgraph)
+        fgraph.attach_feature(NodeChangeTracker())
+        for lopt in self.local_optimizers:
+            lopt.add_requirements(fgraph)
+
+    def downstream_nodes(self, nodes):
+        """Add the clients of the given nodes--up to `client_depth` levels--to them."""
+        res = OrderedDict.fromkeys(nodes)
+        frontier = list(res)
+        depth = 0
+
+        while frontier and (self.client_depth is None or depth < self.client_depth):
+            depth += 1
+            new_frontier = []
+            for node in frontier:
+                for o in node.outputs:
+                    for c, _ in o.clients:
+                        if c != "output" and c not in res:
+                            res[c] = None
+                            new_frontier.append(c)
+            frontier = new_frontier
+
+        return list(res)
+
+    def apply(self, fgraph):
+        tracker = getattr(fgraph, "node_changes", None)
+
+        if tracker is None:
+            tracker = NodeChangeTracker()
+            fgraph.attach_feature(tracker)
+
+        profiled_opts = [lopt for lopt in self.local_optimizers if hasattr(lopt, "profile_stats")]
+        stats_before = [lopt.profile_stats() for lopt in profiled_opts]
+        start_time = time.perf_counter()
+
+        max_use = self.max_use_ratio * max(len(fgraph.apply_nodes), 1)
+        process_count = 0
+
+        nodes = tracker.pop_changed(self)
+
+        while nodes:
+            for node in self.downstream_nodes(nodes):
+                for lopt in self.local_optimizers:
+                    if node not in fgraph.apply_nodes:
+                        break
+
+                    if self.process_node(fgraph, node, lopt):
+                        process_count += 1
+
+                if process_count > max_use:
+                    warn(f"{self} reached its maximum number of replacements ({max_use})")
+                    # Don't lose track of the pending changes.
+                    tracker.consumers[self] = 0
+                    nodes = None
+                    break
+            else:
+                nodes = tracker.pop_changed(self)
+
+        return (
+            self,
+            process_count,
+            time.perf_counter() - start_time,
+            [_profile_stats_delta(lopt, b) for lopt, b in zip(profiled_opts, stats_before)],
+        )
+
+    print_profile = staticmethod(_print_global_opt_profile)
+
+    def print_summary(self, stream=None, level=0, depth=-1):
+        print(f"{' ' * level}{self.__class__.__name__} ({id(self)})", file=stream)
+        if depth != 0:
+            for lopt in self.local_optimizers:
+                lopt.print_summary(stream, level=(level + 2), depth=(depth - 1))
+
+
+def _node_input_expr(node):
+    try:
+        return node.default_output()
+    except AttributeError:
+        return node.outputs
+
+
+def _input_expr_node(input_expr):
+    return input_expr[0].owner if isinstance(input_expr, list) else input_expr.owner
+
+
+def _detached_input_exprs(nodes):
+    """Copy the input terms of nodes into variables that aren't in a `FunctionGraph`.
+
+    The variables in a `FunctionGraph` reference it, so serializing them would
+    serialize the entire graph.  The copies share their common subgraphs.
+    """
+    outputs = [o for node in nodes for o in node.outputs]
+    equiv = clone_get_equiv(tt_inputs(outputs), outputs)
+
+    input_exprs = []
+    for node in nodes:
+        input_expr = _node_input_expr(node)
+        if isinstance(input_expr, list):
+            input_exprs.append([equiv[v] for v in input_expr])
+        else:
+            input_exprs.append(equiv[input_expr])
+
+    return input_exprs
+
+
+def _kanren_match_task(
+    kanren_relation, relation_lvars, results_filter, max_steps, timeout, input_exprs
+):
+    """Produce the `KanrenRelationSub` replacements for a collection of terms.
+
+    This is run in the worker processes of a `ParallelKanrenOptimizer`.  The
+    terms are returned with the replacements, so that they're serialized
+    together and the replacements can be mapped back onto the original terms.
+    The budgets exceeded by each term's search and the searches' statistics
+    are returned, too.
+    """
+    kanren_opt = KanrenRelationSub(
+        kanren_relation,
+        relation_lvars=relation_lvars,
+        results_filter=results_filter,
+        tracks=(),
+        results_cache=False,
+        max_steps=max_steps,
+        timeout=timeout,
+    )
+
+    results = []
+    exceeded = []
+    for input_expr in input_exprs:
+        node = _input_expr_node(input_expr)
+        results.append(kanren_opt._kanren_transform(node, input_expr))
+        exceeded.append(
+            kanren_opt.budget_exceeded.pop().budget if kanren_opt.budget_exceeded else None
+        )
+
+    return input_exprs, results, exceeded, kanren_opt.stats
+
+
+class ParallelKanrenOptimizer(theano.gof.opt.Optimizer):
+    """A global optimizer that runs the miniKanren searches of a `KanrenRelationSub` in a process pool.
+
+    In each pass, the subgraphs of the candidate nodes are sent--in
+    chunks--to worker processes, where the searches are run and their results
+    are reified.  The replacements are then mapped back onto the graph and
+    applied serially.  When a replacement conflicts with an earlier one in the
+    same pass (i.e. its node's subgraph changed), it's skipped and the node is
+    reconsidered in the next pass.  Passes are repeated until no replacements
+    are made.
+
+    The relation, logic variables and results filter of the
+    `KanrenRelationSub` need to be picklable (e.g. module-level functions).
+
+    """
+
+    def __init__(
+        self,
+        kanren_opt,
+        executor=None,
+        max_workers=None,
+        chunks_per_worker=4,
+        max_use_ratio=10,
+        failure_callback=None,
+    ):
+        """Create a `ParallelKanrenOptimizer`.
+
+        Parameters
+        ----------
+        kanren_opt: KanrenRelationSub
+            The local optimizer providing the relation, filters and results
+            cache.
+        executor: concurrent.futures.Executor (optional)
+            The executor used to run the searches.  When not given, a
+            `ProcessPoolExecutor` is created--and shut down--for each
+            application.
+        max_workers: int (optional)
+            The number of worker processes, when `executor` isn't given.
+        chunks_per_worker: int
+            The number of chunks of nodes sent to each worker per pass.  Nodes
+            in the same chunk share the serialization of their common
+            subgraphs.
+        max_use_ratio: int or float
+            At most (size of graph * this number) replacements are made.
+        failure_callback: function (optional)
+            See `NavigatorOptimizer`.
+        """
+        self.kanren_opt = kanren_opt
+        self.executor = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunks_per_worker = chunks_per_worker
+        self.max_use_ratio = max_use_ratio
+        self.failure_callback = failure_callback
+
+    def add_requirements(self, fgraph):
+        super().add_requirements(fgraph)
+        fgraph.attach_feature(theano.gof.toolbox.ReplaceValidate())
+        fgraph.attach_feature(SubgraphFingerprints())
+        self.kanren_opt.add_requirements(fgraph)
+
+    def _match(self, executor, fgraph, nodes):
+        """Produce the replacements for nodes--mapped onto `fgraph`--in the worker processes."""
+        kanren_opt = self.kanren_opt
+        n_chunks = self.max_workers * self.chunks_per_worker
+        chunk_size = max(-(-len(nodes) // n_chunks), 1)
+        chunks = [nodes[i : i + chunk_size] for i in range(0, len(nodes), chunk_size)]
+
+        futures = [
+            executor.submit(
+                _kanren_match_task,
+                kanren_opt.kanren_relation,
+                kanren_opt.relation_lvars,
+                kanren_opt.results_filter,
+                kanren_opt.max_steps,
+                kanren_opt.timeout,
+                _detached_input_exprs([node for node, _ in chunk]),
+            )
+            for chunk in chunks
+        ]
+
+        for chunk, future in zip(chunks, futures):
+            input_exprs, results, exceeded, stats = future.result()
+
+            for k, v in stats.items():
+                kanren_opt.stats[k] += v
+
+            for (node, _), budget in zip(chunk, exceeded):
+                if budget is not None:
+                    kanren_opt.budget_exceeded.append(
+                        BudgetExceededInfo(node, kanren_opt.kanren_relation, budget)
+                    )
+
+            # Map the (copied) terms that were sent back onto the originals.
+            mapping = {}
+            for (node, _), input_expr in zip(chunk, input_exprs):
+                copied_node = _input_expr_node(input_expr)
+                if any(
+                    match_subgraphs(o, n, mapping) is None
+                    for o, n in zip(copied_node.outputs, node.outputs)
+                ):
+                    mapping = None
+                    break
+
+            if mapping is None:  # pragma: no cover
+                continue
+
+            for (node, cache_key), new_node in zip(chunk, results):
+                if new_node is not False:
+                    new_node = clone_replacements(new_node, mapping, fgraph.variables)
+
+                    if new_node is None:  # pragma: no cover
+                        continue
+
+                kanren_opt._cache_result(cache_key, node, new_node)
+
+                yield node, new_node
+
+    def _replace(self, fgraph, node, new_node):
+        """Replace a node's outputs, or the variables in a `dict` of replacements."""
+        if isinstance(new_node, dict):
+            old_vars, new_vars = list(new_node.keys()), list(new_node.values())
+        else:
+            old_vars, new_vars = node.outputs, new_node
+
+        repl_pairs = [(r, r_new) for r, r_new in zip(old_vars, new_vars) if r_new is not r]
+
+        if not repl_pairs:
+            return False
+
+        try:
+            fgraph.replace_all_validate(repl_pairs, reason=self.kanren_opt)
+            return True
+        except Exception as e:
+            if self.failure_callback is not None:
+                self.failure_callback(e, self, repl_pairs, self.kanren_opt, node)
+                return False
+            raise
+
+    def apply(self, fgraph):
+        kanren_opt = self.kanren_opt
+
+        if getattr(fgraph, "subgraph_fingerprints", None) is None:
+            fgraph.attach_feature(SubgraphFingerprints())
+
+        fingerprints = fgraph.subgraph_fingerprints
+        max_use = self.max_use_ratio * max(len(fgraph.apply_nodes), 1)
+        process_count = 0
+
+        stats_before = kanren_opt.profile_stats()
+        start_time = time.perf_counter()
+
+        executor = self.executor or ProcessPoolExecutor(self.max_workers)
+
+        try:
+            changed = True
+            while changed:
+                changed = False
+
+                stats = kanren_opt.stats
+                ready, pending = [], []
+                for node in fgraph.toposort():
+                    stats["calls"] += 1
+
+                    if not kanren_opt.is_candidate(node) or kanren_opt.node_filter(node):
+                        stats["skipped"] += 1
+                        continue
+
+                    cache_key, new_node = kanren_opt._cached_transform(node, _node_input_expr(node))
+
+                    if new_node is None:
+                        pending.append((node, cache_key))
+                    else:
+                        stats["cache_hits"] += 1
+                        if new_node is not False:
+                            ready.append((node, new_node))
+
+                # Snapshot the subgraphs the replacements were produced for.
+                results = [
+                    (node, new_node, [fingerprints.fingerprint(o) for o in node.outputs])
+                    for node, new_node in ready + list(self._match(executor, fgraph, pending))
+                    if new_node is not False
+                ]
+
+                for node, new_node, node_fps in results:
+                    if node not in fgraph.apply_nodes or node_fps != [
+                        fingerprints.fingerprint(o) for o in node.outputs
+                    ]:
+                        # An earlier replacement changed this node's
+                        # subgraph, so its replacements could be invalid.  It
+                        # will be reconsidered in the next pass.
+                        continue
+
+                    if not replacements_valid(
+                        list(new_node.values()) if isinstance(new_node, dict) else new_node,
+                        {},
+                        fgraph.variables,
+                    ):
+                        continue
+
+                    if self._replace(fgraph, node, new_node):
+                        changed = True
+                        process_count += 1
+
+                    if process_count > max_use:
+                        warn(f"{self} reached its maximum number of replacements ({max_use})")
+                        changed = False
+                        break
+        finally:
+            if self.executor is None:
+                executor.shutdown()
+
+        return (
+            self,
+            process_count,
+            time.perf_counter() - start_time,
+            [_profile_stats_delta(kanren_opt, stats_before)],
+        )
+
+    print_profile = staticmethod(_print_global_opt_profile)
+
+    def print_summary(self, stream=None, level=0, depth=-1):
+        print(f"{' ' * level}{self.__class__.__name__} ({id(self)})", file=stream)
+        if depth != 0:
+            self.kanren_opt.print_summary(stream, level=(level + 2), depth=(depth - 1))
+
+
+def node_count_cost(node):
+    """Give every `Apply` node a cost of one."""
+    return 1
+
+
+class EGraph(object):
+    """An e-graph of Theano variables.
+
+    An e-graph partitions terms into equivalence classes ("e-classes").  Its
+    terms ("e-nodes") are `Op` outputs applied to e-classes--instead of
+    specific variables--and leaves (i.e. graph inputs and constants), so the
+    combinations of equivalent sub-terms are represented without being
+    enumerated.
+
+    Each e-node keeps the first Theano variable that produced it (i.e. its
+    "witness"), which is used to match and rebuild the e-node.
+
+    """
+
+    def __init__(self):
+        self._parents = []
+        self.hashcons = OrderedDict()
+        self.witnesses = OrderedDict()
+        self.var_classes = {}
+
+    def __len__(self):
+        return len(self.hashcons)
+
+    @property
+    def classes(self):
+        """Map each e-class to its e-nodes."""
+        res = OrderedDict()
+        for enode, eclass in self.hashcons.items():
+            res.setdefault(self.find(eclass), []).append(enode)
+        return res
+
+    def find(self, eclass):
+        """Return the canonical id of an e-class."""
+        parents = self._parents
+        root = eclass
+        while parents[root] != root:
+            root = parents[root]
+
+        while parents[eclass] != root:
+            parents[eclass], eclass = root, parents[eclass]
+
+        return root
+
+    def _enode(self, var):
+        if var.owner is None:
+            leaf = var.signature() if isinstance(var, tt.TensorConstant) else var
+            return (None, leaf, ())
+
+        node = var.owner
+        return (
+            node.op,
+            node.outputs.index(var),
+            tuple(self.find(self.var_classes[i]) for i in node.inputs),
+        )
+
+    def add(self, var):
+        """Add a variable's graph to the e-graph and return the variable's e-class."""
+        var_classes = self.var_classes
+        stack = [var]
+        while stack:
+            v = stack[-1]
+
+            if v in var_classes:
+                stack.pop()
+                continue
+
+            missing = [] if v.owner is None else [i for i in v.owner.inputs if i not in var_classes]
+
+            if missing:
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+
+            enode = self._enode(v)
+            eclass = self.hashcons.get(enode)
+
+            if eclass is None:
+                eclass = len(self._parents)
+                self._parents.append(eclass)
+                self.hashcons[enode] = eclass
+                self.witnesses[enode] = v
+
+            var_classes[v] = eclass
+
+        return self.find(var_classes[var])
+
+    def union(self, a, b):
+        """Merge two e-classes.
+
+        `rebuild` needs to be called before the e-graph is used again.
+
+        Returns
+        -------
+        bool: Whether or not the e-classes were distinct.
+        """
+        a, b = self.find(a), self.find(b)
+
+        if a == b:
+            return False
+
+        # Keep the oldest id, so that original e-nodes stay first.
+        a, b = min(a, b), max(a, b)
+        self._parents[b] = a
+        return True
+
+    def rebuild(self):
+        """Restore the canonical form of the e-nodes and merge congruent e-classes."""
+        merged = True
+        while merged:
+            merged = False
+            hashcons, witnesses = OrderedDict(), OrderedDict()
 
-from theano.gof.opt import LocalOptimizer, local_optimizer
-from theano.gof.graph import inputs as tt_inputs
-from theano.scan_module.scan_op import Scan
-from theano.scan_module.scan_utils import scan_args, clone as tt_clone
+            for enode, eclass in self.hashcons.items():
+                op, idx, children = enode
+                new_enode = (op, idx, tuple(self.find(c) for c in children))
+                eclass = self.find(eclass)
 
-from unification import var, variables
+                witnesses.setdefault(new_enode, self.witnesses[enode])
+                other = hashcons.setdefault(new_enode, eclass)
 
-from kanren import run
+                if other != eclass:
+                    # Two e-classes contain the same e-node, so they're
+                    # equivalent.
+                    merged |= self.union(other, eclass)
 
-from etuples.core import ExpressionTuple
+            self.hashcons, self.witnesses = hashcons, witnesses
 
-from .meta import MetaSymbol
-from .ops import RandomVariable
+        for enode, eclass in self.hashcons.items():
+            self.hashcons[enode] = self.find(eclass)
 
+    def costs(self, node_cost=node_count_cost):
+        """Compute the cheapest e-node--and its cost--in each e-class.
 
-def eval_and_reify_meta(x):
-    """Get Theano objects from combinations of `etuple`s and meta objects."""
-    res = x
+        The cost of an e-node is the cost of its witness's `Apply` node,
+        according to `node_cost`, plus the costs of its children's cheapest
+        e-nodes; leaves cost nothing.
+        """
+        enode_costs = {
+            enode: 0 if witness.owner is None else node_cost(witness.owner)
+            for enode, witness in self.witnesses.items()
+        }
+
+        best = {}
+        changed = True
+        while changed:
+            changed = False
+            for enode, eclass in self.hashcons.items():
+                eclass = self.find(eclass)
+                try:
+                    cost = enode_costs[enode] + sum(best[c][0] for c in enode[2])
+                except KeyError:
+                    continue
 
-    # Create base objects from the resulting meta object
-    if isinstance(res, ExpressionTuple):
-        res = res.eval_obj
+                if eclass not in best or cost < best[eclass][0]:
+                    best[eclass] = (cost, enode)
+                    changed = True
 
-    if isinstance(res, MetaSymbol):
-        res = res.reify()
+        return best
 
-    if MetaSymbol.is_meta(res):
-        raise ValueError("Kanren results not fully reifiable: {}".format(res))
+    def extract(self, variables, node_cost=node_count_cost):
+        """Construct the cheapest equivalent of each variable.
 
-    return res
+        `node_cost` must be positive, so that the cheapest graphs are acyclic.
+        Sub-terms are shared between the extracted variables, and the original
+        variables are reused where nothing changed.  Variables in e-classes
+        without a finite-cost e-node are returned as they are.
+        """
+        best = self.costs(node_cost)
+        memo = {}
+        res = []
 
+        for var in variables:
+            root = self.find(self.var_classes[var])
 
-def safe_index(lst, x):
-    try:
-        return lst.index(x)
-    except ValueError:
-        return None
+            if root not in best:
+                # None of the e-class's e-nodes have a finite cost (e.g. they
+                # all refer to the e-class itself).
+                res.append(var)
+                continue
 
+            stack = [root]
+            while stack:
+                eclass = stack[-1]
 
-class FunctionGraph(theano.gof.fg.FunctionGraph):
-    """A version of `FunctionGraph` that knows not to merge non-deterministic `Op`s.
+                if eclass in memo:
+                    stack.pop()
+                    continue
 
-    It also performs common operations for input cloning and keeps a map of
-    original/cloned nodes, making the graph much easier to use.
+                op, idx, children = enode = best[eclass][1]
+                missing = [c for c in children if c not in memo]
+
+                if missing:
+                    stack.extend(missing)
+                    continue
+
+                stack.pop()
+
+                witness = self.witnesses[enode]
+                inputs = [memo[c] for c in children]
+
+                if op is None or all(i is w_i for i, w_i in zip(inputs, witness.owner.inputs)):
+                    memo[eclass] = witness
+                else:
+                    try:
+                        new_node = witness.owner.clone_with_new_inputs(inputs)
+                    except TypeError:
+                        new_node = witness.owner.clone_with_new_inputs(inputs, strict=False)
+                    memo[eclass] = new_node.outputs[idx]
+
+            res.append(memo[root])
+
+        return res
+
+
+class KanrenEGraphOptimizer(theano.gof.opt.Optimizer):
+    """A global optimizer that applies miniKanren relations by equality saturation.
+
+    Instead of replacing terms, every result of the relations--up to
+    `results_limit` per search--is added to an `EGraph` of the graph's
+    outputs as an equivalent form.  The relations are applied to the new
+    e-nodes until no new equivalences are found (i.e. the e-graph is
+    saturated) or a budget is exhausted.  The cheapest equivalent outputs are
+    then extracted and replace the originals.
+
+    Relations are matched against "forms" of the e-nodes: their witnesses, and
+    copies of the witnesses that take the witnesses of other e-nodes in their
+    input e-classes as inputs.  A pattern can see the equivalent forms of an
+    e-node's inputs this way, but only the witnesses' forms of the sub-terms
+    below them.
 
     """
 
     def __init__(
         self,
-        inputs,
-        outputs,
-        features=None,
-        clone=True,
-        memo=None,
-        update_mapping=None,
-        copy_inputs=True,
-        copy_orphans=None,
+        relations,
+        results_limit=10,
+        max_forms=10,
+        max_iterations=10,
+        max_nodes=10000,
+        node_cost=node_count_cost,
+        failure_callback=None,
+        **kwargs,
     ):
+        """Create a `KanrenEGraphOptimizer`.
 
-        if clone:
-            if copy_orphans is None:
-                copy_orphans = copy_inputs
+        Parameters
+        ----------
+        relations: Iterable of KanrenRelationSub, kanren.Relation or goal
+            The relations to apply.  Relations that aren't `KanrenRelationSub`s
+            are wrapped in one, using `kwargs`.  Their `tracks`,
+            `node_filter`, logic variables and budgets are used, but not their
+            `results_filter`s or results caches.
+        results_limit: int
+            The maximum number of results taken from each search.
+        max_forms: int
+            The maximum number of forms of each e-node that are searched.
+        max_iterations: int
+            The maximum number of saturation iterations.
+        max_nodes: int
+            Saturation stops once the e-graph has more e-nodes than this.
+        node_cost: function
+            A function that returns the (positive) cost of an `Apply` node.
+        failure_callback: function (optional)
+            See `NavigatorOptimizer`.
+        kwargs:
+            Keyword arguments for `KanrenRelationSub`.
+        """
+        self.kanren_opts = [
+            r if isinstance(r, KanrenRelationSub) else KanrenRelationSub(r, **kwargs)
+            for r in relations
+        ]
+        self.results_limit = results_limit
+        self.max_forms = max_forms
+        self.max_iterations = max_iterations
+        self.max_nodes = max_nodes
+        self.node_cost = node_cost
+        self.failure_callback = failure_callback
 
-            self.memo = theano.gof.graph.clone_get_equiv(
-                inputs, outputs, copy_inputs, copy_orphans, memo
-            )
+    def add_requirements(self, fgraph):
+        super().add_requirements(fgraph)
+        fgraph.attach_feature(theano.gof.toolbox.ReplaceValidate())
 
-            inputs = [self.memo[i] for i in inputs]
-            outputs = [self.memo[o] for o in outputs]
-        else:
-            # We make it possible to use a non-cloned set of inputs and outputs
-            # by cloning only the cached constants and replacing them in the
-            # inputs and output graphs.
-            cached_constants = [x for x in inputs if getattr(x, "cached", False)]
-            copied_constants = tt_clone(cached_constants, share_inputs=False)
-            replacements = list(zip(cached_constants, copied_constants))
-            inputs = list(set(inputs) - set(cached_constants)) + list(copied_constants)
-            outputs = tt_clone(outputs, share_inputs=True, replace=replacements)
+    def _take_results(self, results):
+        return list(islice(results, self.results_limit))
 
-        assert not any(getattr(v, "cached", False) for v in inputs + outputs)
+    def _equivalences(self, kanren_opt, node, result):
+        """Turn a miniKanren result into pairs of equivalent variables."""
+        start_time = time.perf_counter()
 
-        super().__init__(inputs, outputs, features=features, clone=False, update_mapping=None)
+        try:
+            new_node = kanren_opt._reify_result(node, result)
+        finally:
+            kanren_opt.stats["reify_time"] += time.perf_counter() - start_time
 
-    def attach_feature(self, feature):
-        if isinstance(feature, theano.gof.opt.MergeFeature):
-            _process_node = feature.process_node
+        if isinstance(new_node, dict):
+            return list(new_node.items())
 
-            @wraps(feature.process_node)
-            def _f(self, fgraph, node):
-                if getattr(node.op, "nondeterministic", False):
-                    return
-                return _process_node(fgraph, node)
+        return [(o, n) for o, n in zip(node.outputs, new_node) if n is not o]
 
-            feature.process_node = types.MethodType(_f, feature)
+    def _enode_forms(self, egraph, witness, class_members):
+        """Produce the inputs of an e-node's witness and its forms with other members of its input e-classes.
 
-        return super().attach_feature(feature)
+        The witness's inputs come first.  The forms themselves are constructed
+        by `_enode_form`.
+        """
+        inputs_members = []
+        for i in witness.owner.inputs:
+            members = class_members.get(egraph.find(egraph.var_classes[i]), ())
+            inputs_members.append([i] + [m for m in members if m is not i])
 
-    def replace(self, r, new_r, reason=None, verbose=None, remove_dup_inputs=True):
-        """See `theano.gof.fg.FunctionGraph.replace`.
+        return islice(product(*inputs_members), self.max_forms)
 
-        The original `FunctionGraph.replace` will not replace the actual
-        input list.  This one will.
+    def _enode_form(self, witness, inputs):
+        """Construct the form of an e-node's witness with the given inputs, or `None` if it can't be."""
+        node = witness.owner
 
-        """
-        super().replace(r, new_r, reason=reason, verbose=verbose)
+        if all(i is w_i for i, w_i in zip(inputs, node.inputs)):
+            return witness
 
-        if r in self.inputs:
-            # TODO: Is there a reason to do this in-place instead?
-            # Is anyone supposed to hold a reference to the original inputs
-            # list?
+        try:
+            try:
+                new_node = node.clone_with_new_inputs(list(inputs))
+            except TypeError:
+                new_node = node.clone_with_new_inputs(list(inputs), strict=False)
+        except (TypeError, ValueError):
+            return None
 
-            # Remove duplicate inputs, if any.
-            if remove_dup_inputs and new_r in self.inputs:
-                self.inputs.remove(new_r)
+        return new_node.outputs[node.outputs.index(witness)]
 
-            assert r not in self.variables
+    def saturate(self, egraph, stats):
+        """Apply the relations to an e-graph until it's saturated or a budget is exhausted."""
+        # The forms that were searched, keyed on their e-nodes and inputs.
+        searched = set()
 
-            new_inputs = [new_r if i == r else i for i in self.inputs]
-            self.inputs = new_inputs
+        for _ in range(self.max_iterations):
+            stats["iterations"] += 1
+            n_enodes = len(egraph)
+            equivalences = []
 
-            # TODO: Inputs-changed callback?
+            class_members = OrderedDict()
+            for enode, eclass in egraph.hashcons.items():
+                class_members.setdefault(egraph.find(eclass), []).append(egraph.witnesses[enode])
 
-            assert r not in self.inputs
+            # Only the forms that haven't been searched are constructed.
+            forms = []
+            for enode, witness in list(egraph.witnesses.items()):
+                if witness.owner is None:
+                    continue
 
-    def clone_get_equiv(self, *args, **kwargs):
-        fg, var_map = super().clone_get_equiv(*args, **kwargs)
-        fg.__class__ = self.__class__
-        return fg, var_map
+                for inputs in self._enode_forms(egraph, witness, class_members):
+                    form_key = (enode, inputs)
 
+                    if form_key in searched:
+                        continue
 
-class KanrenRelationSub(LocalOptimizer):
-    """A local optimizer that uses miniKanren goals to match and replace terms in a Theano `FunctionGraph`.
+                    searched.add(form_key)
+                    form = self._enode_form(witness, inputs)
 
-    TODO: Only uses *one* miniKanren `run` result (chosen by a configurable
-    filter function).  We might want an option to produce multiple graphs, but
-    I imagine that would involve an entirely different optimizer type.
+                    if form is not None:
+                        forms.append(form)
 
-    """
+            for form in forms:
+                node = form.owner
 
-    reentrant = True
+                candidates = [
+                    kanren_opt
+                    for kanren_opt in self.kanren_opts
+                    if kanren_opt.is_candidate(node) and not kanren_opt.node_filter(node)
+                ]
 
-    def __init__(
-        self,
-        kanren_relation,
-        relation_lvars=None,
-        results_filter=lambda x: next(x, None),
-        node_filter=lambda x: False,
-    ):
-        """Create a `KanrenRelationSub`.
+                if not candidates:
+                    continue
 
-        Parameters
-        ----------
-        kanren_relation: kanren.Relation or goal
-            The miniKanren relation store or goal to use.  Custom goals should
-            take an input and output argument, respectively.
-        relation_lvars: Iterable
-            A collection of terms to be considered logic variables by miniKanren
-            (i.e. Theano terms used as "unknowns" in `kanren_relation`).
-        results_filter: function
-            A function that returns a single result from a stream of
-            miniKanren results.  The default function returns the first result.
-        node_filter: function
-            A function taking a single node as an argument that returns `True`
-            when the node should be skipped.
-        """
-        self.kanren_relation = kanren_relation
-        self.relation_lvars = relation_lvars or []
-        self.results_filter = results_filter
-        self.node_filter = node_filter
-        super().__init__()
+                search_expr = metatize(_node_input_expr(node))
 
-    def adjust_outputs(self, node, new_node, old_node=None):
-        """Make adjustments for multiple outputs.
+                for kanren_opt in candidates:
+                    kanren_opt.stats["calls"] += 1
 
-        This handles (some) nodes with multiple outputs by returning a list
-        with the appropriate length and containing the new node (at the correct
-        index if `default_output` is available and correct, or 0--and it
-        happens to be the correct one).
+                    results = kanren_opt._kanren_search(node, search_expr, self._take_results)
 
-        TODO: We should be able to get the correct index from the something
-        like `node.outputs.index(old_node)`, but we don't exactly have
-        `old_node` unless the miniKanren results give it to us.
+                    if not results:
+                        continue
 
-        """
-        res = list(node.outputs)
-        try:
-            new_node_idx = res.index(old_node)
-        except ValueError:
-            # Guesstimate it
-            new_node_idx = getattr(node.op, "default_output", 0) or 0
+                    kanren_opt.stats["matches"] += 1
 
-        res[new_node_idx] = new_node
-        return res
+                    for result in results:
+                        equivalences.extend(self._equivalences(kanren_opt, node, result))
 
-    def transform(self, node):
-        if not isinstance(node, tt.Apply):
-            return False
+            n_unions = 0
+            for old_var, new_var in equivalences:
+                if not isinstance(new_var, tt.Variable) or new_var.type != old_var.type:
+                    continue
 
-        if self.node_filter(node):
-            return False
+                n_unions += egraph.union(egraph.add(old_var), egraph.add(new_var))
 
-        try:
-            input_expr = node.default_output()
-        except AttributeError:
-            input_expr = node.outputs
+            egraph.rebuild()
+            stats["unions"] += n_unions
 
-        with variables(*self.relation_lvars):
-            q = var()
-            kanren_results = run(None, q, self.kanren_relation(input_expr, q))
+            if n_unions == 0 and len(egraph) == n_enodes:
+                stats["saturated"] = True
+                break
 
-        chosen_res = self.results_filter(kanren_results)
+            if len(egraph) > self.max_nodes:
+                warn(f"{self} reached its maximum number of e-nodes ({self.max_nodes})")
+                break
 
-        if chosen_res:
-            if isinstance(chosen_res, ExpressionTuple):
-                chosen_res = eval_and_reify_meta(chosen_res)
+    def apply(self, fgraph):
+        start_time = time.perf_counter()
+        stats_before = [kanren_opt.profile_stats() for kanren_opt in self.kanren_opts]
+        stats = OrderedDict(
+            [
+                ("iterations", 0),
+                ("unions", 0),
+                ("saturated", False),
+                ("enodes", 0),
+                ("eclasses", 0),
+                ("cost", 0),
+                ("replacements", 0),
+            ]
+        )
 
-            if isinstance(chosen_res, dict):
-                chosen_res = list(chosen_res.items())
+        egraph = EGraph()
+        for out in fgraph.outputs:
+            egraph.add(out)
 
-            if isinstance(chosen_res, list):
-                # We got a dictionary of replacements
-                new_node = {eval_and_reify_meta(k): eval_and_reify_meta(v) for k, v in chosen_res}
+        self.saturate(egraph, stats)
 
-                assert all(k in node.fgraph.variables for k in new_node.keys())
-            elif isinstance(chosen_res, tt.Variable):
-                # Attempt to automatically format the output for multi-output
-                # `Apply` nodes.
-                new_node = self.adjust_outputs(node, eval_and_reify_meta(chosen_res))
-            else:
-                raise ValueError(
-                    "Unsupported FunctionGraph replacement variable type: {chosen_res}"
-                )  # pragma: no cover
+        best = egraph.costs(self.node_cost)
+        stats["enodes"] = len(egraph)
+        stats["eclasses"] = len(egraph.classes)
+        stats["cost"] = sum(
+            best.get(egraph.find(egraph.var_classes[o]), (0,))[0] for o in fgraph.outputs
+        )
 
-            return new_node
-        else:
-            return False
+        new_outputs = egraph.extract(fgraph.outputs, self.node_cost)
+        repl_pairs = [
+            (o, n) for o, n in zip(fgraph.outputs, new_outputs) if n is not o and n.type == o.type
+        ]
+
+        if repl_pairs:
+            try:
+                fgraph.replace_all_validate(repl_pairs, reason=self)
+                stats["replacements"] = len(repl_pairs)
+            except Exception as e:
+                if self.failure_callback is None:
+                    raise
+                self.failure_callback(e, self, repl_pairs, self, None)
+
+        stats["time"] = time.perf_counter() - start_time
+
+        return (
+            self,
+            stats,
+            [
+                _profile_stats_delta(kanren_opt, before)
+                for kanren_opt, before in zip(self.kanren_opts, stats_before)
+            ],
+        )
+
+    @staticmethod
+    def print_profile(stream, prof, level=0):
+        opt, stats, lopt_profs = prof
+        blanc = "    " * level
+        print(blanc, opt.__class__.__name__, getattr(opt, "name", ""), file=stream)
+        for name, value in stats.items():
+            print(blanc, f"  {name} {value}", file=stream)
+        for lopt_prof in lopt_profs:
+            lopt_prof[0].print_profile(stream, lopt_prof, level=level + 1)
+
+    def print_summary(self, stream=None, level=0, depth=-1):
+        print(f"{' ' * level}{self.__class__.__name__} ({id(self)})", file=stream)
+        if depth != 0:
+            for kanren_opt in self.kanren_opts:
+                kanren_opt.print_summary(stream, level=(level + 2), depth=(depth - 1))
 
 
 FieldInfo = namedtuple("FieldInfo", ("name", "agg_name", "index", "inner_index", "agg_index"))
 
 
+class ScanArgsField(IndexedList):
+    """A `ScanArgs` field list that clears its owner's indices when it changes."""
+
+    _owner = None
+
+    def _changed(self, positions=None):
+        super()._changed(positions)
+        if self._owner is not None:
+            self._owner._clear_indices()
+
+
 class ScanArgs(scan_args):
-    """An improved version of `theano.scan_module.scan_utils`."""
+    """An improved version of `theano.scan_module.scan_utils`.
+
+    The field lists are `ScanArgsField`s, so that the fields containing each
+    variable, `var_mappings` and the inner-graph dependencies can be
+    indexed--and re-indexed after the fields change.
+
+    """
 
     default_filter = lambda x: x.startswith("inner_") or x.startswith("outer_")
     nested_list_fields = ("inner_in_mit_mot", "inner_in_mit_sot", "inner_out_mit_mot")
+    owned_field_prefixes = ("inner_in", "inner_out", "outer_in", "outer_out", "cond")
+
+    _field_index = None
+    _var_mappings = None
+    _inner_dependents = None
 
     def __init__(self, *args, **kwargs):
         # Prevent unnecessary and counter-productive cloning.
@@ -266,6 +2757,39 @@ class ScanArgs(scan_args):
         ):
             super().__init__(*args, **kwargs)
 
+    def __setattr__(self, name, value):
+        if name.startswith(self.owned_field_prefixes) and isinstance(value, list):
+            value = self._own_field(value)
+
+            if name in self.nested_list_fields:
+                for n, sub_lst in enumerate(value):
+                    list.__setitem__(value, n, self._own_field(sub_lst))
+
+            self._clear_indices()
+
+        super().__setattr__(name, value)
+
+    def _own_field(self, lst):
+        """Make a list--or a copy of it, if another object owns it--a field of this object."""
+        owner = getattr(lst, "_owner", None)
+        if not isinstance(lst, ScanArgsField) or (owner is not None and owner is not self):
+            lst = ScanArgsField(lst)
+        lst._owner = self
+        return lst
+
+    def __copy__(self):
+        # Copies of the field lists--including nested ones--are owned by the
+        # new object.
+        res = super().__copy__()
+        for name in self.nested_list_fields:
+            setattr(res, name, [copy(sub_lst) for sub_lst in getattr(self, name)])
+        return res
+
+    def _clear_indices(self):
+        self._field_index = None
+        self._var_mappings = None
+        self._inner_dependents = None
+
     @staticmethod
     def from_node(node):
         if not isinstance(node.op, Scan):
@@ -316,7 +2840,74 @@ class ScanArgs(scan_args):
 
     @property
     def var_mappings(self):
-        return Scan.get_oinp_iinp_iout_oout_mappings(self)
+        if self._var_mappings is None:
+            self._var_mappings = Scan.get_oinp_iinp_iout_oout_mappings(self)
+        return self._var_mappings
+
+    @property
+    def field_index(self):
+        """Map variables to the `FieldInfo`s of the fields containing them.
+
+        The `FieldInfo`s for a variable are in the order of `field_names`, and
+        only the first occurrence in each field is included.  Only fields
+        accepted by `default_filter` are indexed.
+        """
+        if self._field_index is None:
+            index = {}
+            agg_positions = {}
+
+            for field_name in filter(ScanArgs.default_filter, self.field_names):
+                agg_field_name = self._agg_field_name(field_name)
+
+                if agg_field_name not in agg_positions:
+                    agg_positions[agg_field_name] = IndexedList(
+                        getattr(self, agg_field_name)
+                    ).positions
+
+                agg_pos = agg_positions[agg_field_name]
+                lst = getattr(self, field_name)
+
+                if field_name in self.nested_list_fields:
+                    # Sub-lists that were added after the field was set
+                    # need to be owned, so that their changes are tracked.
+                    for n, sub_lst in enumerate(lst):
+                        list.__setitem__(lst, n, self._own_field(sub_lst))
+
+                    elements = (
+                        (n, idx, v) for n, sub in enumerate(lst) for idx, v in enumerate(sub)
+                    )
+                else:
+                    elements = ((idx, None, v) for idx, v in enumerate(lst))
+
+                for idx, inner_idx, v in elements:
+                    infos = index.setdefault(v, [])
+                    if not infos or infos[-1].name != field_name:
+                        infos.append(
+                            FieldInfo(field_name, agg_field_name, idx, inner_idx, agg_pos[v][0])
+                        )
+
+            self._field_index = index
+
+        return self._field_index
+
+    @property
+    def inner_dependents(self):
+        """Map the inputs of the inner-graph outputs to the outputs that depend on them."""
+        if self._inner_dependents is None:
+            dependents = {}
+            for out_n in self.inner_outputs:
+                for i in tt_inputs([out_n]):
+                    dependents.setdefault(i, []).append(out_n)
+            self._inner_dependents = dependents
+        return self._inner_dependents
+
+    @staticmethod
+    def _agg_field_name(field_name):
+        field_prefix = field_name[:8]
+        if field_prefix.endswith("in"):
+            return "{}puts".format(field_prefix)
+        else:
+            return "{}tputs".format(field_prefix)
 
     @property
     def field_names(self):
@@ -386,30 +2977,15 @@ class ScanArgs(scan_args):
 
         """
 
-        field_names = filter(field_filter, self.field_names)
-
-        for field_name in field_names:
-            lst = getattr(self, field_name)
-
-            field_prefix = field_name[:8]
-            if field_prefix.endswith("in"):
-                agg_field_name = "{}puts".format(field_prefix)
-            else:
-                agg_field_name = "{}tputs".format(field_prefix)
-
-            agg_list = getattr(self, agg_field_name)
+        try:
+            field_infos = self.field_index.get(i, ())
+        except TypeError:
+            # Unhashable objects (e.g. lists) can't be field elements.
+            return None
 
-            if field_name in self.nested_list_fields:
-                for n, sub_lst in enumerate(lst):
-                    idx = safe_index(sub_lst, i)
-                    if idx is not None:
-                        agg_idx = safe_index(agg_list, i)
-                        return FieldInfo(field_name, agg_field_name, n, idx, agg_idx)
-            else:
-                idx = safe_index(lst, i)
-                if idx is not None:
-                    agg_idx = safe_index(agg_list, i)
-                    return FieldInfo(field_name, agg_field_name, idx, None, agg_idx)
+        for field_info in field_infos:
+            if field_filter(field_info.name):
+                return field_info
 
         return None
 
@@ -484,10 +3060,9 @@ class ScanArgs(scan_args):
         if field_info.name.startswith("inner_in"):
             # If starting from an inner-input, then we need to find any
             # inner-outputs that depend on it.
-            for out_n in self.inner_outputs:
-                if i in tt_inputs([out_n]):
-                    if out_n not in seen:
-                        dependent_nodes.add(out_n)
+            for out_n in self.inner_dependents.get(i, ()):
+                if out_n not in seen:
+                    dependent_nodes.add(out_n)
 
         for n in tuple(dependent_nodes):
             if n in seen:
@@ -632,6 +3207,43 @@ def convert_outer_out_to_in(input_scan_args, var, inner_out_fn=None, output_scan
     converted to an outer-graph input, and a variable that is a clone of `var`
     and serves as the new outer-graph input term.
 
+    """
+    output_scan_args, (new_outer_input_var,) = convert_outer_outs_to_ins(
+        input_scan_args, [var], inner_out_fn=inner_out_fn, output_scan_args=output_scan_args
+    )
+    return output_scan_args, new_outer_input_var
+
+
+def convert_outer_outs_to_ins(
+    input_scan_args, outer_out_vars, inner_out_fn=None, output_scan_args=None
+):
+    """Convert multiple outer-graph outputs into outer-graph inputs at once.
+
+    This is equivalent to applying `convert_outer_out_to_in` to each of
+    `outer_out_vars` in turn, but the inner-graph outputs are only cloned once
+    and the `ScanArgs` are copied once.
+
+    Parameters
+    ----------
+    input_scan_args: ScanArgs
+        The source scan arguments.
+    outer_out_vars: Sequence of TensorVariable
+        The outer-graph output variables that are to be converted into
+        outer-graph inputs.
+    inner_out_fn: function (Optional)
+        See `convert_outer_out_to_in`.  It's given the inner-graph outputs of
+        `input_scan_args`, and references to the converted inner-graph
+        outputs in its results are replaced by the new inner-graph inputs.
+    output_scan_args: ScanArgs (Optional)
+        See `convert_outer_out_to_in`.
+
+    Outputs
+    -------
+    (ScanArgs, List[TensorVariable])
+    A tuple containing a `ScanArgs` object for a `Scan` in which
+    `outer_out_vars` have been converted to outer-graph inputs, and the new
+    outer-graph input terms for each of `outer_out_vars`.
+
     """
     replacing = False
     if output_scan_args is None:
@@ -642,101 +3254,137 @@ def convert_outer_out_to_in(input_scan_args, var, inner_out_fn=None, output_scan
         if output_scan_args is input_scan_args:
             output_scan_args = copy(input_scan_args)
 
-    var_info = input_scan_args.find_among_fields(
-        var, field_filter=lambda x: x.startswith("outer_out")
-    )
+    old_inner_out_vars = []
+    inner_out_infos = []
+    for var in outer_out_vars:
+        var_info = input_scan_args.find_among_fields(
+            var, field_filter=lambda x: x.startswith("outer_out")
+        )
 
-    old_inner_out_var = input_scan_args.get_alt_field(var_info, "inner_out")
+        old_inner_out_var = input_scan_args.get_alt_field(var_info, "inner_out")
+        old_inner_out_vars.append(old_inner_out_var)
 
-    if replacing:
-        output_scan_args.remove_from_fields(old_inner_out_var, rm_dependents=False)
-        # Remove the old outer-output variable.
-        # Not sure if this really matters, since we don't use the outer-outputs
-        # when building a new `Scan`, but doing it keeps the `ScanArgs` object
-        # consistent.
-        output_scan_args.remove_from_fields(var, rm_dependents=False)
-
-    # Couldn't one do the same with `var_info`?
-    inner_out_info = input_scan_args.find_among_fields(
-        old_inner_out_var, field_filter=lambda x: x.startswith("inner_out")
-    )
+        # Couldn't one do the same with `var_info`?
+        inner_out_infos.append(
+            input_scan_args.find_among_fields(
+                old_inner_out_var, field_filter=lambda x: x.startswith("inner_out")
+            )
+        )
 
-    # Use the index for the specific inner-graph sub-collection to which this
-    # variable belongs (e.g. index `1` among the inner-graph sit-sot terms)
-    var_idx = inner_out_info.index
+        if replacing:
+            output_scan_args.remove_from_fields(old_inner_out_var, rm_dependents=False)
+            # Remove the old outer-output variable.
+            # Not sure if this really matters, since we don't use the outer-outputs
+            # when building a new `Scan`, but doing it keeps the `ScanArgs` object
+            # consistent.
+            output_scan_args.remove_from_fields(var, rm_dependents=False)
+
+    # The old inner-output variables become new inner-inputs
+    inner_in_vars = [v.clone() for v in old_inner_out_vars]
 
-    # The old inner-output variable becomes the a new inner-input
-    inner_in_var = old_inner_out_var.clone()
+    new_inner_out_vars = []
+    if inner_out_fn:
+        new_inner_out_vars = [
+            inner_out_fn(input_scan_args, old_inner_out_var, inner_in_var, output_scan_args)
+            for old_inner_out_var, inner_in_var in zip(old_inner_out_vars, inner_in_vars)
+        ]
 
     # We need to clone any existing inner-output variables in the `ScanArgs`
-    # object that we're mutating and replace references to `old_inner_out_var`
-    # with `inner_in_var`.  If we don't, then any other inner-outputs that
-    # reference the inner-output that we're replacing will be inconsistent.
-    # Instead, we want those other inner-outputs to reference the new
-    # inner-input replacement variable.
-    for io_var in list(output_scan_args.inner_outputs):
-        io_var_info = output_scan_args.find_among_fields(
-            io_var, field_filter=lambda x: x.startswith("inner_out")
-        )
+    # object that we're mutating and replace references to the old
+    # inner-outputs with their new inner-inputs.  If we don't, then any other
+    # inner-outputs that reference the inner-outputs that we're replacing will
+    # be inconsistent.  Instead, we want those other inner-outputs to
+    # reference the new inner-input replacement variables.
+    io_vars = list(output_scan_args.inner_outputs)
+    io_var_infos = [
+        output_scan_args.find_among_fields(io_var, field_filter=lambda x: x.startswith("inner_out"))
+        for io_var in io_vars
+    ]
+
+    new_io_vars = tt_clone(
+        io_vars + new_inner_out_vars, replace=dict(zip(old_inner_out_vars, inner_in_vars))
+    )
+
+    for io_var_info, new_io_var in zip(io_var_infos, new_io_vars):
+        if io_var_info is None:  # pragma: no cover
+            # E.g. the condition of a "while" loop.
+            continue
+
         io_sub_list = getattr(output_scan_args, io_var_info.name)
 
-        (new_io_var,) = tt_clone([io_var], replace={old_inner_out_var: inner_in_var})
+        if io_var_info.inner_index is not None:
+            io_sub_list = io_sub_list[io_var_info.index]
+            io_sub_list[io_var_info.inner_index] = new_io_var
+        else:
+            io_sub_list[io_var_info.index] = new_io_var
 
-        io_sub_list[io_var_info.index] = new_io_var
+    new_inner_out_vars = new_io_vars[len(io_vars) :]
 
-    # If we're replacing a [m|s]it-sot, then we need to add a new nit-sot
-    add_nit_sot = False
-    inner_in_seqs = [inner_in_var]
-    if inner_out_info.name.endswith("mit_sot"):
-        inner_in_seqs = input_scan_args.inner_in_mit_sot[var_idx] + inner_in_seqs
-        if replacing:
-            output_scan_args.inner_in_mit_sot.pop(var_idx)
-            output_scan_args.outer_in_mit_sot.pop(var_idx)
-        add_nit_sot = True
-    elif inner_out_info.name.endswith("sit_sot"):
-        inner_in_seqs = [input_scan_args.inner_in_sit_sot[var_idx]] + inner_in_seqs
-        if replacing:
-            output_scan_args.inner_in_sit_sot.pop(var_idx)
-            output_scan_args.outer_in_sit_sot.pop(var_idx)
-        add_nit_sot = True
+    if replacing:
+        # Remove the old [m|s]it-sot inputs, starting from the end, so that
+        # the remaining indices stay valid.
+        for inner_out_info in sorted(inner_out_infos, key=lambda x: x.index, reverse=True):
+            if inner_out_info.name.endswith("mit_sot"):
+                output_scan_args.inner_in_mit_sot.pop(inner_out_info.index)
+                output_scan_args.outer_in_mit_sot.pop(inner_out_info.index)
+                output_scan_args.mit_sot_in_slices.pop(inner_out_info.index)
+            elif inner_out_info.name.endswith("sit_sot"):
+                output_scan_args.inner_in_sit_sot.pop(inner_out_info.index)
+                output_scan_args.outer_in_sit_sot.pop(inner_out_info.index)
+
+    new_outer_input_vars = []
+    for var, inner_out_info, inner_in_var, new_inner_out_var in zip(
+        outer_out_vars,
+        inner_out_infos,
+        inner_in_vars,
+        new_inner_out_vars or [None] * len(outer_out_vars),
+    ):
+        # Use the index for the specific inner-graph sub-collection to which this
+        # variable belongs (e.g. index `1` among the inner-graph sit-sot terms)
+        var_idx = inner_out_info.index
 
-    taps = [0]
-    if inner_out_info.name.endswith("mit_sot"):
-        taps = input_scan_args.mit_sot_in_slices[var_idx] + taps
-        if replacing:
-            output_scan_args.mit_sot_in_slices.pop(var_idx)
-    elif inner_out_info.name.endswith("sit_sot"):
-        taps = [-1] + taps
+        # If we're replacing a [m|s]it-sot, then we need to add a new nit-sot
+        add_nit_sot = False
+        inner_in_seqs = [inner_in_var]
+        taps = [0]
+        if inner_out_info.name.endswith("mit_sot"):
+            inner_in_seqs = input_scan_args.inner_in_mit_sot[var_idx] + inner_in_seqs
+            taps = input_scan_args.mit_sot_in_slices[var_idx] + taps
+            add_nit_sot = True
+        elif inner_out_info.name.endswith("sit_sot"):
+            inner_in_seqs = [input_scan_args.inner_in_sit_sot[var_idx]] + inner_in_seqs
+            taps = [-1] + taps
+            add_nit_sot = True
 
-    taps, inner_in_seqs = zip(*sorted(zip(taps, inner_in_seqs), key=lambda x: x[0]))
+        taps, inner_in_seqs = zip(*sorted(zip(taps, inner_in_seqs), key=lambda x: x[0]))
 
-    inner_in_seqs = list(reversed(inner_in_seqs))
-    output_scan_args.inner_in_seqs += inner_in_seqs
+        inner_in_seqs = list(reversed(inner_in_seqs))
+        output_scan_args.inner_in_seqs += inner_in_seqs
 
-    taps = np.asarray(taps)
-    slice_seqs = zip(-taps, [n if n < 0 else None for n in reversed(taps)])
+        taps = np.asarray(taps)
+        slice_seqs = zip(-taps, [n if n < 0 else None for n in reversed(taps)])
 
-    # We could clone `var`, but reusing it will make things easier down the
-    # line (e.g. avoid the need to remap cloned variables)
-    # new_input_var = var.clone()
-    new_outer_input_var = var.clone()
-    if new_outer_input_var.name:
-        new_outer_input_var.name = new_outer_input_var.name.lower()
+        # We could clone `var`, but reusing it will make things easier down the
+        # line (e.g. avoid the need to remap cloned variables)
+        # new_input_var = var.clone()
+        new_outer_input_var = var.clone()
+        if new_outer_input_var.name:
+            new_outer_input_var.name = new_outer_input_var.name.lower()
 
-    var_slices = [new_outer_input_var[b:e] for b, e in slice_seqs]
-    n_steps = tt.min([tt.shape(n)[0] for n in var_slices])
+        new_outer_input_vars.append(new_outer_input_var)
 
-    if output_scan_args.n_steps is None or replacing:
-        output_scan_args.n_steps = n_steps
+        var_slices = [new_outer_input_var[b:e] for b, e in slice_seqs]
+        n_steps = tt.min([tt.shape(n)[0] for n in var_slices])
 
-    output_scan_args.outer_in_seqs += [v[:n_steps] for v in var_slices]
+        if output_scan_args.n_steps is None or replacing:
+            output_scan_args.n_steps = n_steps
 
-    if not replacing or add_nit_sot:
-        output_scan_args.outer_in_nit_sot += [n_steps]
+        output_scan_args.outer_in_seqs += [v[:n_steps] for v in var_slices]
 
-    if inner_out_fn:
-        output_scan_args.inner_out_nit_sot += [
-            inner_out_fn(input_scan_args, old_inner_out_var, inner_in_var, output_scan_args)
-        ]
+        if not replacing or add_nit_sot:
+            output_scan_args.outer_in_nit_sot += [n_steps]
 
-    return output_scan_args, new_outer_input_var
+        if inner_out_fn:
+            output_scan_args.inner_out_nit_sot += [new_inner_out_var]
+
+    return output_scan_args, new_outer_input_vars
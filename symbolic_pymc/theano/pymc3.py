@@ -70,7 +70,7 @@ from .utils import (
     get_random_outer_outputs,
     construct_scan,
 )
-from .opt import FunctionGraph, push_out_rvs_from_scan, convert_outer_out_to_in, ScanArgs
+from .opt import FunctionGraph, push_out_rvs_from_scan, convert_outer_outs_to_ins, ScanArgs
 
 logger = logging.getLogger("symbolic_pymc")
 
@@ -165,11 +165,11 @@ def logp(*output_vars):
             scan_args = ScanArgs.from_node(node)
             rv_outer_outs = get_random_outer_outputs(scan_args)
 
-            for var_idx, var, io_var in rv_outer_outs:
-                scan_args, new_oi_var = convert_outer_out_to_in(
-                    scan_args, var, inner_out_fn=create_inner_out_logp, output_scan_args=scan_args
-                )
-                replacements[var] = new_oi_var
+            rv_vars = [var for var_idx, var, io_var in rv_outer_outs]
+            scan_args, new_oi_vars = convert_outer_outs_to_ins(
+                scan_args, rv_vars, inner_out_fn=create_inner_out_logp, output_scan_args=scan_args
+            )
+            replacements.update(zip(rv_vars, new_oi_vars))
 
             logp_scan_out = construct_scan(scan_args)
 
@@ -1,13 +1,25 @@
+import weakref
+
 import numpy as np
 
 from operator import ne, attrgetter, itemgetter
+from itertools import islice
 from collections import namedtuple
 from collections.abc import Hashable, Sequence, Mapping
 
-from unification import isvar, Var
+from functools import partial
+
+from unification import isvar, reify, Var
+
+from kanren.core import lall
 
 from toolz import compose
 
+from cachetools import LRUCache
+
+from multipledispatch import Dispatcher
+from multipledispatch.dispatcher import MDNotImplementedError, str_signature
+
 import symbolic_pymc as sp
 
 
@@ -37,6 +49,448 @@ class HashableNDArray(np.ndarray, Hashable):
         return NotImplemented
 
 
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class _WeakCacheKey(weakref.ref):
+    """A weak reference that hashes and compares like its referent."""
+
+    __slots__ = ("_hash",)
+
+    def __new__(cls, obj, callback=None):
+        self = weakref.ref.__new__(cls, obj, callback)
+        self._hash = hash(obj)
+        return self
+
+    def __init__(self, obj, callback=None):
+        super().__init__(obj, callback)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+
+        if not isinstance(other, _WeakCacheKey):
+            return False
+
+        self_obj, other_obj = self(), other()
+        return self_obj is not None and (self_obj is other_obj or self_obj == other_obj)
+
+
+class InstrumentedLRUCache(LRUCache):
+    """A size-bounded LRU cache that counts hits, misses and evictions.
+
+    Usage
+    -----
+        >>> from symbolic_pymc.utils import InstrumentedLRUCache
+        >>> cache = InstrumentedLRUCache(2)
+        >>> cache[1] = "a"; cache[2] = "b"; cache[3] = "c"
+        >>> cache[3]
+        'c'
+        >>> 1 in cache
+        False
+        >>> cache.cache_info()
+        CacheInfo(hits=1, misses=0, evictions=1, maxsize=2, currsize=2)
+
+    Parameters
+    ----------
+    maxsize: int
+        The maximum number of entries.
+    getsizeof: Callable (optional)
+        A function that returns the size of an entry.
+    weak_keys: bool
+        When `True`, keys that support weak references are only weakly
+        referenced by the cache, and their entries are removed when the keys are
+        garbage collected.  Keep in mind that a value which references its
+        key will still keep the key alive.
+    """
+
+    def __init__(self, maxsize, getsizeof=None, weak_keys=False):
+        super().__init__(maxsize, getsizeof=getsizeof)
+        self.weak_keys = weak_keys
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self_ref = weakref.ref(self)
+
+        def _remove_dead_key(wr):
+            cache = self_ref()
+            if cache is not None:
+                try:
+                    LRUCache.__delitem__(cache, wr)
+                except KeyError:  # pragma: no cover
+                    pass
+
+        self._remove_dead_key = _remove_dead_key
+
+    def _cache_key(self, key, new=False):
+        if not self.weak_keys or isinstance(key, _WeakCacheKey):
+            return key
+
+        try:
+            return _WeakCacheKey(key, self._remove_dead_key if new else None)
+        except TypeError:
+            # The key doesn't support weak references.
+            return key
+
+    def __getitem__(self, key):
+        try:
+            value = super().__getitem__(self._cache_key(key))
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(self._cache_key(key, new=True), value)
+
+    def __delitem__(self, key):
+        super().__delitem__(self._cache_key(key))
+
+    def __contains__(self, key):
+        return super().__contains__(self._cache_key(key))
+
+    def _popitem(self):
+        # `LRUCache.popitem` uses `__getitem__`, which we don't want to count
+        # as a hit.
+        hits = self.hits
+        try:
+            return super().popitem()
+        finally:
+            self.hits = hits
+
+    def popitem(self):
+        res = self._popitem()
+        self.evictions += 1
+        return res
+
+    def clear(self):
+        """Remove all entries without counting them as evictions."""
+        while self:
+            self._popitem()
+
+    def reset_info(self):
+        """Reset the hit, miss and eviction counters."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cache_info(self):
+        """Return a `CacheInfo` with the cache's statistics."""
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, self.currsize)
+
+
+class TypeDispatcher(Dispatcher):
+    """A single-argument `Dispatcher` that caches implementations by concrete type.
+
+    The implementation resolved for an argument's type is stored in a plain
+    `dict` keyed on that type, so repeated calls skip signature construction
+    and MRO-based resolution.  The cache is cleared whenever a new
+    implementation is added.
+
+    Usage
+    -----
+        >>> from symbolic_pymc.utils import TypeDispatcher
+        >>> f = TypeDispatcher("f")
+        >>> @f.register(object)
+        ... def f_object(x):
+        ...     return "object"
+        >>> f(1), f(2), f("a")
+        ('object', 'object', 'object')
+        >>> f.cache_info()
+        CacheInfo(hits=1, misses=2, evictions=0, maxsize=None, currsize=2)
+    """
+
+    __slots__ = ("_type_cache", "hits", "misses", "evictions")
+
+    def __init__(self, name, doc=None):
+        super().__init__(name, doc=doc)
+        self._type_cache = {}
+        self.reset_info()
+
+    def __setstate__(self, d):
+        super().__setstate__(d)
+        self._type_cache = {}
+        self.reset_info()
+
+    def add(self, signature, func):
+        super().add(signature, func)
+        self.evictions += len(self._type_cache)
+        self._type_cache.clear()
+
+    def __call__(self, obj):
+        obj_type = type(obj)
+        try:
+            func = self._type_cache[obj_type]
+        except KeyError:
+            self.misses += 1
+            func = self.dispatch(obj_type)
+            if func is None:
+                raise NotImplementedError(
+                    "Could not find signature for %s: <%s>"
+                    % (self.name, str_signature((obj_type,)))
+                )
+            self._type_cache[obj_type] = func
+        else:
+            self.hits += 1
+
+        try:
+            return func(obj)
+        except MDNotImplementedError:
+            # Try the remaining implementations in resolution order.
+            funcs = self.dispatch_iter(obj_type)
+            next(funcs)
+            for func in funcs:
+                try:
+                    return func(obj)
+                except MDNotImplementedError:
+                    pass
+
+            raise NotImplementedError(
+                "Matching functions for %s: <%s> found, but none completed successfully"
+                % (self.name, str_signature((obj_type,)))
+            )
+
+    def reset_info(self):
+        """Reset the hit, miss and eviction counters."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cache_info(self):
+        """Return a `CacheInfo` with the resolved implementation cache's statistics."""
+        return CacheInfo(self.hits, self.misses, self.evictions, None, len(self._type_cache))
+
+
+_HAMT_BITS = 5
+_HAMT_MASK = (1 << _HAMT_BITS) - 1
+
+# Marks the entries of a `_HAMTBitmapNode` that hold sub-nodes instead of keys.
+_hamt_node_entry = object()
+_hamt_missing = object()
+
+
+def _popcount(x):
+    return bin(x).count("1")
+
+
+class _HAMTBitmapNode(object):
+    """A `PersistentMap` trie node with up to 32 entries, indexed by a bitmap of hash fragments.
+
+    The entries are stored as a flat tuple of key and value pairs, where the
+    key is `_hamt_node_entry` when the value is a sub-node.
+    """
+
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class _HAMTCollisionNode(object):
+    """A `PersistentMap` trie node holding the keys that share a full hash value."""
+
+    __slots__ = ("hash", "entries")
+
+    def __init__(self, hash, entries):
+        self.hash = hash
+        self.entries = entries
+
+
+_hamt_empty_node = _HAMTBitmapNode(0, ())
+
+
+def _hamt_get(node, shift, h, key):
+    while True:
+        if type(node) is _HAMTCollisionNode:
+            entries = node.entries
+            for i in range(0, len(entries), 2):
+                if entries[i] is key or entries[i] == key:
+                    return entries[i + 1]
+            return _hamt_missing
+
+        bit = 1 << ((h >> shift) & _HAMT_MASK)
+        if not node.bitmap & bit:
+            return _hamt_missing
+
+        i = 2 * _popcount(node.bitmap & (bit - 1))
+        k, v = node.entries[i], node.entries[i + 1]
+
+        if k is _hamt_node_entry:
+            node = v
+            shift += _HAMT_BITS
+        elif k is key or k == key:
+            return v
+        else:
+            return _hamt_missing
+
+
+def _hamt_pair_node(shift, k1, v1, h2, k2, v2):
+    h1 = hash(k1)
+
+    if h1 == h2:
+        return _HAMTCollisionNode(h1, (k1, v1, k2, v2))
+
+    node, _ = _hamt_assoc(_hamt_empty_node, shift, h1, k1, v1)
+    node, _ = _hamt_assoc(node, shift, h2, k2, v2)
+    return node
+
+
+def _hamt_assoc(node, shift, h, key, value):
+    """Return a node with `key` set to `value` and whether a new key was added."""
+    if type(node) is _HAMTCollisionNode:
+        entries = node.entries
+
+        if h == node.hash:
+            for i in range(0, len(entries), 2):
+                if entries[i] is key or entries[i] == key:
+                    if entries[i + 1] is value:
+                        return node, False
+                    entries = entries[: i + 1] + (value,) + entries[i + 2 :]
+                    return _HAMTCollisionNode(h, entries), False
+
+            return _HAMTCollisionNode(h, entries + (key, value)), True
+
+        # Put the collision node under a bitmap node, and add the new key to
+        # that.
+        node = _HAMTBitmapNode(1 << ((node.hash >> shift) & _HAMT_MASK), (_hamt_node_entry, node))
+
+    bit = 1 << ((h >> shift) & _HAMT_MASK)
+    entries = node.entries
+    i = 2 * _popcount(node.bitmap & (bit - 1))
+
+    if not node.bitmap & bit:
+        return _HAMTBitmapNode(node.bitmap | bit, entries[:i] + (key, value) + entries[i:]), True
+
+    k, v = entries[i], entries[i + 1]
+
+    if k is _hamt_node_entry:
+        child, added = _hamt_assoc(v, shift + _HAMT_BITS, h, key, value)
+        if child is v:
+            return node, False
+        return _HAMTBitmapNode(node.bitmap, entries[: i + 1] + (child,) + entries[i + 2 :]), added
+
+    if k is key or k == key:
+        if v is value:
+            return node, False
+        return _HAMTBitmapNode(node.bitmap, entries[: i + 1] + (value,) + entries[i + 2 :]), False
+
+    child = _hamt_pair_node(shift + _HAMT_BITS, k, v, h, key, value)
+    entries = entries[:i] + (_hamt_node_entry, child) + entries[i + 2 :]
+    return _HAMTBitmapNode(node.bitmap, entries), True
+
+
+def _hamt_items(node):
+    stack = [node]
+    while stack:
+        entries = stack.pop().entries
+        for i in range(0, len(entries), 2):
+            if entries[i] is _hamt_node_entry:
+                stack.append(entries[i + 1])
+            else:
+                yield entries[i], entries[i + 1]
+
+
+class PersistentMap(Mapping):
+    """An immutable mapping implemented as a hash array mapped trie (HAMT).
+
+    `PersistentMap.assoc` returns a new map that shares all but the
+    `O(log n)` trie nodes on the path to the new entry with the old one,
+    instead of copying the whole map like `dict`-based miniKanren states do
+    for each new logic variable binding.
+
+    Usage
+    -----
+        >>> from symbolic_pymc.utils import PersistentMap
+        >>> s = PersistentMap({"a": 1})
+        >>> s_new = s.assoc("b", 2)
+        >>> dict(s), dict(s_new)
+        ({'a': 1}, {'a': 1, 'b': 2})
+    """
+
+    __slots__ = ("_root", "_len")
+
+    def __init__(self, *args, **kwargs):
+        self._root = _hamt_empty_node
+        self._len = 0
+
+        for key, value in dict(*args, **kwargs).items():
+            self._root, added = _hamt_assoc(self._root, 0, hash(key), key, value)
+            self._len += added
+
+    def assoc(self, key, value):
+        """Return a new map with `key` set to `value`."""
+        root, added = _hamt_assoc(self._root, 0, hash(key), key, value)
+
+        if root is self._root:
+            return self
+
+        res = object.__new__(type(self))
+        res._root = root
+        res._len = self._len + added
+        return res
+
+    def __getitem__(self, key):
+        res = _hamt_get(self._root, 0, hash(key), key)
+        if res is _hamt_missing:
+            raise KeyError(key)
+        return res
+
+    def get(self, key, default=None):
+        res = _hamt_get(self._root, 0, hash(key), key)
+        return default if res is _hamt_missing else res
+
+    def __contains__(self, key):
+        try:
+            return _hamt_get(self._root, 0, hash(key), key) is not _hamt_missing
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return (k for k, _ in _hamt_items(self._root))
+
+    def items(self):
+        return _hamt_items(self._root)
+
+    def __len__(self):
+        return self._len
+
+    def copy(self):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (dict(self.items()),))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+def run(n, x, *goals, results_filter=None):
+    """Run a miniKanren program like `kanren.run`, but with `PersistentMap` states.
+
+    Each new logic variable binding then costs `O(log n)` instead of a copy of
+    the entire state.
+    """
+    g = lall(*goals)
+    results = map(partial(reify, x), g(PersistentMap()))
+
+    if results_filter is not None:
+        results = results_filter(results)
+
+    if n is None:
+        return results
+    elif n == 0:
+        return tuple(results)
+    else:
+        return tuple(islice(results, n))
+
+
 UnequalMetaParts = namedtuple("UnequalMetaParts", ["path", "reason", "objects"])
 
 
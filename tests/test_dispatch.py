@@ -8,7 +8,10 @@ from etuples.core import ExpressionTuple
 
 from unification import var, unify, reify
 
+from kanren import run, eq
+
 from symbolic_pymc.meta import MetaVariable, MetaOp
+from symbolic_pymc.dispatch import MetaPattern, count_meta_reify_calls
 
 
 class SomeOp(object):
@@ -84,6 +87,15 @@ def test_unify():
 
     assert obj == a
 
+    # Reifications are only counted within `count_meta_reify_calls`
+    with count_meta_reify_calls() as outer_counts:
+        reify(b, s)
+        with count_meta_reify_calls() as inner_counts:
+            reify(b, s)
+
+    assert inner_counts[0] > 0
+    assert outer_counts[0] == 2 * inner_counts[0]
+
     r_lv = var()
     b = SomeMetaVariable(op, q_lv, obj=r_lv)
 
@@ -91,6 +103,13 @@ def test_unify():
     assert s is not False
     assert s[r_lv] is a.obj
 
+    # The base object is bound without changing the given state, even when
+    # nothing else is
+    s_0 = {}
+    s = unify(a, SomeMetaVariable(op, a_args, obj=r_lv), s_0)
+    assert s == {r_lv: a.obj}
+    assert s_0 == {}
+
     assert car(a) == rator(a) == op
     assert isinstance(cdr(a), ExpressionTuple)
     assert isinstance(rands(a), ExpressionTuple)
@@ -112,3 +131,48 @@ def test_unify():
 
     with pytest.raises(ConsError):
         rator(a)
+
+
+def test_MetaPattern():
+
+    op = SomeMetaOp()
+    x_lv, y_lv, obj_lv = var(), var(), var()
+    pattern = SomeMetaVariable(op, (x_lv, (1, y_lv)), obj=obj_lv)
+
+    meta_pattern = MetaPattern(pattern)
+
+    assert set(meta_pattern.lvars) == {x_lv, y_lv, obj_lv}
+    assert meta_pattern.pattern is pattern
+    assert meta_pattern[x_lv] is x_lv
+
+    with pytest.raises(KeyError):
+        meta_pattern[var()]
+
+    # The compiled function should produce the same results as `unify`
+    a = SomeMetaVariable(op, (3, (1, 4)), obj=SomeType(1, 2))
+    b = SomeMetaVariable(op, (3, (2, 4)))
+    c = SomeMetaVariable(SomeOtherMetaOp(), (3, (1, 4)))
+    d = SomeMetaVariable(op, (3, (1, 4, 5)))
+    e = SomeMetaVariable(op, (var(), (1, 4)))
+    q_lv = var()
+
+    for term, s in [(a, {}), (b, {}), (c, {}), (d, {}), (e, {}), (q_lv, {}), (a, {x_lv: 2})]:
+        assert meta_pattern.match(term, s) == unify(pattern, term, s)
+
+    s = meta_pattern.match(a, {})
+    assert s == {x_lv: 3, y_lv: 4, obj_lv: a.obj}
+
+    assert run(0, (x_lv, y_lv), eq(meta_pattern, a)) == ((3, 4),)
+    assert run(0, (x_lv, y_lv), eq(a, meta_pattern)) == ((3, 4),)
+    assert run(0, q_lv, eq(q_lv, meta_pattern)) == (pattern,)
+    assert not run(0, q_lv, eq(meta_pattern, b))
+
+    # Fresh copies share the compiled function, but not the logic variables
+    fresh_pattern = meta_pattern.fresh()
+    fresh_x_lv, fresh_y_lv = fresh_pattern[x_lv], fresh_pattern[y_lv]
+
+    assert not {fresh_x_lv, fresh_y_lv} & {x_lv, y_lv}
+    assert fresh_pattern.pattern == SomeMetaVariable(op, (fresh_x_lv, (1, fresh_y_lv)))
+
+    res = run(0, (x_lv, fresh_x_lv), eq(meta_pattern, a), eq(fresh_pattern, e))
+    assert res == ((3, e.args[0]),)
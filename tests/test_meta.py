@@ -1,9 +1,25 @@
+import gc
+import sys
 import pytest
+import threading
 
 import numpy as np
 
+from unification import var, variables, reify
+
 from symbolic_pymc.utils import HashableNDArray
-from symbolic_pymc.meta import MetaSymbol, MetaOp, metatize
+from symbolic_pymc.meta import (
+    MetaSymbol,
+    MetaOp,
+    metatize,
+    enable_meta_interning,
+    meta_intern_table,
+    metatize_cache_scope,
+    enable_weak_base_refs,
+    enable_frozen_meta,
+    MetaFrozenError,
+    meta_free_vars,
+)
 
 
 class SomeOp(object):
@@ -23,14 +39,26 @@ class SomeType(object):
         return f"SomeType<{self.field1}, {self.field2}>"
 
 
+class SomeValueType(SomeType):
+    def __eq__(self, other):
+        return (
+            type(self) == type(other)
+            and self.field1 == other.field1
+            and self.field2 == other.field2
+        )
+
+    def __hash__(self):
+        return hash((self.field1, self.field2))
+
+
 class SomeMetaSymbol(MetaSymbol):
     __slots__ = ("field1", "field2", "_blah")
     base = SomeType
 
-    def __init__(self, obj=None):
+    def __init__(self, obj=None, field1=1, field2=2):
         super().__init__(obj)
-        self.field1 = 1
-        self.field2 = 2
+        self.field1 = field1
+        self.field2 = field2
         self._blah = "a"
 
 
@@ -50,10 +78,30 @@ def test_meta():
 
     some_mt = SomeMetaSymbol()
 
-    assert some_mt.__all_slots__ == ("_obj", "_hash", "_rands", "field1", "field2", "_blah")
+    assert some_mt.__all_slots__ == (
+        "_obj",
+        "_hash",
+        "_rands",
+        "_intern_key",
+        "_dependents",
+        "_frozen",
+        "_free_vars",
+        "field1",
+        "field2",
+        "_blah",
+    )
     assert some_mt.__all_props__ == ("field1", "field2")
     assert some_mt.__props__ == ("field1", "field2")
-    assert some_mt.__volatile_slots__ == ("_obj", "_hash", "_rands", "_blah")
+    assert some_mt.__volatile_slots__ == (
+        "_obj",
+        "_hash",
+        "_rands",
+        "_intern_key",
+        "_dependents",
+        "_frozen",
+        "_free_vars",
+        "_blah",
+    )
 
     assert some_mt.obj is None
     assert not hasattr(some_mt, "_hash")
@@ -87,6 +135,48 @@ def test_meta():
         some_op_mt.obj = SomeOp()
 
 
+def test_meta_hash():
+    """Make sure hash values are invalidated by changes in sub-objects."""
+    leaf_mt = SomeMetaSymbol(field1=1)
+    parent_mt = SomeMetaSymbol(field1=leaf_mt)
+    root_mt = SomeMetaSymbol(field1=(parent_mt, 2))
+
+    root_hash = hash(root_mt)
+    assert parent_mt._hash is not None
+    assert leaf_mt._hash is not None
+
+    leaf_mt.field1 = 3
+
+    assert leaf_mt._hash is None
+    assert parent_mt._hash is None
+    assert root_mt._hash is None
+
+    assert hash(root_mt) != root_hash
+    assert hash(root_mt) == hash(
+        SomeMetaSymbol(field1=(SomeMetaSymbol(field1=SomeMetaSymbol(field1=3)), 2))
+    )
+
+    # Collected dependents are removed from their children's registries
+    assert id(parent_mt) in leaf_mt._dependents
+    del root_mt, parent_mt
+    gc.collect()
+
+    assert not leaf_mt._dependents
+
+    # Hashing is iterative and distinguishes long chains of repeated objects
+    depth = 2 * sys.getrecursionlimit()
+    chain_mt = SomeMetaSymbol()
+    for i in range(depth):
+        chain_mt = SomeMetaSymbol(field1=chain_mt, field2=chain_mt)
+
+    hashes = set([hash(chain_mt)])
+    while isinstance(chain_mt.field1, SomeMetaSymbol):
+        chain_mt = chain_mt.field1
+        hashes.add(chain_mt._hash)
+
+    assert len(hashes) == depth + 1
+
+
 def test_meta_inheritance():
     class SomeOtherType(SomeType):
         def __init__(self, field1, field2, field3):
@@ -113,6 +203,10 @@ def test_meta_inheritance():
         "_obj",
         "_hash",
         "_rands",
+        "_intern_key",
+        "_dependents",
+        "_frozen",
+        "_free_vars",
         "field1",
         "field2",
         "_blah",
@@ -121,7 +215,17 @@ def test_meta_inheritance():
     )
     assert other_mt.__all_props__ == ("field1", "field2", "field3")
     assert other_mt.__props__ == ("field3",)
-    assert other_mt.__volatile_slots__ == ("_obj", "_hash", "_rands", "_blah", "_bloh")
+    assert other_mt.__volatile_slots__ == (
+        "_obj",
+        "_hash",
+        "_rands",
+        "_intern_key",
+        "_dependents",
+        "_frozen",
+        "_free_vars",
+        "_blah",
+        "_bloh",
+    )
 
 
 def test_meta_str():
@@ -183,3 +287,190 @@ def test_metatize():
     assert x_mt != y_mt
 
     assert x_mt != 1
+
+
+def test_meta_interning():
+    some_mt = SomeMetaSymbol()
+    assert some_mt is not SomeMetaSymbol()
+
+    with enable_meta_interning():
+        some_mt = SomeMetaSymbol()
+        assert some_mt is SomeMetaSymbol()
+        assert some_mt is not SomeMetaSymbol(field1=3)
+
+        # Nested ground objects are interned, too
+        nested_mt = SomeMetaSymbol(field1=SomeMetaSymbol(field2=3))
+        assert nested_mt is SomeMetaSymbol(field1=SomeMetaSymbol(field2=3))
+
+        # Distinct base objects mean distinct meta objects
+        some_type = SomeType(1, 2)
+        obj_mt = SomeMetaSymbol(some_type)
+        assert obj_mt is not some_mt
+        assert obj_mt is SomeMetaSymbol(some_type)
+        assert obj_mt is not SomeMetaSymbol(SomeType(1, 2))
+
+        # Base objects that are equal by value are interned together
+        value_mt = SomeMetaSymbol(SomeValueType(1, 2))
+        assert value_mt is SomeMetaSymbol(SomeValueType(1, 2))
+        assert value_mt is not SomeMetaSymbol(SomeValueType(1, 3))
+
+        # Objects with logic variables aren't interned
+        lvar_mt = SomeMetaSymbol(field1=var())
+        assert getattr(lvar_mt, "_intern_key", None) is None
+        assert SomeMetaSymbol(field1=SomeMetaSymbol(field2=var())) is not SomeMetaSymbol(
+            field1=SomeMetaSymbol(field2=var())
+        )
+
+        # Mutating an interned object removes it from the table
+        some_mt.field1 = 10
+        assert some_mt._intern_key is None
+        assert SomeMetaSymbol() is not some_mt
+
+    assert SomeMetaSymbol() is not SomeMetaSymbol()
+
+    # The table doesn't keep the objects alive
+    del some_mt, nested_mt, obj_mt, value_mt, lvar_mt
+    gc.collect()
+    assert not any(isinstance(v, SomeMetaSymbol) for v in meta_intern_table.values())
+
+
+def test_metatize_cache_scope():
+    from symbolic_pymc import meta
+
+    test_tuple = ("a", "b")
+    outer_cache = meta.metatize_cache
+
+    with metatize_cache_scope() as cache:
+        assert meta.metatize_cache is cache
+        assert cache is not outer_cache
+        assert cache.maxsize == outer_cache.maxsize
+
+        res = metatize(test_tuple)
+        assert metatize(test_tuple) is res
+        assert cache.cache_info().hits == 1
+        assert cache.cache_info().misses == 1
+
+    assert meta.metatize_cache is outer_cache
+
+
+def test_weak_base_refs():
+    some_type = SomeType(1, 2)
+    some_mt = SomeMetaSymbol(some_type)
+
+    del some_type
+    gc.collect()
+    assert some_mt.obj is not None
+
+    with enable_weak_base_refs():
+        some_type = SomeType(1, 2)
+        some_mt = SomeMetaSymbol(some_type)
+        some_op_mt = SomeMetaOp(SomeOp())
+
+    assert some_mt.obj is some_type
+
+    del some_type
+    gc.collect()
+
+    assert some_mt.obj is None
+
+    some_type = some_mt.reify()
+    assert isinstance(some_type, SomeType)
+    assert (some_type.field1, some_type.field2) == (1, 2)
+
+    # Meta objects without properties can't recreate their base objects
+    gc.collect()
+    assert isinstance(some_op_mt.obj, SomeOp)
+
+
+def test_frozen_meta():
+    with enable_frozen_meta():
+        some_type = SomeType(1, 2)
+        some_mt = SomeMetaSymbol(some_type, field2=SomeMetaSymbol())
+        no_obj_mt = SomeMetaSymbol()
+
+    with pytest.raises(MetaFrozenError):
+        some_mt.field1 = 2
+
+    with pytest.raises(MetaFrozenError):
+        some_mt._obj = SomeType(1, 2)
+
+    # Cached/volatile values can still be set
+    some_mt._blah = "b"
+    assert hash(some_mt) == some_mt._hash
+
+    # The results of reification can be added
+    no_obj_type = no_obj_mt.reify()
+    assert no_obj_mt.obj is no_obj_type
+
+    new_mt = some_mt.evolve(field1=3)
+
+    assert new_mt is not some_mt
+    assert new_mt.field1 == 3
+    assert new_mt.field2 is some_mt.field2
+    assert new_mt.obj is None
+    assert some_mt.field1 == 1
+    assert some_mt.obj is some_type
+
+    with pytest.raises(MetaFrozenError):
+        new_mt.field1 = 2
+
+    same_mt = some_mt.evolve(field1=some_mt.field1)
+    assert same_mt == some_mt
+    assert same_mt.obj is some_type
+
+    with pytest.raises(TypeError):
+        some_mt.evolve(field3=1)
+
+    # Unfrozen objects can still be evolved
+    some_mt = SomeMetaSymbol()
+    new_mt = some_mt.evolve(field2=4)
+    assert new_mt.field2 == 4
+    assert some_mt.field2 == 2
+    new_mt.field2 = 5
+
+    # The context only applies to the thread it's entered in
+    other_mts = []
+    other_thread = threading.Thread(target=lambda: other_mts.append(SomeMetaSymbol()))
+
+    with enable_frozen_meta():
+        other_thread.start()
+        other_thread.join()
+        assert getattr(SomeMetaSymbol(), "_frozen", False)
+
+    (other_mt,) = other_mts
+    assert not getattr(other_mt, "_frozen", False)
+    other_mt.field2 = 5
+
+
+def test_meta_free_vars():
+    x_lv, y_lv, z_lv = var(), var(), var()
+
+    ground_mt = SomeMetaSymbol(field1=SomeMetaSymbol())
+    assert ground_mt.free_vars == frozenset()
+    assert ground_mt.field1._free_vars == frozenset()
+
+    some_mt = SomeMetaSymbol(field1=ground_mt, field2=SomeMetaSymbol(field1=(x_lv, {"a": y_lv})))
+    assert some_mt.free_vars == {x_lv, y_lv}
+
+    # Reification skips objects without substituted logic variables
+    assert reify(some_mt, {z_lv: 1}) is some_mt
+    assert reify(ground_mt, {x_lv: 1}) is ground_mt
+
+    # Changes to sub-objects invalidate the cached values
+    ground_mt.field1.field2 = z_lv
+    assert some_mt._free_vars is None
+    assert some_mt.free_vars == {x_lv, y_lv, z_lv}
+
+    # So do logic variable base objects
+    no_obj_mt = SomeMetaSymbol()
+    parent_mt = SomeMetaSymbol(field1=no_obj_mt)
+    assert parent_mt.free_vars == frozenset()
+    no_obj_mt._obj = x_lv
+    assert parent_mt.free_vars == {x_lv}
+
+    # Global logic variables aren't cached
+    some_type = SomeType(1, 2)
+    obj_mt = SomeMetaSymbol(some_type)
+    with variables(some_type):
+        assert meta_free_vars(obj_mt) == {some_type}
+    assert obj_mt.free_vars == frozenset()
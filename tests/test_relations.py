@@ -1,8 +1,12 @@
+from operator import add, mul
+
 from unification import var
 
+from cons import cons
+
 from kanren import run
 
-from symbolic_pymc.relations import concat
+from symbolic_pymc.relations import concat, DiscriminationTree, IndexedRelation
 
 
 def test_concat():
@@ -11,3 +15,62 @@ def test_concat():
     assert not run(0, q, concat("a", "b", "bc"))
     assert not run(0, q, concat(1, "b", "bc"))
     assert run(0, q, concat(q, "b", "bc")) == (q,)
+
+
+def test_DiscriminationTree():
+    x_lv, y_lv = var(), var()
+
+    index = DiscriminationTree()
+    index.add(((add, x_lv, 1),), "add_1")
+    index.add(((mul, 3, y_lv),), "mul_3")
+    index.add((x_lv,), "any")
+    index.add((cons(add, y_lv),), "add_cons")
+    index.add((5,), "five")
+    index.add(((add, 1), 2), "two_terms")
+
+    for i in range(100):
+        index.add(((add, i, (mul, i, "z")),), i)
+
+    assert len(index) == 106
+
+    assert set(index.candidates(((add, 7, 1),))) == {"add_1", "any", "add_cons"}
+    # `cons`es with logic variable tails could have any number of operands, so
+    # they're stored as wildcards
+    assert set(index.candidates(((mul, 3, 4),))) == {"mul_3", "any", "add_cons"}
+    assert set(index.candidates((5,))) == {"five", "any", "add_cons"}
+    assert set(index.candidates(((add, 42, (mul, 42, "z")),))) == {42, "any", "add_cons"}
+    assert set(index.candidates(((add, 42, var()),))) == {42, "any", "add_cons", "add_1"}
+    assert set(index.candidates(((var(), 42, var()),))) == {42, "any", "add_cons", "add_1"}
+    assert set(index.candidates((var(),))) == set(range(100)) | {
+        "add_1",
+        "mul_3",
+        "any",
+        "add_cons",
+        "five",
+    }
+    assert index.candidates(((add, 1), var())) == ["two_terms"]
+    assert not index.candidates(((add, 1), 3, 4))
+
+
+def test_IndexedRelation():
+    x_lv, y_lv = var(), var()
+
+    rel = IndexedRelation("test")
+    rel.add_fact((add, x_lv, 1), (mul, x_lv, 2))
+    rel.add_fact((mul, 3, y_lv), "mul_3")
+    rel.add_fact("a", "b")
+
+    for i in range(100):
+        rel.add_fact((add, i, (mul, i, "z")), i)
+
+    # Duplicate facts aren't indexed twice
+    rel.add_fact("a", "b")
+
+    assert len(rel.facts) == len(rel.term_index) == 103
+
+    q = var()
+    assert run(0, q, rel((add, 7, 1), q)) == ((mul, 7, 2),)
+    assert run(0, q, rel((mul, 3, 4), q)) == ("mul_3",)
+    assert run(0, q, rel(q, "b")) == ("a",)
+    assert set(run(0, q, rel((add, 42, var()), q))) == {42, (mul, 42, 2)}
+    assert not run(0, q, rel((add, 7, 2), q))
@@ -1,9 +1,27 @@
+import gc
+import pickle
+import pytest
+
+from copy import deepcopy
+
 import numpy as np
 
-from unification import var
+from unification import var, unify
+
+from kanren import eq, conde
+
+from multipledispatch.dispatcher import MDNotImplementedError
 
 from symbolic_pymc.meta import MetaSymbol, MetaOp
-from symbolic_pymc.utils import meta_diff, eq_lvar, HashableNDArray
+from symbolic_pymc.utils import (
+    meta_diff,
+    eq_lvar,
+    HashableNDArray,
+    InstrumentedLRUCache,
+    TypeDispatcher,
+    PersistentMap,
+    run,
+)
 
 
 class SomeOp(object):
@@ -181,3 +199,165 @@ def test_HashableNDArray():
     c_h = c.view(HashableNDArray)
     assert hash(a_h) != hash(c_h)
     assert a_h != c_h
+
+
+def test_InstrumentedLRUCache():
+    cache = InstrumentedLRUCache(2)
+
+    cache[1] = "a"
+    cache[2] = "b"
+    assert cache[1] == "a"
+    cache[3] = "c"
+
+    assert 2 not in cache
+    assert cache.get(2) is None
+    assert cache.cache_info() == (1, 0, 1, 2, 2)
+
+    try:
+        cache[4]
+    except KeyError:
+        pass
+
+    assert cache.cache_info().misses == 1
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.cache_info() == (1, 1, 1, 2, 0)
+
+    cache.reset_info()
+    assert cache.cache_info() == (0, 0, 0, 2, 0)
+
+    # Weakly referenced keys
+    class SomeKey(object):
+        pass
+
+    cache = InstrumentedLRUCache(10, weak_keys=True)
+    key = SomeKey()
+    cache[key] = 1
+    cache[(1, 2)] = 2
+
+    assert cache[key] == 1
+    assert cache[(1, 2)] == 2
+
+    del key
+    gc.collect()
+
+    assert len(cache) == 1
+    assert cache.cache_info().evictions == 0
+
+
+def test_TypeDispatcher():
+    f = TypeDispatcher("f")
+    f.add((object,), lambda x: "object")
+    f.add((int,), lambda x: "int")
+
+    assert f(1) == "int"
+    assert f(True) == "int"
+    assert f(1.0) == "object"
+    assert f(2) == "int"
+
+    info = f.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 3, 3)
+
+    # New implementations invalidate the resolved implementations
+    f.add((bool,), lambda x: "bool")
+    assert f.cache_info().evictions == 3
+    assert f.cache_info().currsize == 0
+    assert f(True) == "bool"
+
+    f_copy = deepcopy(f)
+    assert f_copy(True) == "bool"
+    assert f_copy.cache_info().misses == 1
+
+    with pytest.raises(NotImplementedError):
+        TypeDispatcher("g")(1)
+
+    # Implementations that defer continue down the resolution order
+    h = TypeDispatcher("h")
+    h.add((object,), lambda x: "object")
+
+    def h_int(x):
+        raise MDNotImplementedError()
+
+    h.add((int,), h_int)
+    h.add((bool,), h_int)
+
+    assert h(True) == "object"
+    assert h(1) == "object"
+
+    h.add((object,), h_int)
+
+    with pytest.raises(NotImplementedError, match="none completed successfully"):
+        h(True)
+
+
+class CollidingKey(object):
+    def __init__(self, value, hash_value):
+        self.value = value
+        self.hash_value = hash_value
+
+    def __hash__(self):
+        return self.hash_value
+
+    def __eq__(self, other):
+        return isinstance(other, CollidingKey) and self.value == other.value
+
+
+def test_PersistentMap():
+    s = PersistentMap()
+    assert len(s) == 0
+    assert not s
+    assert s.copy() is s
+
+    # Enough keys to need a few levels of trie nodes
+    maps = [s]
+    for i in range(2000):
+        maps.append(maps[-1].assoc(i, str(i)))
+
+    # Older versions are unchanged
+    for i, m in enumerate(maps):
+        assert len(m) == i
+        assert i not in m
+        assert m.get(i) is None
+        assert all(m[j] == str(j) for j in range(0, i, 97))
+
+    s = maps[-1]
+    assert dict(s) == {i: str(i) for i in range(2000)}
+    assert s == {i: str(i) for i in range(2000)}
+    assert set(s) == set(range(2000))
+
+    with pytest.raises(KeyError):
+        s[-1]
+
+    assert s.assoc(0, s[0]) is s
+    s_new = s.assoc(0, "zero")
+    assert s_new[0] == "zero" and s[0] == "0"
+    assert len(s_new) == len(s)
+
+    # Keys with equal hash values
+    a, b, c = CollidingKey("a", 1), CollidingKey("b", 1), CollidingKey("c", 33)
+    s = PersistentMap({a: 1}).assoc(b, 2).assoc(c, 3)
+    assert s[a] == 1 and s[b] == 2 and s[c] == 3
+    assert len(s) == 3
+    assert CollidingKey("d", 1) not in s
+    assert s.assoc(CollidingKey("a", 1), 4)[a] == 4
+    assert s[a] == 1
+
+    s = PersistentMap(x=1, y=2)
+    assert s == {"x": 1, "y": 2}
+    assert repr(s) in ("PersistentMap({'x': 1, 'y': 2})", "PersistentMap({'y': 2, 'x': 1})")
+    assert pickle.loads(pickle.dumps(s)) == s
+    assert [] not in s
+
+
+def test_PersistentMap_states():
+    x_lv, y_lv, q_lv = var(), var(), var()
+
+    s = unify((x_lv, y_lv), (1, 2), PersistentMap())
+    assert isinstance(s, PersistentMap)
+    assert s == {x_lv: 1, y_lv: 2}
+
+    assert run(0, q_lv, eq(q_lv, (1, x_lv)), eq(x_lv, 2)) == ((1, 2),)
+    assert run(0, q_lv, conde([eq(q_lv, 1)], [eq(q_lv, 2)])) == (1, 2)
+    assert run(1, q_lv, conde([eq(q_lv, 1)], [eq(q_lv, 2)])) == (1,)
+    assert list(run(None, q_lv, eq(q_lv, 1))) == [1]
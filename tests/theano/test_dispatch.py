@@ -12,6 +12,7 @@ from cons.core import ConsError
 from etuples import etuple, etuplize, rator, rands
 from etuples.core import ExpressionTuple
 
+from symbolic_pymc.dispatch import MetaPattern
 from symbolic_pymc.theano.meta import mt
 from symbolic_pymc.theano.utils import graph_equal
 from symbolic_pymc.theano.random_variables import MvNormalRV
@@ -190,3 +191,28 @@ def test_unify_ops():
     assert output_new != output
 
     assert np.array_equal(output_new.eval({state: 1.0, n_steps: 4}), np.r_[5.0, 25.0, 125.0, 625.0])
+
+
+def test_MetaPattern_theano():
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    a_lv, b_lv = var(), var()
+
+    # Theano objects are matched directly, like they're unified (i.e. as meta
+    # objects)
+    pattern = mt.add(a_lv, mt.exp(b_lv))
+    meta_pattern = MetaPattern(pattern)
+
+    for term in [x_tt + tt.exp(y_tt), x_tt + tt.log(y_tt), x_tt * tt.exp(y_tt), x_tt]:
+        assert meta_pattern.match(term, {}) == unify(pattern, term, {})
+
+    s = meta_pattern.match(x_tt + tt.exp(y_tt), {})
+    assert s[a_lv] == mt(x_tt)
+    assert s[b_lv] == mt(y_tt)
+    assert s[b_lv].obj is y_tt
+
+    # Sequences don't unify with meta objects or their base objects
+    seq_pattern = MetaPattern((a_lv, b_lv))
+
+    for term in [mt(x_tt), x_tt, (x_tt, y_tt)]:
+        assert seq_pattern.match(term, {}) == unify((a_lv, b_lv), term, {})
@@ -1,3 +1,5 @@
+import gc
+import sys
 import pytest
 import numpy as np
 import theano
@@ -7,7 +9,15 @@ from collections.abc import Iterator
 
 from unification import var, isvar, variables
 
-from symbolic_pymc.meta import MetaSymbol, MetaOp
+from symbolic_pymc.meta import (
+    MetaSymbol,
+    MetaOp,
+    MetaFrozenError,
+    enable_frozen_meta,
+    enable_weak_base_refs,
+    meta_reify_graph,
+    dynamic_meta_types,
+)
 from symbolic_pymc.theano.meta import (
     metatize,
     TheanoMetaOp,
@@ -219,3 +229,116 @@ def test_scan_op():
     assert isinstance(output_mt.owner.inputs[0].owner.op, mt.Scan)
 
     assert output is output_mt.reify()
+
+
+def test_weak_base_refs():
+    x_tt = tt.vector("x")
+
+    with enable_weak_base_refs():
+        y_mt = mt(tt.exp(x_tt + 1))
+
+    gc.collect()
+
+    assert y_mt.obj is None
+    assert y_mt.owner.obj is None
+    assert y_mt.owner.inputs[0].obj is None
+
+    # The leaf input is still referenced
+    assert y_mt.owner.inputs[0].owner.inputs[0].obj is x_tt
+
+    y_tt = y_mt.reify()
+    assert y_mt.obj is y_tt
+
+    x_val = np.r_[1.0, 2.0]
+    np.testing.assert_array_almost_equal(
+        y_tt.eval({x_tt: x_val.astype(tt.config.floatX)}), np.exp(x_val + 1)
+    )
+
+
+def test_meta_reify_graph():
+    x_tt = tt.vector("x")
+    x_mt = mt(x_tt)
+
+    # A chain of "diamonds" that's deeper than the recursion limit
+    depth = 1500
+    y_mt = x_mt
+    for i in range(depth):
+        y_mt = TheanoMetaTensorVariable(x_mt.type, TheanoMetaApply(mt.add, [y_mt, y_mt]), 0, None)
+
+    assert y_mt.obj is None
+
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        res = meta_reify_graph(y_mt, x_mt)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    assert tuple(res.keys())[-1] is y_mt
+    assert res[x_mt] is x_tt
+
+    y_tt = res[y_mt]
+    assert y_mt.obj is y_tt
+
+    for i in range(depth):
+        assert y_tt.owner.op == tt.add
+        assert y_tt.owner.inputs[0] is y_tt.owner.inputs[1]
+        y_tt = y_tt.owner.inputs[0]
+
+    assert y_tt is x_tt
+
+    # `MetaSymbol.reify` goes through the same memoized traversal
+    z_mt = x_mt
+    for i in range(depth):
+        z_mt = TheanoMetaTensorVariable(x_mt.type, TheanoMetaApply(mt.mul, [z_mt, z_mt]), 0, None)
+
+    sys.setrecursionlimit(1000)
+    try:
+        z_tt = z_mt.reify()
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    assert z_mt.obj is z_tt
+    assert z_tt.owner.op == tt.mul
+    assert z_tt.owner.inputs[0] is z_tt.owner.inputs[1]
+
+
+def test_frozen_meta():
+    with enable_frozen_meta():
+        add_mt = mt.add(0, 1, name="add")
+        add_lv_mt = mt.add(0, 1, name=var())
+        svd_mt = mt(tt.nlinalg.SVD())(np.c_[[2, 3], [4, 5]])
+        var_mt = TheanoMetaVariable(svd_mt[0].type, svd_mt[0].owner, None, None)
+
+    assert add_mt.name == "add"
+    assert add_mt.reify().name == "add"
+    assert isvar(add_lv_mt.name)
+
+    with pytest.raises(MetaFrozenError):
+        add_mt.name = "blah"
+
+    # Reification of a frozen object doesn't change its properties
+    reified_var_mt = var_mt.reify()
+    assert reified_var_mt == svd_mt[0]
+    assert var_mt.index is None
+
+
+def test_dynamic_meta_types():
+    from symbolic_pymc import meta
+
+    svd_op_mt = mt(tt.nlinalg.SVD())
+    svd_type_mt = type(svd_op_mt)
+
+    assert svd_type_mt is not TheanoMetaOp
+    assert svd_type_mt.base is tt.nlinalg.SVD
+    assert dynamic_meta_types[(TheanoMetaOp, tt.nlinalg.SVD)] is svd_type_mt
+
+    n_funcs = len(meta._metatize.funcs)
+
+    # New instances of the same `Op` type reuse the meta type
+    assert type(mt(tt.nlinalg.SVD(full_matrices=False))) is svd_type_mt
+    assert type(TheanoMetaOp(obj=tt.nlinalg.SVD())) is svd_type_mt
+    assert metatize(tt.nlinalg.SVD) is svd_type_mt
+    assert len(meta._metatize.funcs) == n_funcs
+
+    assert svd_type_mt._op_sig.parameters.keys() == {"x"}
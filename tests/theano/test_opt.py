@@ -1,13 +1,20 @@
+import gc
+import io
+import pickle
+import time
+import weakref
 import pytest
 import numpy as np
 import theano
 import theano.tensor as tt
 
 from copy import copy
-from unification import var
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unification import var, isvar
 
-from kanren import eq
-from kanren.core import lall
+from kanren import eq, conde, run
+from kanren.core import lall, lany
+from kanren.facts import Relation, fact
 
 from etuples import etuple, etuplize
 
@@ -18,13 +25,36 @@ from theano.scan_module.scan_op import Scan
 from symbolic_pymc.theano.meta import mt
 from symbolic_pymc.theano.opt import (
     KanrenRelationSub,
+    KanrenRelationGroup,
     FunctionGraph,
+    IndexedList,
+    relation_tracks,
+    relation_input_ops,
+    SubgraphFingerprints,
+    NodeChangeTracker,
+    IncrementalOptimizer,
+    KanrenEquilibriumOptimizer,
+    ParallelKanrenOptimizer,
+    EGraph,
+    KanrenEGraphOptimizer,
+    GraphCostModel,
+    cheapest_result,
+    BudgetExceededInfo,
+    match_subgraphs,
     push_out_rvs_from_scan,
     ScanArgs,
     convert_outer_out_to_in,
+    convert_outer_outs_to_ins,
 )
+from symbolic_pymc.utils import InstrumentedLRUCache
 from symbolic_pymc.theano.utils import optimize_graph, get_random_outer_outputs, construct_scan
-from symbolic_pymc.theano.random_variables import CategoricalRV, DirichletRV, NormalRV
+from symbolic_pymc.theano.random_variables import (
+    CategoricalRV,
+    DirichletRV,
+    NormalRV,
+    GammaRV,
+    MvNormalRV,
+)
 
 from tests.theano.utils import create_test_hmm
 
@@ -71,6 +101,857 @@ def test_kanren_opt():
     assert isinstance(fgraph_opt.owner.inputs[1].owner.inputs[1].owner.op, tt.Dot)
 
 
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_kanren_opt_tracks():
+    """Make sure `KanrenRelationSub` only runs miniKanren on nodes with tracked `Op`s."""
+    x_tt = tt.vector("x")
+    A_tt = tt.matrix("A")
+    Z_tt = tt.exp(A_tt.dot(x_tt + 1))
+
+    visited = []
+
+    @relation_tracks(mt(tt.basic._dot))
+    def exp_to_log(in_lv, out_lv):
+        visited.append(in_lv)
+        y_lv = var()
+        return lall(eq(etuple(mt.exp, y_lv), etuplize(in_lv)), eq(out_lv, etuple(mt.log, y_lv)))
+
+    kanren_opt = KanrenRelationSub(exp_to_log)
+    assert kanren_opt.tracks() == (tt.basic._dot,)
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    Z_opt_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+
+    # Only the `dot` was considered, so the `exp` wasn't changed
+    assert Z_opt_tt.owner.op == tt.exp
+    assert len(visited) == 1
+    assert visited[0].owner.op == tt.basic._dot
+
+    # Explicit `tracks` take precedence
+    kanren_opt = KanrenRelationSub(exp_to_log, tracks=[mt.exp])
+    assert kanren_opt.tracks() == (tt.exp,)
+
+    kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    Z_opt_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+    assert Z_opt_tt.owner.op == tt.log
+
+    # The input `Op`s of fact-based relations are derived from their facts
+    exp_log = Relation("exp_log")
+    fact(exp_log, mt.exp(var()), mt.log(var()))
+    fact(exp_log, mt.NormalRV(var(), var(), size=var(), rng=var(), name=var()), var())
+    # The facts are stored in a `set`, so their order isn't fixed
+    assert set(relation_input_ops(exp_log)) == {tt.exp, NormalRV}
+
+    fact(exp_log, var(), var())
+    assert relation_input_ops(exp_log) is None
+    assert KanrenRelationSub(exp_log).tracks() is None
+
+    with pytest.raises(TypeError):
+        KanrenRelationSub(exp_to_log, tracks=[tt.dot])
+
+
+def test_kanren_relation_group():
+    """Make sure `KanrenRelationGroup` only tries the relations that can match a node."""
+    x_tt = tt.vector("x")
+    A_tt = tt.matrix("A")
+    Z_tt = tt.exp(A_tt.dot(tt.log(x_tt)))
+
+    visited = {"exp": [], "log": [], "any": []}
+
+    @relation_tracks(mt.exp)
+    def exp_to_log(in_lv, out_lv):
+        visited["exp"].append(in_lv)
+        y_lv = var()
+        return lall(eq(etuple(mt.exp, y_lv), etuplize(in_lv)), eq(out_lv, etuple(mt.log, y_lv)))
+
+    @relation_tracks(mt.log)
+    def log_to_sqrt(in_lv, out_lv):
+        visited["log"].append(in_lv)
+        y_lv = var()
+        return lall(eq(etuple(mt.log, y_lv), etuplize(in_lv)), eq(out_lv, etuple(mt.sqrt, y_lv)))
+
+    def no_match(in_lv, out_lv):
+        visited["any"].append(in_lv)
+        return eq(in_lv, None)
+
+    kanren_group = KanrenRelationGroup([exp_to_log, KanrenRelationSub(log_to_sqrt)])
+    assert set(kanren_group.tracks()) == {tt.exp, tt.log}
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    dot_node = fgraph.outputs[0].owner.inputs[0].owner
+    assert kanren_group.candidates(dot_node) == []
+    assert kanren_group.transform(dot_node) is False
+
+    kanren_eq_opt = EquilibriumOptimizer([kanren_group], max_use_ratio=10)
+    Z_opt_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+
+    # `exp(dot(A, log(x)))` -> `log(dot(A, log(x)))` -> `sqrt(dot(A, sqrt(x)))`
+    assert Z_opt_tt.owner.op == tt.sqrt
+    assert Z_opt_tt.owner.inputs[0].owner.inputs[1].owner.op == tt.sqrt
+
+    # Each relation only saw the (metatized) nodes with the `Op` it tracks
+    assert all(v.owner.op.obj == tt.exp for v in visited["exp"])
+    assert all(v.owner.op.obj == tt.log for v in visited["log"])
+    assert kanren_group.kanren_opts[0].stats["matches"] == 1
+    assert kanren_group.kanren_opts[1].stats["matches"] == 2
+    assert kanren_group.profile_stats()["matches"] == 3
+
+    # Untracked relations are tried on every node
+    kanren_group = KanrenRelationGroup([exp_to_log, no_match])
+    assert kanren_group.tracks() is None
+
+    exp_node = Z_tt.owner
+    assert kanren_group.candidates(exp_node) == kanren_group.kanren_opts
+    dot_node = Z_tt.owner.inputs[0].owner
+    assert kanren_group.candidates(dot_node) == kanren_group.kanren_opts[1:]
+
+    assert kanren_group.transform(dot_node) is False
+    assert len(visited["any"]) == 1
+
+    # Theano terms in `relation_lvars` are logic variables for the members,
+    # too, and the members get the same input as a lone `KanrenRelationSub`
+    y_tt = tt.vector("y")
+    lvar_inputs = []
+
+    @relation_tracks(mt.exp)
+    def exp_to_log_lvars(in_lv, out_lv):
+        lvar_inputs.append(in_lv)
+        return lall(eq(mt.exp(y_tt), in_lv), eq(out_lv, mt.log(y_tt)))
+
+    kanren_group = KanrenRelationGroup(
+        [KanrenRelationSub(log_to_sqrt), KanrenRelationSub(exp_to_log_lvars, relation_lvars=[y_tt])]
+    )
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    (res,) = kanren_group.transform(fgraph.outputs[0].owner)
+
+    assert res.owner.op == tt.log
+    assert res.owner.inputs[0] is fgraph.outputs[0].owner.inputs[0]
+    assert lvar_inputs == [fgraph.outputs[0]]
+    assert kanren_group.kanren_opts[1].stats["matches"] == 1
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_kanren_opt_results_cache():
+    """Make sure `KanrenRelationSub` reuses the results for structurally identical subgraphs."""
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    Z_tt = tt.exp(y_tt) + tt.exp(x_tt + 1) + tt.exp(x_tt + 1)
+
+    visited = []
+
+    def exp_to_log(in_lv, out_lv):
+        visited.append(in_lv)
+        y_lv = var()
+        return lall(eq(etuple(mt.exp, y_lv), etuplize(in_lv)), eq(out_lv, etuple(mt.log, y_lv)))
+
+    results_cache = InstrumentedLRUCache(100)
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=results_cache)
+    assert kanren_opt.results_cache is results_cache
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    Z_opt_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+
+    assert tt.log in [n.op for n in theano.gof.graph.ops(tt_inputs([Z_opt_tt]), [Z_opt_tt])]
+    assert tt.exp not in [n.op for n in theano.gof.graph.ops(tt_inputs([Z_opt_tt]), [Z_opt_tt])]
+
+    # One `exp(x + 1)` reused the search for the other, and the unchanged
+    # nodes reused their searches from the previous passes.
+    n_visited = len(visited)
+    assert kanren_opt.cache_info().hits > 0
+
+    # Optimizing (a copy of) the same graph again reuses the cached
+    # replacements.  Failed searches are only reused within the graph they
+    # were run in, so those are repeated.
+    Z_opt_2_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+    assert len(visited) > n_visited
+    assert all(v.owner.op != tt.exp for v in visited[n_visited:])
+    assert theano.scan_module.scan_utils.equal_computations(
+        [Z_opt_tt], [Z_opt_2_tt], tt_inputs([Z_opt_tt]), tt_inputs([Z_opt_2_tt])
+    )
+    n_visited = len(visited)
+
+    # The cache doesn't keep the optimized graphs alive
+    fgraph_opt = fgraph.clone()
+    fgraph_ref = weakref.ref(fgraph_opt)
+    kanren_eq_opt.optimize(fgraph_opt)
+    del fgraph_opt, visited[n_visited:]
+    gc.collect()
+    assert fgraph_ref() is None
+    assert results_cache.currsize > 0
+
+    # Caching is opt-in, and `True` gives each optimizer its own cache
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=True)
+    assert isinstance(kanren_opt.results_cache, InstrumentedLRUCache)
+    assert (
+        kanren_opt.results_cache
+        is not KanrenRelationSub(exp_to_log, results_cache=True).results_cache
+    )
+
+    kanren_opt = KanrenRelationSub(exp_to_log)
+    assert kanren_opt.results_cache is None
+    assert kanren_opt.cache_info() is None
+
+    kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    Z_opt_3_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+    assert len(visited) > n_visited
+    assert theano.scan_module.scan_utils.equal_computations(
+        [Z_opt_tt], [Z_opt_3_tt], tt_inputs([Z_opt_tt]), tt_inputs([Z_opt_3_tt])
+    )
+
+
+@relation_tracks(mt.exp)
+def named_exp_to_log(in_lv, out_lv):
+    y_lv = var()
+    return lall(
+        eq(mt.exp(y_lv, name="a"), in_lv),
+        eq(out_lv, etuple(mt.log, y_lv)),
+    )
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_kanren_opt_results_cache_names():
+    """Make sure cached results aren't reused for subgraphs that only differ by name."""
+    x_tt = tt.vector("x")
+    a_tt = tt.exp(x_tt + 1)
+    a_tt.name = "a"
+    d_tt = tt.exp(x_tt + 1)
+    d_tt.name = "d"
+    Z_tt = a_tt * d_tt
+
+    def optimize(results_cache):
+        fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+        kanren_opt = KanrenRelationSub(named_exp_to_log, results_cache=results_cache)
+        kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+        return optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+
+    for results_cache in (False, True):
+        Z_opt_tt = optimize(results_cache)
+        a_opt_tt, d_opt_tt = Z_opt_tt.owner.inputs
+        assert a_opt_tt.owner.op == tt.log
+        assert d_opt_tt.owner.op == tt.exp
+        assert d_opt_tt.name == "d"
+
+    # Subgraphs with colliding fingerprints aren't confused, either
+    fgraph = FunctionGraph([x_tt], [a_tt, tt.log(x_tt + 1)], clone=True)
+    fgraph.attach_feature(SubgraphFingerprints())
+    a_fg, log_fg = fgraph.outputs
+
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=True)
+    a_key = kanren_opt._cache_key(a_fg.owner, a_fg)
+    log_key = kanren_opt._cache_key(log_fg.owner, log_fg)
+    assert a_key == kanren_opt._cache_key(a_fg.owner, a_fg)
+    assert a_key[-1].detached() == a_key[-1]
+
+    log_key[-1].fingerprint = a_key[-1].fingerprint
+    assert hash(log_key) == hash(a_key)
+    assert log_key != a_key
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_incremental_optimizer():
+    """Make sure `IncrementalOptimizer` only considers the nodes that changed."""
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    Z_tt = tt.exp(x_tt) + tt.exp(y_tt)
+
+    visited = []
+
+    def exp_to_log(in_lv, out_lv):
+        visited.append(in_lv)
+        y_lv = var()
+        return lall(eq(etuple(mt.exp, y_lv), etuplize(in_lv)), eq(out_lv, etuple(mt.log, y_lv)))
+
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=False)
+    incr_opt = IncrementalOptimizer([kanren_opt])
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    incr_opt.optimize(fgraph)
+
+    assert isinstance(fgraph.node_changes, NodeChangeTracker)
+    assert tt.log in [n.op for n in fgraph.apply_nodes]
+    assert tt.exp not in [n.op for n in fgraph.apply_nodes]
+
+    # Nothing changed, so there's nothing to do
+    n_visited = len(visited)
+    incr_opt.optimize(fgraph)
+    assert len(visited) == n_visited
+
+    # Only the changed nodes and their clients are considered
+    x_fg = next(i for i in fgraph.inputs if i.name == "x")
+    y_fg = next(i for i in fgraph.inputs if i.name == "y")
+    log_x = next(n.outputs[0] for n in fgraph.apply_nodes if n.inputs == [x_fg])
+    log_y = next(n.outputs[0] for n in fgraph.apply_nodes if n.inputs == [y_fg])
+
+    fgraph.replace(log_x, tt.exp(x_fg) * x_fg)
+    incr_opt.optimize(fgraph)
+
+    assert len(visited) > n_visited
+    assert log_y not in visited[n_visited:]
+    assert tt.exp not in [n.op for n in fgraph.apply_nodes]
+
+    # Other consumers of the same changes aren't affected
+    tracker = fgraph.node_changes
+    assert set(tracker.pop_changed("other")) == fgraph.apply_nodes
+    assert tracker.pop_changed("other") == []
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_kanren_opt_budgets():
+    """Make sure `KanrenRelationSub` abandons searches that exceed their budgets."""
+    x_tt = tt.vector("x")
+    Z_tt = tt.exp(x_tt)
+
+    def endless_states(in_lv, out_lv):
+        def _goal(S):
+            while True:
+                yield S
+
+        return _goal
+
+    def nested_search(in_lv, out_lv):
+        def _goal(S):
+            # This (unbudgeted) search isn't counted by the budget of the
+            # search that runs it
+            assert len(run(0, out_lv, lany(*(eq(out_lv, i) for i in range(50))))) == 50
+            yield S
+
+        return _goal
+
+    def non_var_result(results):
+        return next((r for r in results if not isvar(r)), None)
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    (node,) = fgraph.apply_nodes
+
+    kanren_opt = KanrenRelationSub(
+        endless_states, results_filter=non_var_result, results_cache=False, max_steps=100
+    )
+    assert kanren_opt.transform(node) is False
+    assert kanren_opt.budget_exceeded == [BudgetExceededInfo(node, endless_states, "steps")]
+
+    kanren_opt = KanrenRelationSub(
+        endless_states, results_filter=non_var_result, results_cache=False, timeout=0.1
+    )
+    assert kanren_opt.transform(node) is False
+    assert kanren_opt.budget_exceeded == [BudgetExceededInfo(node, endless_states, "time")]
+
+    # Only the states taken from the search's goal stream are counted
+    kanren_opt = KanrenRelationSub(
+        nested_search, results_filter=non_var_result, results_cache=False, max_steps=10
+    )
+    assert kanren_opt.transform(node) is False
+    assert kanren_opt.budget_exceeded == []
+    assert kanren_opt.stats["budget_exceeded"] == 0
+
+    # Searches within their budgets aren't affected
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=False, max_steps=100, timeout=10)
+    assert kanren_opt.transform(node)[0].owner.op == tt.log
+    assert kanren_opt.budget_exceeded == []
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_kanren_opt_profile():
+    x_tt = tt.vector("x")
+    Z_tt = tt.exp(x_tt) + tt.exp(x_tt + 1)
+
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=False)
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+
+    kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+
+    stats = kanren_opt.profile_stats()
+    assert stats["calls"] > 0
+    assert stats["matches"] == 2
+    assert stats["runs"] == stats["calls"] - stats["skipped"] - stats["cache_hits"]
+    assert stats["results_consumed"] >= stats["matches"]
+    assert stats["run_time"] > 0
+    assert stats["reify_time"] > 0
+    assert stats["metatize_calls"] > 0
+    # Reifications are only counted while profiling
+    assert stats["meta_reify_calls"] == 0
+
+    stream = io.StringIO()
+    kanren_opt.print_profile(stream, (kanren_opt, stats))
+    assert "exp_to_log" in stream.getvalue()
+    assert "matches 2" in stream.getvalue()
+
+    # The statistics are added to the profiles of `EquilibriumOptimizer`s
+    kanren_opt.reset_stats()
+    kanren_eq_opt = KanrenEquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    fgraph_opt = fgraph.clone()
+
+    with theano.change_flags(profile_optimizer=True):
+        prof = kanren_eq_opt.optimize(fgraph_opt)
+
+    assert prof[0] is kanren_eq_opt
+    ((lopt, lopt_stats),) = prof[-1]
+    assert lopt is kanren_opt
+    assert lopt_stats == kanren_opt.profile_stats()
+    assert lopt_stats["matches"] == 2
+    assert lopt_stats["meta_reify_calls"] > 0
+
+    stream = io.StringIO()
+    kanren_eq_opt.print_profile(stream, prof)
+    assert "EquilibriumOptimizer" in stream.getvalue()
+    assert "KanrenRelationSub exp_to_log" in stream.getvalue()
+    assert "matches 2" in stream.getvalue()
+
+    merged_prof = kanren_eq_opt.merge_profile(prof, prof)
+    ((lopt, merged_stats),) = merged_prof[-1]
+    assert lopt is kanren_opt
+    assert merged_stats["matches"] == 4
+
+    stream = io.StringIO()
+    kanren_eq_opt.print_profile(stream, merged_prof)
+    assert "matches 4" in stream.getvalue()
+
+    # Global optimizers report the statistics collected while they ran
+    kanren_opt.reset_stats()
+    assert kanren_opt.profile_stats()["calls"] == 0
+
+    incr_opt = IncrementalOptimizer([kanren_opt])
+    fgraph_opt = fgraph.clone()
+    prof = incr_opt.optimize(fgraph_opt)
+
+    (opt, process_count, _, ((lopt, lopt_stats),)) = prof
+    assert opt is incr_opt
+    assert process_count == 2
+    assert lopt is kanren_opt
+    assert lopt_stats == kanren_opt.profile_stats()
+
+    stream = io.StringIO()
+    incr_opt.print_profile(stream, prof)
+    assert "IncrementalOptimizer" in stream.getvalue()
+    assert "KanrenRelationSub exp_to_log" in stream.getvalue()
+
+
+def exp_to_log(in_lv, out_lv):
+    y_lv = var()
+    return lall(eq(etuple(mt.exp, y_lv), etuplize(in_lv)), eq(out_lv, etuple(mt.log, y_lv)))
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_parallel_kanren_optimizer():
+    """Make sure `ParallelKanrenOptimizer` produces the same results as the serial optimizers."""
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    Z_tt = tt.exp(tt.exp(x_tt) + tt.exp(y_tt + 1)) * tt.exp(x_tt)
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=False)
+    kanren_eq_opt = EquilibriumOptimizer([kanren_opt], max_use_ratio=10)
+    Z_exp_tt = optimize_graph(fgraph, kanren_eq_opt, return_graph=False)
+
+    with ProcessPoolExecutor(2) as executor:
+        par_opt = ParallelKanrenOptimizer(kanren_opt, executor=executor, max_workers=2)
+        Z_opt_tt = optimize_graph(fgraph, par_opt, return_graph=False)
+
+    assert tt.exp not in [n.op for n in theano.gof.graph.ops(tt_inputs([Z_opt_tt]), [Z_opt_tt])]
+    assert theano.scan_module.scan_utils.equal_computations(
+        [Z_opt_tt], [Z_exp_tt], tt_inputs([Z_opt_tt]), tt_inputs([Z_exp_tt])
+    )
+
+    # The results cache is used and filled, too
+    results_cache = InstrumentedLRUCache(100)
+    kanren_opt = KanrenRelationSub(exp_to_log, results_cache=results_cache)
+
+    with ThreadPoolExecutor(2) as executor:
+        par_opt = ParallelKanrenOptimizer(kanren_opt, executor=executor, max_workers=2)
+        Z_opt_tt = optimize_graph(fgraph, par_opt, return_graph=False)
+        assert results_cache.currsize > 0
+
+        Z_opt_2_tt = optimize_graph(fgraph, par_opt, return_graph=False)
+        assert results_cache.hits > 0
+
+    assert theano.scan_module.scan_utils.equal_computations(
+        [Z_opt_tt], [Z_exp_tt], tt_inputs([Z_opt_tt]), tt_inputs([Z_exp_tt])
+    )
+    assert theano.scan_module.scan_utils.equal_computations(
+        [Z_opt_2_tt], [Z_exp_tt], tt_inputs([Z_opt_2_tt]), tt_inputs([Z_exp_tt])
+    )
+
+    # Only the candidates' subgraphs are serialized, not the entire graph
+    class PayloadExecutor(ThreadPoolExecutor):
+        payload_sizes = []
+
+        def submit(self, fn, *args, **kwargs):
+            self.payload_sizes.append(len(pickle.dumps(args[-1], -1)))
+            return super().submit(fn, *args, **kwargs)
+
+    W_tt = x_tt
+    for i in range(50):
+        W_tt = tt.log(W_tt + i)
+
+    fgraph = FunctionGraph(tt_inputs([Z_tt, W_tt]), [tt.exp(x_tt), W_tt], clone=True)
+    fgraph_size = len(pickle.dumps(fgraph, -1))
+
+    kanren_opt = KanrenRelationSub(exp_to_log, tracks=[mt.exp], results_cache=False)
+
+    with PayloadExecutor(1) as executor:
+        par_opt = ParallelKanrenOptimizer(kanren_opt, executor=executor, max_workers=1)
+        par_opt.optimize(fgraph)
+
+    assert fgraph.outputs[0].owner.op == tt.log
+    assert executor.payload_sizes
+    assert max(executor.payload_sizes) < fgraph_size / 10
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_subgraph_fingerprints():
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    a_tt = tt.exp(x_tt + 1)
+    b_tt = tt.exp(y_tt + 1)
+    c_tt = tt.exp(x_tt + 2)
+    d_tt = tt.exp(x_tt + 1)
+
+    fgraph = FunctionGraph([x_tt, y_tt], [a_tt, b_tt, c_tt, d_tt], clone=True)
+    fingerprints = SubgraphFingerprints()
+    fgraph.attach_feature(fingerprints)
+    assert fgraph.subgraph_fingerprints is fingerprints
+
+    a_tt, b_tt, c_tt, d_tt = fgraph.outputs
+    assert fingerprints.fingerprint(a_tt) == fingerprints.fingerprint(d_tt)
+    assert fingerprints.fingerprint(a_tt) != fingerprints.fingerprint(b_tt)
+    assert fingerprints.fingerprint(a_tt) != fingerprints.fingerprint(c_tt)
+
+    mapping = match_subgraphs(a_tt, d_tt)
+    assert mapping[a_tt] is d_tt
+    assert mapping[a_tt.owner.inputs[0]] is d_tt.owner.inputs[0]
+    assert match_subgraphs(a_tt, c_tt) is None
+
+    # The subgraphs' names are compared, too
+    assert match_subgraphs(a_tt, b_tt) is None
+    assert match_subgraphs(tt.exp(tt.vector() + 1), tt.exp(tt.vector() + 1)) is not None
+
+    # Changing an input invalidates the fingerprints of the descendants
+    fgraph.replace(a_tt.owner.inputs[0], b_tt.owner.inputs[0])
+    assert fingerprints.fingerprint(a_tt) == fingerprints.fingerprint(b_tt)
+    assert fingerprints.fingerprint(a_tt) != fingerprints.fingerprint(d_tt)
+
+
+def test_IndexedList():
+    lst = IndexedList([1, 2, 1])
+    assert lst.index(1) == 0
+    assert 3 not in lst
+
+    with pytest.raises(ValueError):
+        lst.index(3)
+
+    # Every occurrence is replaced
+    lst.replace(1, 3)
+    assert lst == [3, 2, 3]
+    assert 1 not in lst
+    assert lst.index(3) == 0
+    assert lst.positions == {3: [0, 2], 2: [1]}
+
+    with pytest.raises(ValueError):
+        lst.replace(1, 3)
+
+    # Replacing with an existing element merges their positions
+    lst.replace(2, 3)
+    assert lst == [3, 3, 3]
+    assert lst.positions == {3: [0, 1, 2]}
+
+    lst[:] = [3, 2, 1]
+    assert lst.positions == {3: [0], 2: [1], 1: [2]}
+
+    version = lst.version
+    lst.insert(0, 4)
+    assert lst.version > version
+    assert lst.index(3) == 1
+
+    lst.append(5)
+    assert lst.index(5) == 4
+
+    del lst[0]
+    assert lst.index(5) == 3
+
+    lst_copy = pickle.loads(pickle.dumps(lst))
+    assert lst_copy == lst
+    assert lst_copy.index(5) == 3
+
+    # Removals only shift the positions after the removed element
+    lst = IndexedList([1, 2, 3, 2, 4])
+    lst.positions
+    lst.remove(2)
+    assert lst == [1, 3, 2, 4]
+    assert lst.positions == {1: [0], 3: [1], 2: [2], 4: [3]}
+    assert lst.positions == IndexedList(lst).positions
+    lst.remove(1)
+    assert lst.positions == {3: [0], 2: [1], 4: [2]}
+
+    with pytest.raises(ValueError):
+        lst.remove(1)
+
+    # Unhashable elements are found by linear scans
+    lst = IndexedList([[1], 2, [3]])
+    assert [3] in lst
+    assert [4] not in lst
+    assert lst.index([3]) == 2
+    assert lst.index(2) == 1
+
+    lst.replace([1], 5)
+    assert lst == [5, 2, [3]]
+    assert lst.index(5) == 0
+
+    lst.remove([3])
+    lst.append([6])
+    assert lst == [5, 2, [6]]
+    assert lst.index([6]) == 2
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_FunctionGraph_replace_inputs():
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    z_tt = tt.vector("z")
+
+    fgraph = FunctionGraph([x_tt, y_tt], [x_tt + y_tt], clone=True)
+    x_fg, y_fg = fgraph.inputs
+    inputs = fgraph.inputs
+    assert isinstance(inputs, IndexedList)
+    assert isinstance(fgraph.clone().inputs, IndexedList)
+
+    fgraph.add_input(z_tt)
+    assert inputs.index(z_tt) == 2
+
+    # The replaced input takes the position of the old one, and its duplicate
+    # is removed
+    version = inputs.version
+    fgraph.replace(x_fg, z_tt)
+
+    assert fgraph.inputs is inputs
+    assert inputs.version > version
+    assert list(inputs) == [z_tt, y_fg]
+    assert x_fg not in inputs
+    assert inputs.index(y_fg) == 1
+
+    # The map of positions was updated, and not rebuilt
+    assert inputs._positions == {z_tt: [0], y_fg: [1]}
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_egraph():
+    x_tt = tt.vector("x")
+    y_tt = tt.vector("y")
+    exp_x_tt = tt.exp(x_tt)
+    exp_y_tt = tt.exp(y_tt)
+
+    egraph = EGraph()
+    exp_x_class = egraph.add(exp_x_tt)
+    exp_y_class = egraph.add(exp_y_tt)
+
+    # Structurally identical terms share their e-classes
+    assert egraph.add(tt.exp(x_tt)) == exp_x_class
+    assert egraph.add(tt.constant(np.r_[1.0])) == egraph.add(tt.constant(np.r_[1.0]))
+    assert exp_x_class != exp_y_class
+
+    # Merging `x` and `y` makes `exp(x)` and `exp(y)` congruent
+    assert egraph.union(egraph.add(x_tt), egraph.add(y_tt))
+    egraph.rebuild()
+    assert egraph.find(exp_x_class) == egraph.find(exp_y_class)
+    assert egraph.extract([exp_y_tt]) == [exp_x_tt]
+
+    # The cheapest equivalent term is extracted
+    log_exp_x_tt = tt.log(exp_x_tt)
+    egraph.union(egraph.add(log_exp_x_tt), egraph.add(x_tt))
+    egraph.rebuild()
+    assert egraph.extract([log_exp_x_tt]) == [x_tt]
+
+    # Variables in e-classes without a finite-cost e-node are returned as they are
+    egraph = EGraph()
+    x_class = egraph.add(x_tt)
+    egraph.union(x_class, egraph.add(exp_x_tt))
+    egraph.rebuild()
+
+    # Leave the e-class with only `exp(x)`, which refers to the e-class itself
+    x_enode = egraph._enode(x_tt)
+    del egraph.hashcons[x_enode], egraph.witnesses[x_enode]
+
+    assert egraph.find(x_class) not in egraph.costs()
+    assert egraph.extract([x_tt, exp_x_tt]) == [x_tt, exp_x_tt]
+
+
+@relation_tracks(mt.log)
+def log_exp(in_lv, out_lv):
+    return eq(etuple(mt.log, etuple(mt.exp, out_lv)), etuplize(in_lv))
+
+
+@relation_tracks(mt.log)
+def split_log(in_lv, out_lv):
+    y_lv = var()
+    log_sqrt_et = etuple(mt.log, etuple(mt.sqrt, y_lv))
+    return lall(
+        eq(etuple(mt.log, y_lv), etuplize(in_lv)),
+        eq(out_lv, etuple(mt.add, log_sqrt_et, log_sqrt_et)),
+    )
+
+
+@relation_tracks(mt.abs_)
+def abs_exp(in_lv, out_lv):
+    y_lv = var()
+    return lall(
+        eq(etuple(mt.abs_, etuple(mt.exp, y_lv)), etuplize(in_lv)), eq(out_lv, etuple(mt.exp, y_lv))
+    )
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_kanren_egraph_optimizer():
+    x_tt = tt.vector("x")
+    Z_tt = tt.log(tt.exp(x_tt))
+
+    # `split_log` is tried first and keeps producing larger graphs, but
+    # `log_exp` still finds the simplest one
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    egraph_opt = KanrenEGraphOptimizer([split_log, log_exp], max_iterations=3)
+    _, stats, lopt_profs = egraph_opt.optimize(fgraph)
+
+    assert fgraph.outputs[0] is fgraph.inputs[0]
+    assert stats["iterations"] == 3
+    assert not stats["saturated"]
+    assert stats["cost"] == 0
+    assert stats["replacements"] == 1
+    assert [lopt for lopt, _ in lopt_profs] == egraph_opt.kanren_opts
+    assert lopt_profs[0][1]["matches"] == 3
+
+    stream = io.StringIO()
+    egraph_opt.print_profile(stream, (egraph_opt, stats, lopt_profs))
+    assert "KanrenEGraphOptimizer" in stream.getvalue()
+
+    # The original graph is kept when it's the cheapest
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    Z_fg_tt = fgraph.outputs[0]
+    egraph_opt = KanrenEGraphOptimizer([split_log], max_iterations=2)
+    _, stats, _ = egraph_opt.optimize(fgraph)
+
+    assert fgraph.outputs[0] is Z_fg_tt
+    assert stats["replacements"] == 0
+    assert stats["eclasses"] > 3
+
+    # Saturation
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    egraph_opt = KanrenEGraphOptimizer([log_exp])
+
+    # Forms are only constructed for e-nodes and inputs that weren't searched
+    # in earlier iterations
+    built_forms = []
+    enode_form = egraph_opt._enode_form
+
+    def _enode_form(witness, inputs):
+        built_forms.append((witness, inputs))
+        return enode_form(witness, inputs)
+
+    egraph_opt._enode_form = _enode_form
+    _, stats, _ = egraph_opt.optimize(fgraph)
+
+    assert stats["saturated"]
+    assert stats["iterations"] == 2
+    assert fgraph.outputs[0] is fgraph.inputs[0]
+    assert len(built_forms) == len(set(built_forms)) == 3
+
+    # The e-nodes are matched in forms that use the other members of their
+    # input e-classes: `log(abs(exp(x)))` matches `log_exp` as `log(exp(x))`
+    Z_tt = tt.log(abs(tt.exp(x_tt)))
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    egraph_opt = KanrenEGraphOptimizer([abs_exp, log_exp])
+    _, stats, _ = egraph_opt.optimize(fgraph)
+
+    assert stats["saturated"]
+    assert fgraph.outputs[0] is fgraph.inputs[0]
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_graph_cost_model():
+    cost_model = GraphCostModel(default_dim_size=10)
+
+    x_tt = tt.vector("x")
+    A_tt = tt.matrix("A")
+    A_tt.tag.test_value = np.ones((3, 4))
+
+    assert cost_model.shape(x_tt) == (10,)
+    assert cost_model.shape(tt.row()) == (1, 10)
+    assert cost_model.shape(A_tt) == (3, 4)
+    assert cost_model.shape(tt.as_tensor_variable(np.ones((2, 5)))) == (2, 5)
+
+    assert cost_model.flops(A_tt.dot(x_tt).owner) == 2 * 3 * 4
+    assert cost_model(tt.exp(x_tt).owner) > cost_model((x_tt + x_tt).owner)
+
+    Z_tt = tt.exp(x_tt) * x_tt
+    assert cost_model.graph_cost([Z_tt]) == cost_model(Z_tt.owner) + cost_model(
+        Z_tt.owner.inputs[0].owner
+    )
+
+    # Sampling costs depend on the distribution
+    normal_tt = NormalRV(0, 1, size=[10])
+    gamma_tt = GammaRV(1, 1, size=[10])
+    mvnormal_tt = MvNormalRV(np.zeros(10), np.eye(10))
+    assert cost_model.flops(gamma_tt.owner) > cost_model.flops(normal_tt.owner)
+    assert cost_model.flops(mvnormal_tt.owner) > cost_model.flops(normal_tt.owner)
+
+
+@theano.change_flags(compute_test_value="ignore", cxx="", mode="FAST_COMPILE")
+def test_cheapest_result():
+    x_tt = tt.vector("x")
+
+    exp_exp_et = etuple(mt.exp, etuple(mt.exp, x_tt))
+    exp_et = etuple(mt.exp, x_tt)
+    log_et = etuple(mt.log, x_tt)
+    results = iter([exp_exp_et, exp_et, log_et])
+    res = cheapest_result(results, n=2)
+
+    # The cheapest result is returned in its reified form
+    assert isinstance(res, tt.Variable)
+    assert res.owner.op == tt.exp
+    assert res.owner.inputs[0] is x_tt
+    # Only the first `n` results are consumed
+    assert next(results) is log_et
+
+    assert cheapest_result(iter([])) is None
+
+    # Results are reified once
+    class CountingCostModel(GraphCostModel):
+        reified = 0
+
+        def reify_result(self, result):
+            self.reified += 1
+            return super().reify_result(result)
+
+    cost_model = CountingCostModel()
+    res = cheapest_result(iter([exp_exp_et, [(x_tt, exp_et)]]), cost_model=cost_model)
+
+    assert cost_model.reified == 2
+    assert res[0][0] is x_tt
+    assert isinstance(res[0][1], tt.Variable)
+
+    @relation_tracks(mt.exp)
+    def exp_forms(in_lv, out_lv):
+        y_lv = var()
+        return lall(
+            eq(etuple(mt.exp, y_lv), etuplize(in_lv)),
+            conde(
+                [eq(out_lv, etuple(mt.exp, etuple(mt.log, etuple(mt.exp, y_lv))))],
+                [eq(out_lv, etuple(mt.exp, y_lv))],
+            ),
+        )
+
+    Z_tt = tt.exp(x_tt)
+    fgraph = FunctionGraph(tt_inputs([Z_tt]), [Z_tt], clone=True)
+    node = fgraph.outputs[0].owner
+
+    kanren_opt = KanrenRelationSub(exp_forms, results_filter=cheapest_result, results_cache=False)
+    (new_out,) = kanren_opt.transform(node)
+
+    assert new_out.owner.op == tt.exp
+    assert new_out.owner.inputs[0] is fgraph.inputs[0]
+    assert kanren_opt.stats["results_consumed"] == 2
+
+
 @theano.change_flags(compute_test_value="warn", cxx="", mode="FAST_COMPILE")
 def test_push_out_rvs():
 
@@ -211,6 +1092,40 @@ def test_ScanArgs_basics():
     assert scan_args_copy != scan_args
 
 
+@theano.change_flags(compute_test_value="warn", cxx="", mode="FAST_COMPILE")
+def test_ScanArgs_field_index():
+    hmm_model_env = create_test_hmm()
+    scan_args = hmm_model_env["scan_args"]
+
+    test_v = scan_args.inner_in_seqs[1]
+    assert scan_args.find_among_fields(test_v).index == 1
+
+    # Changes made directly to the fields are reflected by the index
+    old_v = scan_args.inner_in_seqs.pop(0)
+    assert scan_args.find_among_fields(old_v) is None
+
+    field_info = scan_args.find_among_fields(test_v)
+    assert field_info.index == 0
+    assert scan_args.inner_inputs[field_info.agg_index] is test_v
+
+    new_v = test_v.clone()
+    scan_args.inner_in_non_seqs.append(new_v)
+    field_info = scan_args.find_among_fields(new_v)
+    assert field_info.name == "inner_in_non_seqs"
+    assert field_info.agg_index == len(scan_args.inner_inputs) - 1
+
+    # Copies have their own fields and indices
+    scan_args_copy = copy(scan_args)
+    scan_args_copy.inner_in_non_seqs.remove(new_v)
+    assert scan_args_copy.find_among_fields(new_v) is None
+    assert scan_args.find_among_fields(new_v) is not None
+
+    # The inner-graph dependencies are indexed, too
+    for out_n in scan_args.inner_outputs:
+        for i in tt_inputs([out_n]):
+            assert out_n in scan_args.inner_dependents[i]
+
+
 @theano.change_flags(compute_test_value="warn", cxx="", mode="FAST_COMPILE")
 def test_ScanArgs_basics_mit_sot():
 
@@ -265,6 +1180,11 @@ def test_ScanArgs_basics_mit_sot():
     scan_args = ScanArgs.from_node(Y_rv.owner)
 
     test_v = scan_args.inner_in_mit_sot[0][1]
+
+    # The nested fields can be searched like lists
+    assert scan_args.inner_in_mit_sot[0] in scan_args.inner_in_mit_sot
+    assert scan_args.inner_in_mit_sot.index(scan_args.inner_in_mit_sot[0]) == 0
+
     field_info = scan_args.find_among_fields(test_v)
 
     assert field_info.name == "inner_in_mit_sot"
@@ -892,3 +1812,72 @@ def test_convert_outer_out_to_in_hmm():
     exp_res = Y_logp.eval(test_point)
 
     assert np.array_equal(res, exp_res)
+
+
+@theano.change_flags(compute_test_value="warn", cxx="", mode="FAST_COMPILE")
+def test_convert_outer_outs_to_ins_hmm():
+    hmm_model_env = create_test_hmm()
+    input_scan_args = hmm_model_env["scan_args"]
+    M_tt = hmm_model_env["M_tt"]
+    N_tt = hmm_model_env["N_tt"]
+    mus_tt = hmm_model_env["mus_tt"]
+    rng_tt = hmm_model_env["rng_tt"]
+    rng_init_state = hmm_model_env["rng_init_state"]
+
+    test_point = {
+        M_tt: 2,
+        N_tt: 10,
+        mus_tt: mus_tt.tag.test_value,
+    }
+
+    rv_outer_outs = get_random_outer_outputs(input_scan_args)
+    rv_vars = [var for var_idx, var, io_var in rv_outer_outs]
+
+    # Sample values for all the `RandomVariable` outer-outputs
+    rng_tt.get_value(borrow=True).set_state(rng_init_state)
+    rv_obs = theano.function(list(test_point.keys()), rv_vars)(*test_point.values())
+
+    #
+    # Convert the `RandomVariable` outer-outputs one at a time...
+    #
+    exp_scan_args = input_scan_args
+    exp_oi_vars = []
+    for var in rv_vars:
+        exp_scan_args, new_oi_var = convert_outer_out_to_in(
+            exp_scan_args, var, inner_out_fn=create_inner_out_logp, output_scan_args=exp_scan_args
+        )
+        exp_oi_vars.append(new_oi_var)
+
+    #
+    # ...and all at once.
+    #
+    test_scan_args, test_oi_vars = convert_outer_outs_to_ins(
+        input_scan_args,
+        rv_vars,
+        inner_out_fn=create_inner_out_logp,
+        output_scan_args=input_scan_args,
+    )
+
+    assert len(test_oi_vars) == len(rv_vars)
+    assert test_scan_args is not input_scan_args
+    assert not any(v in test_scan_args.outer_outputs for v in rv_vars)
+    assert len(test_scan_args.inner_out_nit_sot) == len(exp_scan_args.inner_out_nit_sot)
+    assert len(test_scan_args.inner_in_seqs) == len(exp_scan_args.inner_in_seqs)
+    assert not test_scan_args.inner_in_sit_sot
+    assert not test_scan_args.inner_in_mit_sot
+
+    def eval_logps(scan_args, oi_vars):
+        scan_out = construct_scan(scan_args)
+        new_test_point = dict(test_point)
+        new_test_point.update(zip(oi_vars, rv_obs))
+        rng_tt.get_value(borrow=True).set_state(rng_init_state)
+        with theano.change_flags(on_unused_input="ignore"):
+            return theano.function(list(new_test_point.keys()), scan_out)(*new_test_point.values())
+
+    exp_res = eval_logps(exp_scan_args, exp_oi_vars)
+    res = eval_logps(test_scan_args, test_oi_vars)
+
+    assert len(res) == len(exp_res)
+    # The last output is the updated RNG, which is compared by its state
+    assert all(np.array_equal(r, e) for r, e in zip(res[:-1], exp_res[:-1]))
+    assert np.array_equal(res[-1].get_state()[1], exp_res[-1].get_state()[1])
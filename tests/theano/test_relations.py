@@ -15,16 +15,47 @@ from kanren import run, eq
 from kanren.core import lall
 from kanren.graph import reduceo, walko, applyo
 
-from symbolic_pymc.theano.meta import mt
+from symbolic_pymc.theano.meta import mt, TheanoMetaTensorType, TheanoMetaTensorVariable
 from symbolic_pymc.theano.opt import eval_and_reify_meta
 from symbolic_pymc.theano.random_variables import observed, NormalRV, HalfCauchyRV, MvNormalRV
 
+from symbolic_pymc.relations import term_key, DiscriminationTree, IndexedRelation
 from symbolic_pymc.relations.theano import non_obs_walko
 from symbolic_pymc.relations.theano.conjugates import conjugate
 from symbolic_pymc.relations.theano.distributions import scale_loc_transform, constant_neq
 from symbolic_pymc.relations.theano.linalg import normal_normal_regression, normal_qr_transform
 
 
+def test_term_key_meta():
+    # Ground meta objects are keyed structurally, so meta objects without base
+    # objects have the same keys as the ones with them
+    dvector_mt = mt(tt.dvector)
+    dvector_noobj_mt = TheanoMetaTensorType("float64", (False,), None)
+    assert dvector_mt != dvector_noobj_mt
+    assert term_key(dvector_mt) == term_key(dvector_noobj_mt)
+
+    x_mt = mt(tt.dvector("x"))
+    x_noobj_mt = TheanoMetaTensorVariable(dvector_noobj_mt, None, None, "x")
+    x_key, x_sub_terms = term_key(x_mt)
+    x_noobj_key, x_noobj_sub_terms = term_key(x_noobj_mt)
+    assert x_key == x_noobj_key
+    assert [term_key(t)[0] for t in x_sub_terms] == [term_key(t)[0] for t in x_noobj_sub_terms]
+
+    index = DiscriminationTree()
+    index.add((dvector_noobj_mt,), "dvector")
+    index.add((TheanoMetaTensorType("float32", (False,), None),), "fvector")
+    assert index.candidates((dvector_mt,)) == ["dvector"]
+
+    rel = IndexedRelation("test")
+    rel.add_fact(x_noobj_mt, "x")
+    rel.add_fact(etuple(mt.exp, x_noobj_mt), "exp_x")
+
+    q = var()
+    assert run(0, q, rel(x_mt, q)) == ("x",)
+    assert run(0, q, rel(etuplize(mt.exp(x_mt)), q)) == ("exp_x",)
+    assert not run(0, q, rel(etuplize(mt.log(x_mt)), q))
+
+
 def test_constant_neq():
     q_lv = var()
 